@@ -0,0 +1,176 @@
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Tuple
+
+# ==============================
+# PACOTES DE CENÁRIOS DE REGRESSÃO
+# ==============================
+#
+# Um pacote é um JSON:
+#
+#   {
+#     "name": "Pacote exemplo",
+#     "scenarios": [
+#       {
+#         "id": "amox-alergia-penicilina",
+#         "description": "...",
+#         "request": { ...payload de /api/clinical-check... },
+#         "expected": {"ITEM001": [{"type": "BLOCK", "layer": "alergia"}]}
+#       }
+#     ]
+#   }
+#
+# `expected` lista, por item, os alertas esperados (tipo + camada). Item
+# ausente de `expected` = nenhum alerta esperado. A mensagem não é comparada:
+# texto pode mudar sem que a decisão clínica mude.
+
+SCENARIOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios")
+
+PostFn = Callable[[Dict[str, Any]], Tuple[int, Any]]
+
+
+def list_packs(directory: str = SCENARIOS_DIR) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(f for f in os.listdir(directory) if f.endswith(".json"))
+
+
+def load_pack(filename: str, directory: str = SCENARIOS_DIR) -> Dict[str, Any]:
+    with open(os.path.join(directory, filename), encoding="utf-8") as f:
+        return parse_pack(f.read())
+
+
+def parse_pack(raw: str) -> Dict[str, Any]:
+    pack = json.loads(raw)
+    scenarios = pack.get("scenarios")
+    if not isinstance(scenarios, list) or not scenarios:
+        raise ValueError("Pacote sem cenários.")
+    seen = set()
+    for i, sc in enumerate(scenarios):
+        if "request" not in sc:
+            raise ValueError(f"Cenário #{i + 1} sem 'request'.")
+        sc.setdefault("id", f"cenario-{i + 1}")
+        sc.setdefault("expected", {})
+        if sc["id"] in seen:
+            raise ValueError(f"ID de cenário repetido: {sc['id']}")
+        seen.add(sc["id"])
+    return pack
+
+
+def save_pack(filename: str, pack: Dict[str, Any], directory: str = SCENARIOS_DIR) -> str:
+    name = os.path.basename(filename)
+    if not name.endswith(".json"):
+        name += ".json"
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+        json.dump(pack, f, ensure_ascii=False, indent=2)
+    return name
+
+
+# ==============================
+# COMPARAÇÃO
+# ==============================
+
+def _alert_key(alert: Dict[str, Any]) -> Tuple[str, str]:
+    return (alert.get("type", ""), alert.get("layer", ""))
+
+
+def diff_alerts(expected: Dict[str, List[Dict]], results: List[Dict]) -> List[Dict[str, Any]]:
+    """
+    Compara alertas obtidos x esperados, item a item (multiconjunto de
+    (type, layer)). Devolve a lista de divergências; vazia = passou.
+    """
+    got = {r["item"]: Counter(_alert_key(a) for a in r.get("alerts", [])) for r in results}
+    diffs = []
+    for item in sorted(set(got) | set(expected)):
+        want = Counter(_alert_key(a) for a in expected.get(item, []))
+        have = got.get(item, Counter())
+        missing = want - have
+        unexpected = have - want
+        if missing or unexpected:
+            diffs.append({
+                "item": item,
+                "faltando": [f"{t}/{l}" for t, l in sorted(missing.elements())],
+                "inesperado": [f"{t}/{l}" for t, l in sorted(unexpected.elements())],
+            })
+    return diffs
+
+
+# ==============================
+# EXECUÇÃO
+# ==============================
+
+def run_scenario(scenario: Dict[str, Any], post: PostFn) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        status, body = post(scenario["request"])
+    except Exception as e:
+        status, body = 0, str(e)
+    latency_ms = (time.perf_counter() - start) * 1000.0
+
+    result = {
+        "id": scenario["id"],
+        "description": scenario.get("description", ""),
+        "latency_ms": round(latency_ms, 1),
+        "status": status,
+        "diffs": [],
+        "error": None,
+    }
+    if status != 200 or not isinstance(body, dict):
+        result["outcome"] = "ERRO"
+        result["error"] = f"HTTP {status}: {body}"
+    elif body.get("degraded"):
+        # Resposta parcial (deadline): não dá para afirmar que passou
+        result["outcome"] = "ERRO"
+        result["error"] = f"Resposta degradada; itens não avaliados: {body.get('not_evaluated')}"
+    else:
+        result["diffs"] = diff_alerts(scenario["expected"], body.get("results", []))
+        result["outcome"] = "FALHOU" if result["diffs"] else "PASSOU"
+    return result
+
+
+def run_pack(
+    scenarios: List[Dict[str, Any]],
+    post: PostFn,
+    max_workers: int = 8,
+    on_result: Callable[[Dict[str, Any]], None] | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Executa os cenários em paralelo com no máximo `max_workers` requisições
+    simultâneas. Resultados voltam na ordem do pacote; `on_result` é chamado
+    (na thread de quem chamou) conforme cada cenário termina.
+    """
+    results: List[Dict[str, Any] | None] = [None] * len(scenarios)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(run_scenario, sc, post): i for i, sc in enumerate(scenarios)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if on_result:
+                on_result(results[i])
+    return results
+
+
+def summarize(results: List[Dict[str, Any]], wall_s: float) -> Dict[str, Any]:
+    outcomes = Counter(r["outcome"] for r in results)
+    latencies = sorted(r["latency_ms"] for r in results)
+
+    def pct(p: float) -> float:
+        if not latencies:
+            return 0.0
+        k = max(0, min(len(latencies) - 1, int(round(p * (len(latencies) - 1)))))
+        return latencies[k]
+
+    return {
+        "total": len(results),
+        "passou": outcomes.get("PASSOU", 0),
+        "falhou": outcomes.get("FALHOU", 0),
+        "erro": outcomes.get("ERRO", 0),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "max_ms": latencies[-1] if latencies else 0.0,
+        "wall_s": round(wall_s, 2),
+    }
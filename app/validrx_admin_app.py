@@ -1,8 +1,13 @@
 import json
+import time
 from typing import List, Dict, Any
 
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import regression
 
 # ==============================
 # Helpers
@@ -35,29 +40,126 @@ def list_to_str(values: List[str] | None) -> str:
     return ", ".join(values)
 
 
-def call_api(
+class ApiError(Exception):
+    pass
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    Sessão HTTP única por processo do Streamlit (keep-alive + pool de conexões).
+    Só GETs são repetidos automaticamente em caso de falha de conexão.
+    """
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.2, allowed_methods=frozenset(["GET"]))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def request_api(
     method: str,
     url: str,
     admin_key: str | None = None,
     payload: Dict[str, Any] | None = None,
+    params: Dict[str, Any] | None = None,
 ):
+    """
+    Chamada HTTP sem efeitos na UI: devolve o JSON ou levanta ApiError.
+    """
     try:
-        resp = requests.request(
+        resp = get_session().request(
             method=method,
             url=url,
             headers=get_headers(admin_key),
             data=json.dumps(payload) if payload is not None else None,
+            params=params,
             timeout=10,
         )
-        if resp.status_code >= 400:
-            st.error(f"Erro {resp.status_code}: {resp.text}")
-            return None
-        return resp.json()
-    except Exception as e:
-        st.error(f"Erro ao chamar API: {e}")
+    except requests.RequestException as e:
+        raise ApiError(f"Erro ao chamar API: {e}") from e
+    if resp.status_code >= 400:
+        raise ApiError(f"Erro {resp.status_code}: {resp.text}")
+    return resp.json()
+
+
+def call_api(
+    method: str,
+    url: str,
+    admin_key: str | None = None,
+    payload: Dict[str, Any] | None = None,
+):
+    try:
+        data = request_api(method, url, admin_key=admin_key, payload=payload)
+    except ApiError as e:
+        st.error(str(e))
+        return None
+    if method != "GET":
+        # Escrita: descarta leituras em cache e a versão memorizada da base
+        invalidate_reads()
+    return data
+
+
+@st.cache_data(ttl=2, show_spinner=False)
+def get_kb_version(base_url: str) -> int:
+    """
+    Versão da base de conhecimento, consultada no máximo a cada 2s.
+    """
+    try:
+        return request_api("GET", f"{base_url}/api/kb/version")["version"]
+    except ApiError:
+        return -1
+
+
+@st.cache_data(ttl=600, max_entries=256, show_spinner=False)
+def cached_get(url: str, admin_key: str | None, kb_version: int, params_json: str = "{}"):
+    """
+    GET em cache. `kb_version` entra na chave: quando a base muda,
+    as leituras antigas deixam de ser usadas.
+    """
+    return request_api("GET", url, admin_key=admin_key, params=json.loads(params_json))
+
+
+def get_cached(url: str, admin_key: str | None, params: Dict[str, Any] | None = None):
+    try:
+        return cached_get(
+            url, admin_key, get_kb_version(base_url), json.dumps(params or {}, sort_keys=True)
+        )
+    except ApiError as e:
+        st.error(str(e))
         return None
 
 
+def invalidate_reads():
+    get_kb_version.clear()
+    cached_get.clear()
+
+
+def drugs_to_rows(drugs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Achata os medicamentos para exibição em tabela."""
+    rows = []
+    for d in drugs:
+        ped = d.get("pediatria") or {}
+        rows.append({
+            "id": d["id"],
+            "nome": d["nome"],
+            "principio_ativo": d["principio_ativo"],
+            "classe_terapeutica": d["classe_terapeutica"],
+            "concentracao_mg_ml": d["concentracao_mg_ml"],
+            "min_idade_meses": d["min_idade_meses"],
+            "dose_max_diaria_adulto_mg": d["dose_max_diaria_adulto_mg"],
+            "vias_permitidas": list_to_str(d.get("vias_permitidas")),
+            "familias_alergia": list_to_str(d.get("familias_alergia")),
+            "contra_indicacoes": list_to_str(d.get("contra_indicacoes")),
+            "ped_modo": ped.get("modo", ""),
+            "ped_min": ped.get("min"),
+            "ped_max": ped.get("max"),
+            "ped_teto_dose": ped.get("teto_dose"),
+        })
+    return rows
+
+
 # ==============================
 # Layout geral
 # ==============================
@@ -103,12 +205,28 @@ with tab_meds:
     # ------- Listar -------
     with subtab_list:
         st.markdown("### 📋 Lista de Medicamentos")
-        if st.button("Carregar medicamentos", type="primary"):
-            url = f"{base_url}/api/admin/drugs"
-            data = call_api("GET", url, admin_key=admin_key)
-            if data and "drugs" in data:
-                st.success(f"{len(data['drugs'])} medicamentos encontrados.")
-                st.json(data["drugs"])
+
+        col_filter = st.columns([3, 1, 1])
+        with col_filter[0]:
+            drug_query = st.text_input(
+                "Buscar por ID, nome ou princípio ativo",
+                key="drug_list_query",
+            )
+        with col_filter[1]:
+            page_size = st.selectbox("Por página", options=[25, 50, 100, 200], index=1)
+        with col_filter[2]:
+            page = st.number_input("Página", min_value=1, value=1, step=1, key="drug_list_page")
+
+        # Paginação e busca feitas no servidor: só a página atual trafega
+        params = {"offset": (int(page) - 1) * page_size, "limit": page_size}
+        if drug_query:
+            params["q"] = drug_query
+        data = get_cached(f"{base_url}/api/admin/drugs", admin_key, params)
+        if data and "drugs" in data:
+            total = data.get("total", len(data["drugs"]))
+            pages = max(1, -(-total // page_size))
+            st.caption(f"{total} medicamentos encontrados · página {int(page)} de {pages}")
+            st.dataframe(drugs_to_rows(data["drugs"]), use_container_width=True, hide_index=True)
 
         st.markdown("### 🔍 Buscar medicamento por ID")
         search_id = st.text_input("ID do medicamento para buscar", key="search_drug_id")
@@ -117,7 +235,7 @@ with tab_meds:
                 st.warning("Informe o ID do medicamento.")
             else:
                 url = f"{base_url}/api/admin/drugs/{search_id}"
-                data = call_api("GET", url, admin_key=admin_key)
+                data = get_cached(url, admin_key)
                 if data:
                     st.json(data)
 
@@ -166,7 +284,7 @@ with tab_meds:
         with col_lists[1]:
             contras_str = st.text_area(
                 "Contra-indicações",
-                placeholder="insuficiência renal, mononucleose",
+                placeholder="insuficiência renal, mononucleose, B27, J00-J06",
             )
         with col_lists[2]:
             vias_str = st.text_area(
@@ -252,7 +370,7 @@ with tab_interactions:
         st.markdown("### 📋 Lista de Interações")
         if st.button("Carregar interações", type="primary"):
             url = f"{base_url}/api/admin/interactions"
-            data = call_api("GET", url, admin_key=admin_key)
+            data = get_cached(url, admin_key)
             if data and "interactions" in data:
                 st.success(f"{len(data['interactions'])} interações encontradas.")
                 st.json(data["interactions"])
@@ -383,5 +501,145 @@ with tab_clinical:
         url = f"{base_url}/api/clinical-check"
         data = call_api("POST", url, admin_key=None, payload=payload)
         if data:
+            st.session_state["last_clinical_test"] = {"request": payload, "response": data}
             st.success("✅ Resposta da engine clínica:")
             st.json(data)
+
+# ==============================
+# TESTE CLÍNICO: REGRESSÃO EM LOTE
+# ==============================
+
+def post_clinical_check(payload: Dict[str, Any]):
+    """POST thread-safe usado pelos workers da regressão (sessão compartilhada)."""
+    resp = get_session().post(f"{base_url}/api/clinical-check", json=payload, timeout=30)
+    try:
+        body = resp.json()
+    except ValueError:
+        body = resp.text
+    return resp.status_code, body
+
+
+with tab_clinical:
+    st.markdown("---")
+    st.subheader("Regressão - pacotes de cenários")
+    st.markdown(
+        "Roda um pacote de cenários salvos contra `/api/clinical-check` e compara "
+        "os alertas (tipo + camada) com os esperados. Use antes de publicar uma mudança na base."
+    )
+
+    packs = regression.list_packs()
+
+    with st.expander("📥 Importar / salvar pacote"):
+        uploaded = st.file_uploader("Pacote de cenários (.json)", type=["json"])
+        if uploaded is not None and st.button("Salvar pacote"):
+            try:
+                pack = regression.parse_pack(uploaded.getvalue().decode("utf-8"))
+                saved = regression.save_pack(uploaded.name, pack)
+                st.success(f"Pacote salvo como {saved} ({len(pack['scenarios'])} cenários).")
+                packs = regression.list_packs()
+            except (ValueError, UnicodeDecodeError) as e:
+                st.error(f"Pacote inválido: {e}")
+
+        last_test = st.session_state.get("last_clinical_test")
+        if last_test and packs:
+            st.markdown("**Adicionar o último teste rápido a um pacote**")
+            st.caption("Os alertas devolvidos agora viram o resultado esperado do cenário.")
+            col_add = st.columns(2)
+            with col_add[0]:
+                target_pack = st.selectbox("Pacote de destino", options=packs, key="add_target_pack")
+            with col_add[1]:
+                new_id = st.text_input("ID do cenário", key="add_scenario_id")
+            if st.button("Adicionar cenário"):
+                if not new_id:
+                    st.warning("Informe o ID do cenário.")
+                else:
+                    pack = regression.load_pack(target_pack)
+                    if any(sc["id"] == new_id for sc in pack["scenarios"]):
+                        st.error(f"Já existe um cenário {new_id} em {target_pack}.")
+                    else:
+                        pack["scenarios"].append({
+                            "id": new_id,
+                            "request": last_test["request"],
+                            "expected": {
+                                r["item"]: [{"type": a["type"], "layer": a["layer"]} for a in r["alerts"]]
+                                for r in last_test["response"].get("results", [])
+                                if r["alerts"]
+                            },
+                        })
+                        regression.save_pack(target_pack, pack)
+                        st.success(f"Cenário {new_id} adicionado a {target_pack}.")
+
+    if not packs:
+        st.info(f"Nenhum pacote em {regression.SCENARIOS_DIR}.")
+    else:
+        col_run = st.columns([3, 1])
+        with col_run[0]:
+            pack_name = st.selectbox("Pacote", options=packs)
+        with col_run[1]:
+            # Limitado ao pool de conexões da sessão HTTP (pool_maxsize=16)
+            workers = st.number_input("Paralelismo", min_value=1, max_value=16, value=8, step=1)
+
+        pack = regression.load_pack(pack_name)
+        st.caption(f"{len(pack['scenarios'])} cenários · {pack.get('description', '')}")
+
+        if st.button("▶️ Rodar regressão", type="primary"):
+            progress = st.progress(0.0, text="Executando cenários...")
+            done = []
+
+            def on_result(result):
+                done.append(result)
+                progress.progress(
+                    len(done) / len(pack["scenarios"]),
+                    text=f"{len(done)}/{len(pack['scenarios'])} cenários",
+                )
+
+            start = time.perf_counter()
+            results = regression.run_pack(
+                pack["scenarios"], post_clinical_check, max_workers=int(workers), on_result=on_result
+            )
+            summary = regression.summarize(results, time.perf_counter() - start)
+            st.session_state["regression_run"] = {"pack": pack_name, "results": results, "summary": summary}
+
+        run = st.session_state.get("regression_run")
+        if run and run["pack"] == pack_name:
+            summary = run["summary"]
+            cols = st.columns(5)
+            cols[0].metric("Passou", summary["passou"])
+            cols[1].metric("Falhou", summary["falhou"])
+            cols[2].metric("Erro", summary["erro"])
+            cols[3].metric("p95 (ms)", summary["p95_ms"])
+            cols[4].metric("Tempo total (s)", summary["wall_s"])
+
+            only_failures = st.checkbox("Mostrar só falhas e erros", value=True)
+            rows = [
+                {
+                    "cenário": r["id"],
+                    "resultado": r["outcome"],
+                    "latência (ms)": r["latency_ms"],
+                    "HTTP": r["status"],
+                    "descrição": r["description"],
+                }
+                for r in run["results"]
+                if not only_failures or r["outcome"] != "PASSOU"
+            ]
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+
+            for r in run["results"]:
+                if r["outcome"] == "PASSOU":
+                    continue
+                with st.expander(f"{r['outcome']} · {r['id']}"):
+                    if r["error"]:
+                        st.error(r["error"])
+                    for d in r["diffs"]:
+                        st.markdown(f"**Item {d['item']}**")
+                        if d["faltando"]:
+                            st.markdown(f"- faltando: `{', '.join(d['faltando'])}`")
+                        if d["inesperado"]:
+                            st.markdown(f"- inesperado: `{', '.join(d['inesperado'])}`")
+
+            st.download_button(
+                "Baixar resultados (JSON)",
+                data=json.dumps(run, ensure_ascii=False, indent=2),
+                file_name=f"regressao_{pack_name}",
+                mime="application/json",
+            )
@@ -0,0 +1,450 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Gerador de carga do ValidRx.
+
+Dispara tráfego realista contra uma API local (`uvicorn src.api:app`),
+com payloads de /api/clinical-check nos formatos Tasy e MV (ver README),
+opcionalmente misturados com escritas administrativas.
+
+Modos:
+  closed  -> N workers concorrentes, cada um envia a próxima requisição
+             assim que recebe a resposta.
+  open    -> chegadas em taxa fixa (Poisson), independentes das respostas.
+             A latência é medida a partir do horário agendado, evitando
+             "coordinated omission".
+  sweep   -> executa o modo open em taxas crescentes até violar o SLO
+             e informa o ponto de saturação.
+
+Exemplos:
+  python loadtest/validrx_loadtest.py closed --concurrency 32 --duration 30
+  python loadtest/validrx_loadtest.py open --rate 200 --duration 30
+  python loadtest/validrx_loadtest.py sweep --start-rate 50 --step 50 --slo-p99-ms 250
+  python loadtest/validrx_loadtest.py open --payloads gravados.ndjson --admin-ratio 0.02
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# ======================================
+# 1. Geração de payloads
+# ======================================
+
+# Rotas como chegam de cada sistema (Tasy descritivo, MV em siglas)
+TASY_ROUTES = ["Endovenosa (IV)", "Intramuscular (IM)", "Oral", "Subcutânea"]
+MV_ROUTES = ["EV", "IM", "VO", "SC"]
+
+TASY_CONDITIONS = ["tosse seca", "asma", "febre", "mononucleose", "parada_cardiaca"]
+MV_CONDITIONS = ["J00", "J45", "R50", "B27", "I46"]
+
+ALLERGIES = ["penicilina", "aines", "sulfa"]
+
+FIRST_NAMES = ["João", "Ana", "Maria", "Pedro", "Clara", "Lucas", "Beatriz"]
+LAST_NAMES = ["da Silva", "Souza", "Oliveira", "Santos", "Pereira"]
+
+
+def _patient(rng: random.Random, style: str) -> Dict[str, Any]:
+    # Mistura realista: maioria pediátrica, parte adulta
+    age_months = rng.choice([rng.randint(1, 143), rng.randint(1, 143), rng.randint(144, 1000)])
+    weight = round(max(3.0, min(age_months * 0.25 + rng.uniform(2, 6), 110.0)), 1)
+    conditions_pool = MV_CONDITIONS if style == "mv" else TASY_CONDITIONS
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+    return {
+        "cd_pessoa_fisica": f"{'MV' if style == 'mv' else 'PAC'}-{rng.randint(1, 999999)}",
+        "nm_paciente": name.upper() if style == "mv" else name,
+        "nr_atendimento": str(rng.randint(100000, 999999)),
+        "weight_kg": weight,
+        "age_months": age_months,
+        "conditions": rng.sample(conditions_pool, rng.randint(0, 2)),
+        "allergies": rng.sample(ALLERGIES, rng.choice([0, 0, 0, 1])),
+        "current_meds": [],
+    }
+
+
+def synthetic_clinical_request(
+    rng: random.Random, drugs: List[Dict[str, Any]], style: str
+) -> Dict[str, Any]:
+    """
+    Monta um ClinicalRequest sintético no formato Tasy ou MV.
+    Usa os medicamentos reais da base para que a engine percorra todas as camadas.
+    """
+    patient = _patient(rng, style)
+    if drugs and rng.random() < 0.3:
+        patient["current_meds"] = [rng.choice(drugs)["id"]]
+
+    items = []
+    for n in range(1, rng.choice([1, 1, 2, 3, 5]) + 1):
+        drug = rng.choice(drugs)
+        if style == "mv":
+            route = rng.choice(MV_ROUTES)
+            nm = drug["nome"].upper()
+            unidade = rng.choice(["AMP", "ML", "MG"])
+        else:
+            route = rng.choice(TASY_ROUTES)
+            nm = drug["nome"]
+            unidade = rng.choice(["ml", "mg"])
+
+        items.append({
+            "cd_item_prescricao": str(n),
+            "ean_codigo": f"789{rng.randint(100000000, 999999999)}",
+            "nm_medicamento": nm,
+            "dose_input": round(rng.uniform(0.1, 10.0), 2),
+            "dose_unidade": unidade,
+            "route": route,
+            "freq_hours": rng.choice([4, 6, 8, 12, 24]),
+            "drug_id": drug["id"],
+        })
+
+    return {
+        "cd_medico": f"CRM-{rng.randint(1000, 99999)}" if style == "tasy" else str(rng.randint(1000, 99999)),
+        "patient": patient,
+        "items": items,
+    }
+
+
+def synthetic_admin_drug(rng: random.Random) -> Dict[str, Any]:
+    """Upsert administrativo sobre um conjunto pequeno de IDs LOADTEST_*."""
+    n = rng.randint(1, 20)
+    return {
+        "id": f"LOADTEST_{n:03d}",
+        "nome": f"Medicamento de Carga {n}",
+        "principio_ativo": f"substancia_carga_{n}",
+        "classe_terapeutica": "teste_carga",
+        "familias_alergia": [],
+        "concentracao_mg_ml": 10.0,
+        "min_idade_meses": 0,
+        "dose_max_diaria_adulto_mg": 1000.0,
+        "contra_indicacoes": [],
+        "vias_permitidas": ["Oral"],
+        "pediatria": {"modo": "mg_kg_dia", "min": 10.0, "max": 20.0, "teto_dose": 0},
+    }
+
+
+def load_recorded(path: str) -> List[Dict[str, Any]]:
+    """
+    Lê payloads gravados (um ClinicalRequest JSON por linha).
+    Linhas vazias e comentários (#) são ignorados.
+    """
+    payloads = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            record = json.loads(line)
+            # Aceita tanto o payload puro quanto {"request": {...}}
+            payloads.append(record.get("request", record))
+    return payloads
+
+
+class Workload:
+    """
+    Produz a sequência de requisições (método, caminho, corpo, tipo).
+    """
+
+    def __init__(
+        self,
+        drugs: List[Dict[str, Any]],
+        recorded: Optional[List[Dict[str, Any]]],
+        mv_ratio: float,
+        admin_ratio: float,
+        seed: int,
+    ):
+        self.rng = random.Random(seed)
+        self.drugs = drugs
+        self.recorded = itertools.cycle(recorded) if recorded else None
+        self.mv_ratio = mv_ratio
+        self.admin_ratio = admin_ratio
+
+    def next_request(self):
+        if self.admin_ratio and self.rng.random() < self.admin_ratio:
+            return "POST", "/api/admin/drugs", synthetic_admin_drug(self.rng), "admin"
+
+        if self.recorded is not None:
+            return "POST", "/api/clinical-check", next(self.recorded), "clinical"
+
+        style = "mv" if self.rng.random() < self.mv_ratio else "tasy"
+        body = synthetic_clinical_request(self.rng, self.drugs, style)
+        return "POST", "/api/clinical-check", body, "clinical"
+
+
+# ======================================
+# 2. Coleta de resultados
+# ======================================
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil por nearest-rank sobre uma lista já ordenada."""
+    if not sorted_values:
+        return 0.0
+    k = math.ceil(pct / 100.0 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(k, len(sorted_values) - 1))]
+
+
+@dataclass
+class Stats:
+    latencies: Dict[str, List[float]] = field(default_factory=dict)
+    statuses: Dict[str, int] = field(default_factory=dict)
+    errors: int = 0
+    dropped: int = 0
+    elapsed: float = 0.0
+    offered_rate: Optional[float] = None
+
+    def record(self, kind: str, latency: float, status: str, ok: bool):
+        self.latencies.setdefault(kind, []).append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self) -> Dict[str, Any]:
+        total = sum(len(v) for v in self.latencies.values())
+        out = {
+            "requests": total,
+            "elapsed_s": round(self.elapsed, 3),
+            "throughput_rps": round(total / self.elapsed, 2) if self.elapsed else 0.0,
+            "error_rate": round(self.errors / total, 4) if total else 0.0,
+            "dropped": self.dropped,
+            "statuses": dict(sorted(self.statuses.items())),
+            "by_kind": {},
+        }
+        if self.offered_rate is not None:
+            out["offered_rps"] = self.offered_rate
+
+        all_lat = []
+        for kind, values in self.latencies.items():
+            values.sort()
+            all_lat.extend(values)
+            out["by_kind"][kind] = _latency_summary(values)
+        all_lat.sort()
+        out.update(_latency_summary(all_lat))
+        return out
+
+
+def _latency_summary(values: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round((values[-1] if values else 0.0) * 1000, 2),
+    }
+
+
+# ======================================
+# 3. Execução
+# ======================================
+
+async def _send(client: httpx.AsyncClient, workload_item, admin_key, stats: Stats, started_at: float):
+    method, path, body, kind = workload_item
+    headers = {"X-Admin-Key": admin_key} if kind == "admin" and admin_key else None
+    try:
+        resp = await client.request(method, path, json=body, headers=headers)
+        ok = resp.status_code < 400
+        status = str(resp.status_code)
+    except httpx.HTTPError as e:
+        ok = False
+        status = type(e).__name__
+    stats.record(kind, time.perf_counter() - started_at, status, ok)
+
+
+async def run_closed(client, workload: Workload, concurrency: int, duration: float, admin_key) -> Stats:
+    stats = Stats()
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await _send(client, workload.next_request(), admin_key, stats, time.perf_counter())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+async def run_open(
+    client, workload: Workload, rate: float, duration: float, admin_key, max_in_flight: int
+) -> Stats:
+    """
+    Chegadas de Poisson na taxa `rate` (req/s). Se o número de requisições
+    pendentes passar de `max_in_flight`, a chegada é contada como descartada
+    (o gerador também tem limite; isso evita medir o próprio cliente).
+    """
+    stats = Stats(offered_rate=rate)
+    rng = random.Random(workload.rng.random())
+    in_flight = set()
+
+    start = time.perf_counter()
+    next_at = start
+    end = start + duration
+    while next_at < end:
+        now = time.perf_counter()
+        if next_at > now:
+            await asyncio.sleep(next_at - now)
+
+        if len(in_flight) >= max_in_flight:
+            stats.dropped += 1
+        else:
+            task = asyncio.create_task(
+                _send(client, workload.next_request(), admin_key, stats, next_at)
+            )
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        next_at += rng.expovariate(rate)
+
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+async def run_sweep(client, workload: Workload, args) -> Dict[str, Any]:
+    """
+    Aumenta a taxa até que p99 passe do SLO, a taxa de erro passe do limite
+    ou o gerador comece a descartar chegadas. Como a latência é medida a
+    partir do horário agendado, fila acumulada no servidor aparece no p99.
+    """
+    steps = []
+    saturation = None
+    rate = args.start_rate
+    while rate <= args.max_rate:
+        stats = await run_open(client, workload, rate, args.duration, args.admin_key, args.max_in_flight)
+        summary = stats.summary()
+        steps.append(summary)
+        _print_summary(f"sweep @ {rate:g} req/s", summary)
+
+        violated = (
+            summary["p99_ms"] > args.slo_p99_ms
+            or summary["error_rate"] > args.max_error_rate
+            or summary["dropped"] > 0
+        )
+        if violated:
+            break
+        saturation = rate
+        rate += args.step
+
+    return {"saturation_rps": saturation, "steps": steps}
+
+
+async def fetch_drugs(client: httpx.AsyncClient) -> List[Dict[str, Any]]:
+    resp = await client.get("/api/drugs")
+    resp.raise_for_status()
+    drugs = resp.json().get("drugs", [])
+    # Medicamentos criados pelo próprio teste não entram no sorteio clínico
+    return [d for d in drugs if not d["id"].startswith("LOADTEST_")]
+
+
+async def cleanup_admin(client: httpx.AsyncClient, admin_key: str):
+    for n in range(1, 21):
+        await client.delete(f"/api/admin/drugs/LOADTEST_{n:03d}", headers={"X-Admin-Key": admin_key})
+
+
+def _print_summary(title: str, summary: Dict[str, Any]):
+    print(f"\n=== {title} ===")
+    print(
+        f"req={summary['requests']}  vazão={summary['throughput_rps']} req/s  "
+        f"erros={summary['error_rate'] * 100:.2f}%  descartadas={summary['dropped']}"
+    )
+    print(
+        f"p50={summary['p50_ms']}ms  p95={summary['p95_ms']}ms  "
+        f"p99={summary['p99_ms']}ms  max={summary['max_ms']}ms"
+    )
+    for kind, s in summary["by_kind"].items():
+        print(f"  [{kind}] n={s['count']} p50={s['p50_ms']}ms p95={s['p95_ms']}ms p99={s['p99_ms']}ms")
+    print(f"  status: {summary['statuses']}")
+
+
+async def main_async(args):
+    limits = httpx.Limits(
+        max_connections=args.max_connections,
+        max_keepalive_connections=args.max_connections,
+    )
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        drugs = await fetch_drugs(client)
+        recorded = load_recorded(args.payloads) if args.payloads else None
+        if not drugs and not recorded:
+            raise SystemExit("Nenhum medicamento na base e nenhum payload gravado informado.")
+
+        admin_ratio = args.admin_ratio if args.admin_key else 0.0
+        workload = Workload(drugs, recorded, args.mv_ratio, admin_ratio, args.seed)
+
+        # Aquecimento (conexões, caches, JIT do SQLAlchemy)
+        if args.warmup > 0:
+            await run_closed(client, workload, min(args.concurrency, 8), args.warmup, args.admin_key)
+
+        try:
+            if args.mode == "closed":
+                stats = await run_closed(client, workload, args.concurrency, args.duration, args.admin_key)
+                result = stats.summary()
+                _print_summary(f"closed-loop, {args.concurrency} workers", result)
+            elif args.mode == "open":
+                stats = await run_open(
+                    client, workload, args.rate, args.duration, args.admin_key, args.max_in_flight
+                )
+                result = stats.summary()
+                _print_summary(f"open-loop @ {args.rate:g} req/s", result)
+            else:
+                result = await run_sweep(client, workload, args)
+                print(f"\nPonto de saturação (último passo dentro do SLO): {result['saturation_rps']} req/s")
+        finally:
+            if admin_ratio:
+                await cleanup_admin(client, args.admin_key)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2, ensure_ascii=False)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Gerador de carga do ValidRx")
+    parser.add_argument("mode", choices=["closed", "open", "sweep"])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--duration", type=float, default=30.0, help="segundos por execução/passo")
+    parser.add_argument("--warmup", type=float, default=3.0, help="segundos de aquecimento")
+    parser.add_argument("--concurrency", type=int, default=16, help="workers no modo closed")
+    parser.add_argument("--rate", type=float, default=100.0, help="req/s no modo open")
+    parser.add_argument("--start-rate", type=float, default=50.0)
+    parser.add_argument("--step", type=float, default=50.0)
+    parser.add_argument("--max-rate", type=float, default=5000.0)
+    parser.add_argument("--slo-p99-ms", type=float, default=250.0)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--max-in-flight", type=int, default=2000)
+    parser.add_argument("--max-connections", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--payloads", help="arquivo NDJSON com ClinicalRequests gravados")
+    parser.add_argument("--mv-ratio", type=float, default=0.5, help="fração de payloads no formato MV")
+    parser.add_argument("--admin-ratio", type=float, default=0.0, help="fração de escritas admin")
+    parser.add_argument("--admin-key", help="X-Admin-Key (necessária para escritas admin)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json-out", help="salva o resultado em JSON")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
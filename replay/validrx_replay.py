@@ -0,0 +1,406 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replay da auditoria do ValidRx: impacto de uma mudança na base.
+
+Relê as checagens clínicas gravadas pela auditoria (tabela
+auditoria_checagem ou segmentos .ndjson.gz) e avalia cada uma contra duas
+bases de conhecimento: a atual e uma candidata (outro banco ou um snapshot
+JSON editado). Informa quantas prescrições mudariam entre OK, WARNING e
+BLOCK, quais códigos de alerta aparecem/somem e exemplos de cada mudança.
+
+A avaliação roda num pool de processos: cada worker compila as duas bases
+uma vez e recebe os registros em lotes, então o custo por registro é só
+o da engine (sem rede, sem banco).
+
+Exemplos:
+  # snapshot da base atual para editar (ex: mudar um limite de Pediatria)
+  python replay/validrx_replay.py snapshot --db $DATABASE_URL -o candidata.json
+
+  python replay/validrx_replay.py run --audit-db $DATABASE_URL --candidate-snapshot candidata.json
+  python replay/validrx_replay.py run --audit-ndjson 'audit/*.ndjson.gz' \\
+      --current-db $DATABASE_URL --candidate-db postgresql://.../validrx_homolog --workers 8
+"""
+
+import argparse
+import glob
+import gzip
+import itertools
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # raiz do projeto
+
+from sqlalchemy import Text, cast, create_engine, select  # noqa: E402
+from sqlalchemy.orm import selectinload, sessionmaker  # noqa: E402
+
+from src.audit import DECISION_RANK  # noqa: E402
+from src.database import (  # noqa: E402
+    AuditoriaChecagem,
+    DatabaseManager,
+    FormularioLocal,
+    Interacao,
+    InteracaoLocal,
+    Medicamento,
+    ReatividadeCruzada,
+    VersaoBase,
+)
+from src.knowledge_base import KnowledgeBase  # noqa: E402
+from src.normalization import normalize_route  # noqa: E402
+
+# ======================================
+# 1. Bases de conhecimento
+# ======================================
+
+def snapshot_from_db(url: str) -> dict:
+    """Lê a base de um banco qualquer (sem criar tabelas nem semear dados)."""
+    engine = create_engine(url)
+    Session = sessionmaker(bind=engine)
+    try:
+        with Session() as db:
+            drugs = {
+                d.id: DatabaseManager._drug_to_dict(d)
+                for d in db.query(Medicamento).options(selectinload(Medicamento.pediatria))
+            }
+            interactions = [
+                {"pair": {i.substancia_a, i.substancia_b}, "level": i.nivel, "msg": i.mensagem}
+                for i in db.query(Interacao)
+            ]
+            cross = [
+                {"from": e.familia_alergia, "to": e.familia_reativa, "note": e.nota}
+                for e in db.query(ReatividadeCruzada).order_by(ReatividadeCruzada.id)
+            ]
+            overrides = {}
+            for o in db.query(FormularioLocal):
+                overrides.setdefault(o.tenant, {"drugs": {}, "interactions": []})["drugs"][o.medicamento_id] = o.campos
+            for i in db.query(InteracaoLocal).order_by(InteracaoLocal.id):
+                overrides.setdefault(i.tenant, {"drugs": {}, "interactions": []})["interactions"].append(
+                    {"pair": {i.substancia_a, i.substancia_b}, "level": i.nivel, "msg": i.mensagem}
+                )
+            row = db.get(VersaoBase, 1)
+            version = row.versao if row else 0
+    finally:
+        engine.dispose()
+    return KnowledgeBase(version, drugs, interactions, cross, overrides).to_snapshot()
+
+
+def load_snapshot(path: str) -> dict:
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+# ======================================
+# 2. Leitura da auditoria
+# ======================================
+
+def iter_audit_db(url: str, since: Optional[str], until: Optional[str], batch: int) -> Iterator[tuple]:
+    """
+    (id, tenant, requisição em JSON cru) em ordem de ID, com cursor de servidor.
+    O JSON vem como texto: o parse fica com os workers, não com o leitor.
+    """
+    engine = create_engine(url)
+    query = select(
+        AuditoriaChecagem.id_requisicao,
+        AuditoriaChecagem.tenant,
+        cast(AuditoriaChecagem.requisicao, Text),
+    ).order_by(AuditoriaChecagem.id)
+    if since:
+        query = query.where(AuditoriaChecagem.recebido_em >= since)
+    if until:
+        query = query.where(AuditoriaChecagem.recebido_em < until)
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch).execute(query)
+            for audit_id, tenant, request in result:
+                yield audit_id, tenant, request
+    finally:
+        engine.dispose()
+
+
+def iter_audit_ndjson(patterns: List[str]) -> Iterator[str]:
+    """Linhas cruas dos segmentos; o parse do JSON fica com os workers."""
+    paths = sorted({p for pattern in patterns for p in glob.glob(pattern)})
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    yield line
+
+
+def chunked(records, size: int) -> Iterator[list]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ======================================
+# 3. Avaliação (workers)
+# ======================================
+
+@dataclass
+class ReplayStats:
+    requests: int = 0
+    items: int = 0
+    errors: int = 0
+    request_transitions: Counter = field(default_factory=Counter)
+    item_transitions: Counter = field(default_factory=Counter)
+    codes_added: Counter = field(default_factory=Counter)
+    codes_removed: Counter = field(default_factory=Counter)
+    examples: Dict[str, List[dict]] = field(default_factory=dict)
+
+    def add_example(self, key: str, example: dict, limit: int):
+        bucket = self.examples.setdefault(key, [])
+        if len(bucket) < limit:
+            bucket.append(example)
+
+    def merge(self, other: "ReplayStats", limit: int):
+        self.requests += other.requests
+        self.items += other.items
+        self.errors += other.errors
+        self.request_transitions.update(other.request_transitions)
+        self.item_transitions.update(other.item_transitions)
+        self.codes_added.update(other.codes_added)
+        self.codes_removed.update(other.codes_removed)
+        for key, examples in other.examples.items():
+            for example in examples:
+                self.add_example(key, example, limit)
+
+
+_current = None
+_candidate = None
+
+
+def _init_worker(current_snapshot: dict, candidate_snapshot: dict):
+    # Compilado uma vez por processo, reaproveitado em todos os lotes
+    # (as camadas de cada tenant são montadas sob demanda e ficam em cache na base)
+    global _current, _candidate
+    _current = KnowledgeBase.from_snapshot(current_snapshot)
+    _candidate = KnowledgeBase.from_snapshot(candidate_snapshot)
+
+
+def _worst(alerts: list) -> str:
+    worst = "OK"
+    for alert in alerts:
+        if DECISION_RANK.get(alert["type"], 0) > DECISION_RANK[worst]:
+            worst = alert["type"]
+    return worst
+
+
+def _summarize(alerts: list) -> list:
+    return [{"type": a["type"], "code": a.get("code"), "msg": a["msg"]} for a in alerts]
+
+
+def replay_chunk(records: list, max_examples: int) -> ReplayStats:
+    stats = ReplayStats()
+    for record in records:
+        try:
+            if isinstance(record, tuple):  # banco: (id, tenant, requisição)
+                audit_id, tenant, request = record[0], record[1], json.loads(record[2])
+            else:  # NDJSON: evento completo
+                event = json.loads(record)
+                audit_id, tenant, request = event.get("id_requisicao"), event.get("tenant"), event["requisicao"]
+            patient = request["patient"]
+            items = request["items"]
+        except (ValueError, KeyError, TypeError):
+            stats.errors += 1
+            continue
+
+        current = _current.for_tenant(tenant).engine
+        candidate = _candidate.for_tenant(tenant).engine
+        stats.requests += 1
+        before_req = after_req = "OK"
+        for item in items:
+            prescription = dict(item, route=normalize_route(item.get("route")))
+            try:
+                before = current.validate(patient=patient, prescription=prescription)
+                after = candidate.validate(patient=patient, prescription=prescription)
+            except (KeyError, TypeError, ZeroDivisionError):
+                stats.errors += 1
+                continue
+
+            stats.items += 1
+            b, a = _worst(before), _worst(after)
+            stats.item_transitions[f"{b}->{a}"] += 1
+            if DECISION_RANK[b] > DECISION_RANK[before_req]:
+                before_req = b
+            if DECISION_RANK[a] > DECISION_RANK[after_req]:
+                after_req = a
+
+            codes_before = Counter(x.get("code") for x in before)
+            codes_after = Counter(x.get("code") for x in after)
+            stats.codes_added.update(codes_after - codes_before)
+            stats.codes_removed.update(codes_before - codes_after)
+
+            if b != a:
+                stats.add_example(f"{b}->{a}", {
+                    "audit_id": audit_id,
+                    "item": item.get("cd_item_prescricao"),
+                    "drug_id": item.get("drug_id"),
+                    "current": _summarize(before),
+                    "candidate": _summarize(after),
+                }, max_examples)
+
+        stats.request_transitions[f"{before_req}->{after_req}"] += 1
+    return stats
+
+
+# ======================================
+# 4. Orquestração e relatório
+# ======================================
+
+def run_replay(records, current_snapshot: dict, candidate_snapshot: dict, workers: int,
+               chunk_size: int, max_examples: int, limit: Optional[int] = None) -> ReplayStats:
+    total = ReplayStats()
+    if limit:
+        records = itertools.islice(records, limit)
+    start = time.perf_counter()
+    last_report = start
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(current_snapshot, candidate_snapshot)) as pool:
+        pending = set()
+        # Janela limitada de lotes em voo: a leitura não corre à frente da avaliação
+        for chunk in chunked(records, chunk_size):
+            pending.add(pool.submit(replay_chunk, chunk, max_examples))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    total.merge(future.result(), max_examples)
+            now = time.perf_counter()
+            if now - last_report >= 5.0:
+                last_report = now
+                print(f"  ... {total.requests} requisições ({total.requests / (now - start):.0f}/s)", file=sys.stderr)
+        for future in pending:
+            total.merge(future.result(), max_examples)
+    return total
+
+
+def report(stats: ReplayStats, elapsed: float) -> Dict[str, Any]:
+    changed = sum(n for key, n in stats.request_transitions.items() if key.split("->")[0] != key.split("->")[1])
+    return {
+        "requests": stats.requests,
+        "items": stats.items,
+        "errors": stats.errors,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(stats.requests / elapsed, 1) if elapsed else 0.0,
+        "requests_changed": changed,
+        "request_transitions": dict(stats.request_transitions.most_common()),
+        "item_transitions": dict(stats.item_transitions.most_common()),
+        "codes_added": dict(stats.codes_added.most_common()),
+        "codes_removed": dict(stats.codes_removed.most_common()),
+        "examples": stats.examples,
+    }
+
+
+def _print_report(result: Dict[str, Any]):
+    print("\n=== Replay: base atual -> candidata ===")
+    print(
+        f"requisições={result['requests']}  itens={result['items']}  erros={result['errors']}  "
+        f"tempo={result['elapsed_s']}s  vazão={result['throughput_rps']} req/s"
+    )
+    print(f"requisições com decisão diferente: {result['requests_changed']}")
+    print("  por requisição:", result["request_transitions"])
+    print("  por item:      ", result["item_transitions"])
+    if result["codes_added"]:
+        print("  alertas novos: ", result["codes_added"])
+    if result["codes_removed"]:
+        print("  alertas que somem:", result["codes_removed"])
+    for key, examples in result["examples"].items():
+        print(f"\n--- Exemplos {key} ---")
+        for ex in examples:
+            before = [a["code"] for a in ex["current"]]
+            after = [a["code"] for a in ex["candidate"]]
+            print(f"  audit={ex['audit_id']} item={ex['item']} drug={ex['drug_id']}: {before} -> {after}")
+
+
+def cmd_snapshot(args):
+    snapshot = snapshot_from_db(args.db)
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(snapshot, fh, indent=2, ensure_ascii=False)
+    print(f"Snapshot da versão {snapshot['version']} salvo em {args.output} ({len(snapshot['drugs'])} medicamentos).")
+
+
+def cmd_run(args):
+    if not args.audit_db and not args.audit_ndjson:
+        raise SystemExit("Informe --audit-db ou --audit-ndjson.")
+    if not args.candidate_db and not args.candidate_snapshot:
+        raise SystemExit("Informe --candidate-db ou --candidate-snapshot.")
+
+    current_url = args.current_db or args.audit_db or os.getenv("DATABASE_URL")
+    current = load_snapshot(args.current_snapshot) if args.current_snapshot else snapshot_from_db(current_url)
+    candidate = load_snapshot(args.candidate_snapshot) if args.candidate_snapshot else snapshot_from_db(args.candidate_db)
+
+    if args.audit_ndjson:
+        records = iter_audit_ndjson(args.audit_ndjson)
+    else:
+        records = iter_audit_db(args.audit_db, args.since, args.until, args.chunk_size)
+
+    start = time.perf_counter()
+    stats = run_replay(records, current, candidate, args.workers, args.chunk_size, args.examples, args.limit)
+    result = report(stats, time.perf_counter() - start)
+    _print_report(result)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2, ensure_ascii=False)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Replay da auditoria do ValidRx contra uma base candidata")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    snap = sub.add_parser("snapshot", help="exporta a base de um banco para JSON")
+    snap.add_argument("--db", default=os.getenv("DATABASE_URL"), help="URL do banco (padrão: DATABASE_URL)")
+    snap.add_argument("-o", "--output", required=True)
+
+    run = sub.add_parser("run", help="reavalia a auditoria nas duas bases e compara")
+    run.add_argument("--audit-db", help="banco com a tabela auditoria_checagem")
+    run.add_argument("--audit-ndjson", nargs="*", help="segmentos da auditoria (aceita glob)")
+    run.add_argument("--since", help="só registros a partir desta data (ISO)")
+    run.add_argument("--until", help="só registros antes desta data (ISO)")
+    run.add_argument("--limit", type=int, help="no máximo N requisições")
+    run.add_argument("--current-db", help="base atual (padrão: --audit-db ou DATABASE_URL)")
+    run.add_argument("--current-snapshot", help="base atual a partir de um snapshot JSON")
+    run.add_argument("--candidate-db", help="base candidata (outro banco)")
+    run.add_argument("--candidate-snapshot", help="base candidata a partir de um snapshot JSON")
+    run.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    run.add_argument("--chunk-size", type=int, default=2000, help="registros por lote enviado a um worker")
+    run.add_argument("--examples", type=int, default=5, help="exemplos guardados por tipo de mudança")
+    run.add_argument("--json-out", help="salva o relatório em JSON")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.command == "snapshot":
+        cmd_snapshot(args)
+    else:
+        cmd_run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cliente Python do ValidRx.
+
+Um cliente por processo, compartilhado entre threads (ValidRxClient) ou
+tarefas asyncio (AsyncValidRxClient):
+
+- pool de conexões keep-alive (httpx), em vez de uma conexão por chamada
+- novas tentativas com backoff exponencial e jitter em falhas de rede e
+  503/502/504, respeitando o Retry-After do controle de admissão; a
+  mesma X-Request-Id vai em todas as tentativas (um ID na auditoria)
+- micro-lotes opcionais (batch_window_ms > 0): checagens concorrentes que
+  chegam dentro da janela vão juntas para /api/clinical-check/batch e a
+  resposta de cada uma volta para quem chamou
+
+Exemplos:
+  from validrx_client import ValidRxClient, AsyncValidRxClient
+
+  with ValidRxClient("http://localhost:8000", tenant="HOSP_A", batch_window_ms=2) as client:
+      result = client.clinical_check(payload)          # seguro entre threads
+
+  async with AsyncValidRxClient("http://localhost:8000", batch_window_ms=2) as client:
+      results = await asyncio.gather(*(client.clinical_check(p) for p in payloads))
+
+Para testar contra a API no mesmo processo, passe o transporte do httpx:
+  AsyncValidRxClient("http://validrx", transport=httpx.ASGITransport(app=app))
+"""
+
+import asyncio
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+TENANT_HEADER = "X-ValidRx-Tenant"
+DEADLINE_HEADER = "X-ValidRx-Deadline-Ms"
+AUDIT_ID_HEADER = "X-ValidRx-Audit-Id"
+
+
+class ValidRxError(Exception):
+    """Resposta de erro da API (ou falha de rede depois das tentativas)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, detail: Any = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Novas tentativas em falha de rede e nos status de `retry_statuses`.
+    A espera cresce em dobro a cada tentativa (até `backoff_max_s`), com
+    jitter para que clientes rejeitados juntos não voltem juntos.
+    """
+    max_attempts: int = 3
+    backoff_base_s: float = 0.05
+    backoff_max_s: float = 2.0
+    retry_statuses: Tuple[int, ...] = (502, 503, 504)
+
+    def delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        cap = min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt))
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                cap = max(cap, min(float(retry_after), self.backoff_max_s))
+            except ValueError:
+                pass
+        return cap / 2 + random.uniform(0, cap / 2)
+
+
+# ======================================
+# 1. Partes comuns
+# ======================================
+
+class _BaseClient:
+    def __init__(self, base_url: str, tenant: Optional[str], admin_key: Optional[str],
+                 retry: Optional[RetryPolicy], batch_window_ms: float, max_batch_size: int):
+        self.base_url = base_url.rstrip("/")
+        self.tenant = tenant
+        self.admin_key = admin_key
+        self.retry = retry or RetryPolicy()
+        self.batch_window_s = batch_window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        # Desliga os lotes se a API não tiver /api/clinical-check/batch (versão antiga)
+        self._batch_supported = True
+
+    def _headers(self, deadline_ms: Optional[float] = None, admin: bool = False) -> Dict[str, str]:
+        headers = {"X-Request-Id": uuid.uuid4().hex}
+        if self.tenant:
+            headers[TENANT_HEADER] = self.tenant
+        if deadline_ms is not None:
+            headers[DEADLINE_HEADER] = str(int(deadline_ms))
+        if admin and self.admin_key:
+            headers["x-admin-key"] = self.admin_key
+        return headers
+
+    def _should_retry(self, attempt: int, response: Optional[httpx.Response]) -> bool:
+        if attempt + 1 >= self.retry.max_attempts:
+            return False
+        return response is None or response.status_code in self.retry.retry_statuses
+
+    @staticmethod
+    def _result(response: httpx.Response) -> dict:
+        if response.status_code >= 400:
+            try:
+                detail = response.json().get("detail")
+            except ValueError:
+                detail = response.text
+            raise ValidRxError(f"ValidRx respondeu {response.status_code}: {detail}", response.status_code, detail)
+        return response.json()
+
+    @staticmethod
+    def _with_audit_id(body: dict, audit_id: Optional[str]) -> dict:
+        # O ID da auditoria vem no header da chamada única e no corpo do lote;
+        # para quem chamou, fica sempre no campo "audit_id"
+        if audit_id:
+            body = dict(body, audit_id=audit_id)
+        return body
+
+
+# ======================================
+# 2. Cliente síncrono (threads)
+# ======================================
+
+class ValidRxClient(_BaseClient):
+    """
+    Cliente síncrono e seguro entre threads.
+
+    Com batch_window_ms > 0, clinical_check() de várias threads ao mesmo
+    tempo é juntado por uma thread de despacho: ela espera até
+    `batch_window_ms` (ou `max_batch_size` checagens) e manda o lote. Até
+    `max_connections` lotes ficam em voo ao mesmo tempo.
+    """
+
+    def __init__(self, base_url: str, tenant: Optional[str] = None, admin_key: Optional[str] = None,
+                 timeout: float = 10.0, max_connections: int = 20, retry: Optional[RetryPolicy] = None,
+                 batch_window_ms: float = 0.0, max_batch_size: int = 32,
+                 transport: Optional[httpx.BaseTransport] = None):
+        super().__init__(base_url, tenant, admin_key, retry, batch_window_ms, max_batch_size)
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._http = httpx.Client(base_url=self.base_url, timeout=timeout, limits=limits, transport=transport)
+
+        self._pending: List[Tuple[dict, Future]] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._dispatcher = None
+        self._senders = None
+        if self.batch_window_s > 0:
+            self._senders = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="validrx-batch")
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="validrx-dispatch", daemon=True)
+            self._dispatcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Manda o que ainda está na janela, espera os lotes em voo e fecha as conexões."""
+        if self._dispatcher is not None:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            self._dispatcher.join()
+            self._senders.shutdown(wait=True)
+        self._http.close()
+
+    def _request(self, method: str, path: str, headers: Dict[str, str], **kwargs) -> httpx.Response:
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self._http.request(method, path, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                if not self._should_retry(attempt, None):
+                    raise ValidRxError(f"Falha de comunicação com o ValidRx: {e}") from e
+            if response is not None and not self._should_retry(attempt, response):
+                return response
+            time.sleep(self.retry.delay(attempt, response))
+            attempt += 1
+
+    # ------------------------------------------------------------------
+    # Checagem clínica
+    # ------------------------------------------------------------------
+
+    def clinical_check(self, payload: dict, deadline_ms: Optional[float] = None) -> dict:
+        """
+        Mesma resposta de POST /api/clinical-check, com o ID da auditoria
+        em "audit_id". Chamadas com deadline_ms não entram em lote.
+        """
+        if self._dispatcher is None or deadline_ms is not None or not self._batch_supported:
+            return self._check_one(payload, deadline_ms)
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise ValidRxError("Cliente fechado.")
+            self._pending.append((payload, future))
+            self._cond.notify()
+        return future.result()
+
+    def clinical_check_many(self, payloads: List[dict]) -> List[dict]:
+        """Várias checagens numa chamada (lotes de até max_batch_size), na ordem recebida."""
+        results = []
+        for i in range(0, len(payloads), self.max_batch_size):
+            for result in self._check_batch(payloads[i:i + self.max_batch_size]):
+                if isinstance(result, Exception):
+                    raise result
+                results.append(result)
+        return results
+
+    def _check_one(self, payload: dict, deadline_ms: Optional[float] = None) -> dict:
+        response = self._request("POST", "/api/clinical-check", self._headers(deadline_ms), json=payload)
+        return self._with_audit_id(self._result(response), response.headers.get(AUDIT_ID_HEADER))
+
+    def _check_batch(self, payloads: List[dict]) -> list:
+        """Resposta (ou ValidRxError) de cada requisição, na ordem recebida."""
+        if len(payloads) == 1 or not self._batch_supported:
+            return [self._check_one_or_error(p) for p in payloads]
+        response = self._request("POST", "/api/clinical-check/batch", self._headers(),
+                                 json={"requests": payloads})
+        if response.status_code in (404, 405):
+            self._batch_supported = False
+            return [self._check_one_or_error(p) for p in payloads]
+        if response.status_code == 422:
+            # Uma requisição inválida derruba o lote: refaz uma a uma para o
+            # erro chegar só a quem mandou a inválida
+            return [self._check_one_or_error(p) for p in payloads]
+        body = self._result(response)
+        audit_ids = body.get("audit_ids") or [None] * len(payloads)
+        return [self._with_audit_id(r, a) for r, a in zip(body["responses"], audit_ids)]
+
+    def _check_one_or_error(self, payload: dict):
+        try:
+            return self._check_one(payload)
+        except ValidRxError as e:
+            return e
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # Primeira checagem na fila: espera a janela encher (ou o lote completar)
+                window_end = time.monotonic() + self.batch_window_s
+                while len(self._pending) < self.max_batch_size and not self._closed:
+                    remaining = window_end - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+            self._senders.submit(self._send_batch, batch)
+
+    def _send_batch(self, batch: List[Tuple[dict, Future]]):
+        try:
+            results = self._check_batch([payload for payload, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    # ------------------------------------------------------------------
+    # Outras rotas
+    # ------------------------------------------------------------------
+
+    def dose_sheet(self, weight_kg: float, age_months: int) -> dict:
+        response = self._request("GET", "/api/dose-sheet", self._headers(),
+                                 params={"weight_kg": weight_kg, "age_months": age_months})
+        return self._result(response)
+
+    def explain_alerts(self, alerts: List[dict]) -> dict:
+        response = self._request("POST", "/api/alerts/explain", self._headers(), json={"alerts": alerts})
+        return self._result(response)
+
+    def kb_version(self) -> int:
+        return self._result(self._request("GET", "/api/kb/version", self._headers()))["version"]
+
+    def kb_changes(self, since: Optional[int] = None) -> dict:
+        """Uma página do feed de mudanças da base (sem `since`: snapshot)."""
+        params = {} if since is None else {"since": since}
+        return self._result(self._request("GET", "/api/kb/changes", self._headers(), params=params))
+
+
+# ======================================
+# 3. Cliente asyncio
+# ======================================
+
+class AsyncValidRxClient(_BaseClient):
+    """
+    Cliente asyncio. Com batch_window_ms > 0, clinical_check() de tarefas
+    concorrentes é juntado: a primeira abre a janela e, quando ela fecha (ou
+    o lote completa), o lote é enviado numa tarefa própria.
+    """
+
+    def __init__(self, base_url: str, tenant: Optional[str] = None, admin_key: Optional[str] = None,
+                 timeout: float = 10.0, max_connections: int = 20, retry: Optional[RetryPolicy] = None,
+                 batch_window_ms: float = 0.0, max_batch_size: int = 32,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        super().__init__(base_url, tenant, admin_key, retry, batch_window_ms, max_batch_size)
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._http = httpx.AsyncClient(base_url=self.base_url, timeout=timeout, limits=limits, transport=transport)
+
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._flush_handle = None
+        self._in_flight = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        """Manda o que ainda está na janela, espera os lotes em voo e fecha as conexões."""
+        self._flush()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        await self._http.aclose()
+
+    async def _request(self, method: str, path: str, headers: Dict[str, str], **kwargs) -> httpx.Response:
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = await self._http.request(method, path, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                if not self._should_retry(attempt, None):
+                    raise ValidRxError(f"Falha de comunicação com o ValidRx: {e}") from e
+            if response is not None and not self._should_retry(attempt, response):
+                return response
+            await asyncio.sleep(self.retry.delay(attempt, response))
+            attempt += 1
+
+    # ------------------------------------------------------------------
+    # Checagem clínica
+    # ------------------------------------------------------------------
+
+    async def clinical_check(self, payload: dict, deadline_ms: Optional[float] = None) -> dict:
+        """
+        Mesma resposta de POST /api/clinical-check, com o ID da auditoria
+        em "audit_id". Chamadas com deadline_ms não entram em lote.
+        """
+        if self.batch_window_s <= 0 or deadline_ms is not None or not self._batch_supported:
+            return await self._check_one(payload, deadline_ms)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((payload, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window_s, self._flush)
+        return await future
+
+    async def clinical_check_many(self, payloads: List[dict]) -> List[dict]:
+        """Várias checagens numa chamada (lotes de até max_batch_size), na ordem recebida."""
+        chunks = [payloads[i:i + self.max_batch_size] for i in range(0, len(payloads), self.max_batch_size)]
+        results = []
+        for chunk_results in await asyncio.gather(*(self._check_batch(c) for c in chunks)):
+            for result in chunk_results:
+                if isinstance(result, Exception):
+                    raise result
+                results.append(result)
+        return results
+
+    async def _check_one(self, payload: dict, deadline_ms: Optional[float] = None) -> dict:
+        response = await self._request("POST", "/api/clinical-check", self._headers(deadline_ms), json=payload)
+        return self._with_audit_id(self._result(response), response.headers.get(AUDIT_ID_HEADER))
+
+    async def _check_one_or_error(self, payload: dict):
+        try:
+            return await self._check_one(payload)
+        except ValidRxError as e:
+            return e
+
+    async def _check_batch(self, payloads: List[dict]) -> list:
+        """Resposta (ou ValidRxError) de cada requisição, na ordem recebida."""
+        if len(payloads) == 1 or not self._batch_supported:
+            return await asyncio.gather(*(self._check_one_or_error(p) for p in payloads))
+        response = await self._request("POST", "/api/clinical-check/batch", self._headers(),
+                                       json={"requests": payloads})
+        if response.status_code in (404, 405):
+            self._batch_supported = False
+            return await asyncio.gather(*(self._check_one_or_error(p) for p in payloads))
+        if response.status_code == 422:
+            # Uma requisição inválida derruba o lote: refaz uma a uma
+            return await asyncio.gather(*(self._check_one_or_error(p) for p in payloads))
+        body = self._result(response)
+        audit_ids = body.get("audit_ids") or [None] * len(payloads)
+        return [self._with_audit_id(r, a) for r, a in zip(body["responses"], audit_ids)]
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            task = asyncio.get_running_loop().create_task(self._send_batch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send_batch(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            results = await self._check_batch([payload for payload, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():  # quem chamou foi cancelado
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    # ------------------------------------------------------------------
+    # Outras rotas
+    # ------------------------------------------------------------------
+
+    async def dose_sheet(self, weight_kg: float, age_months: int) -> dict:
+        response = await self._request("GET", "/api/dose-sheet", self._headers(),
+                                       params={"weight_kg": weight_kg, "age_months": age_months})
+        return self._result(response)
+
+    async def explain_alerts(self, alerts: List[dict]) -> dict:
+        response = await self._request("POST", "/api/alerts/explain", self._headers(), json={"alerts": alerts})
+        return self._result(response)
+
+    async def kb_version(self) -> int:
+        return self._result(await self._request("GET", "/api/kb/version", self._headers()))["version"]
+
+    async def kb_changes(self, since: Optional[int] = None) -> dict:
+        """Uma página do feed de mudanças da base (sem `since`: snapshot)."""
+        params = {} if since is None else {"since": since}
+        return self._result(await self._request("GET", "/api/kb/changes", self._headers(), params=params))
@@ -0,0 +1,212 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from typing import Optional
+
+from src import metrics
+
+# ==============================================================================
+# CONTROLE DE ADMISSÃO (PRIORIDADE + FILA LIMITADA + DEADLINE)
+# ==============================================================================
+
+# Classes de prioridade (menor = mais prioritário)
+CLINICAL = 0
+OTHER = 1
+
+CLASS_NAMES = {CLINICAL: "clinical", OTHER: "other"}
+
+DEADLINE_HEADER = "x-validrx-deadline-ms"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class PriorityLimiter:
+    """
+    Semáforo assíncrono com duas classes de prioridade.
+
+    - No máximo `max_concurrency` requisições executam ao mesmo tempo.
+    - Tráfego não clínico usa no máximo `max_concurrency_other` vagas,
+      então sempre sobra capacidade reservada para a checagem clínica.
+    - Quem não consegue vaga espera numa fila de tamanho limitado por classe;
+      fila cheia = rejeição imediata (load shedding), sem esperar timeout.
+    - Ao liberar uma vaga, a fila clínica é sempre atendida primeiro.
+    """
+
+    def __init__(self, max_concurrency: int, max_concurrency_other: int, max_queue: dict):
+        self.max_concurrency = max_concurrency
+        self.limits = {CLINICAL: max_concurrency, OTHER: min(max_concurrency_other, max_concurrency)}
+        self.max_queue = max_queue
+        self.in_flight = {CLINICAL: 0, OTHER: 0}
+        self.queued = {CLINICAL: 0, OTHER: 0}
+        self._waiters = []  # heap de (prioridade, seq, future)
+        self._seq = itertools.count()
+
+    def _total(self) -> int:
+        return self.in_flight[CLINICAL] + self.in_flight[OTHER]
+
+    def _can_run(self, priority: int) -> bool:
+        if self._total() >= self.max_concurrency:
+            return False
+        return self.in_flight[priority] < self.limits[priority]
+
+    def _grant(self, priority: int):
+        self.in_flight[priority] += 1
+        metrics.ADMISSION_IN_FLIGHT.labels(CLASS_NAMES[priority]).set(self.in_flight[priority])
+
+    async def acquire(self, priority: int, timeout: Optional[float]):
+        # Caminho rápido: há vaga e ninguém de prioridade igual/maior esperando
+        ahead = any(w[0] <= priority and not w[2].done() for w in self._waiters)
+        if not ahead and self._can_run(priority):
+            self._grant(priority)
+            return
+
+        if self.queued[priority] >= self.max_queue[priority]:
+            raise AdmissionRejected("queue_full")
+        if timeout is not None and timeout <= 0:
+            raise AdmissionRejected("deadline")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._waiters, entry)
+        self._set_queued(priority, +1)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # A vaga foi concedida no mesmo instante do timeout: devolve
+                self.release(priority)
+            else:
+                future.cancel()
+            raise AdmissionRejected("queue_timeout")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(priority)
+            else:
+                future.cancel()
+            raise
+        finally:
+            self._set_queued(priority, -1)
+
+    def release(self, priority: int):
+        self.in_flight[priority] -= 1
+        metrics.ADMISSION_IN_FLIGHT.labels(CLASS_NAMES[priority]).set(self.in_flight[priority])
+        self._wake()
+
+    def _wake(self):
+        # Remove waiters já cancelados (timeout/desconexão)
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+        skipped = []
+        while self._waiters and self._total() < self.max_concurrency:
+            entry = heapq.heappop(self._waiters)
+            priority, _, future = entry
+            if future.done():
+                continue
+            if not self._can_run(priority):
+                skipped.append(entry)
+                continue
+            self._grant(priority)
+            future.set_result(True)
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    def _set_queued(self, priority: int, delta: int):
+        self.queued[priority] += delta
+        metrics.ADMISSION_QUEUE_DEPTH.labels(CLASS_NAMES[priority]).set(self.queued[priority])
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI de controle de admissão.
+
+    - /api/clinical-check e /api/dose-sheet têm prioridade sobre rotas admin e de catálogo.
+    - Fila cheia ou espera acima do limite -> 503 imediato com Retry-After.
+    - Header X-ValidRx-Deadline-Ms: orçamento (ms) da requisição. O deadline
+      absoluto (time.monotonic) fica em request.state.validrx_deadline para
+      que o endpoint pare de avaliar itens quando ele estourar.
+    - Rotas de observabilidade (/, /metrics) não passam pelo limitador.
+    """
+
+    CLINICAL_PATHS = ("/api/clinical-check", "/api/dose-sheet")
+    EXEMPT_PATHS = ("/", "/metrics", "/docs", "/openapi.json", "/redoc")
+
+    def __init__(self, app, limiter: PriorityLimiter, queue_timeout_s: float):
+        self.app = app
+        self.limiter = limiter
+        self.queue_timeout_s = queue_timeout_s
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        arrival = time.monotonic()
+        priority = CLINICAL if scope["path"].startswith(self.CLINICAL_PATHS) else OTHER
+
+        deadline = None
+        for name, value in scope.get("headers", []):
+            if name == DEADLINE_HEADER.encode():
+                try:
+                    deadline = arrival + max(float(value), 0.0) / 1000.0
+                except ValueError:
+                    pass
+                break
+
+        timeout = self.queue_timeout_s
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+
+        try:
+            await self.limiter.acquire(priority, timeout)
+        except AdmissionRejected as e:
+            metrics.ADMISSION_REJECTED.labels(CLASS_NAMES[priority], e.reason).inc()
+            await _send_overloaded(send, e.reason)
+            return
+
+        scope.setdefault("state", {})["validrx_deadline"] = deadline
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release(priority)
+
+
+async def _send_overloaded(send, reason: str):
+    body = json.dumps({
+        "detail": "ValidRx sobrecarregado, tente novamente.",
+        "reason": reason,
+    }).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", b"1"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def deadline_expired(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
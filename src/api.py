@@ -12,52 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gzip
 import os
+import tempfile
+import time
+import uuid
+from functools import partial
 from typing import List, Optional
 
-from fastapi import FastAPI, Header, HTTPException
+import ijson
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, WebSocket
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 
-from src.engine import ClinicalEngine
+from src import metrics
+from src.admission import CLINICAL, OTHER, AdmissionMiddleware, PriorityLimiter, deadline_expired
+from src.audit import AuditLog, DatabaseSink, NdjsonSink, build_event
+from src.change_feed import ChangeFeed
 from src.database import DatabaseManager
-
-# ============================
-# 🔷 NOVO: CAMADA DE NORMALIZAÇÃO (TRADUTOR)
-# ============================
-
-# Mapeamento de siglas de mercado (MV/Tasy) para o padrão ValidRx
-ROUTE_MAPPING = {
-    # Vias Venosas
-    "EV": "Endovenosa (IV)",
-    "IV": "Endovenosa (IV)",
-    "INTRAVENOSA": "Endovenosa (IV)",
-    
-    # Vias Musculares
-    "IM": "Intramuscular (IM)",
-    "INTRAMUSCULAR": "Intramuscular (IM)",
-    
-    # Vias Orais
-    "VO": "Oral",
-    "ORAL": "Oral",
-    "PO": "Oral", # Per Os (latim)
-    
-    # Subcutânea
-    "SC": "Subcutânea",
-    "SQ": "Subcutânea",
-    "SUBCUTANEA": "Subcutânea"
-}
-
-def normalize_route(route_input: str) -> str:
-    """
-    Traduz siglas (EV, IM, VO) para o padrão do banco de dados.
-    Ex: Recebe 'EV' -> Retorna 'Endovenosa (IV)'
-    """
-    if not route_input:
-        return "Desconhecida"
-    
-    # Converte para maiúsculo e busca no mapa. Se não achar, devolve o original.
-    return ROUTE_MAPPING.get(route_input.upper(), route_input)
+from src.dose_sheet import DoseSheetCache
+from src.explanations import CODE_LABELS, ExplanationService, OllamaExplainer
+from src.fhir import BundleValidator, OperationOutcomeWriter
+from src.icd10 import expand_rule
+from src.knowledge_base import DRUG_FIELDS, KnowledgeBaseCache
+from src.normalization import normalize_route
+from src.realtime import CLOSE_TRY_AGAIN_LATER, ClinicalSession
 
 # ============================
 # 🔷 CONFIGURAÇÃO DA API
@@ -66,12 +47,92 @@ def normalize_route(route_input: str) -> str:
 # Carrega variável de ambiente
 ADMIN_KEY = os.getenv("ADMIN_KEY", "DEFAULT_ADMIN_KEY")
 
+# Header que seleciona o formulário local do hospital (multi-tenant).
+# Sem o header, ou tenant sem sobrescritas, vale a base compartilhada.
+TENANT_HEADER = "X-ValidRx-Tenant"
+
+# Níveis de interação que a engine conhece (ALTO bloqueia, MEDIO alerta)
+INTERACTION_LEVELS = ("ALTO", "MEDIO")
+
+# FHIR: itens pendentes por paciente antes de avaliar e limite do
+# resultado em memória (acima disso o OperationOutcome vai para disco)
+FHIR_MAX_PENDING_ITEMS = int(os.getenv("FHIR_MAX_PENDING_ITEMS", "500"))
+FHIR_SPOOL_MAX_BYTES = int(os.getenv("FHIR_SPOOL_MAX_BYTES", str(4 * 1024 * 1024)))
+# FHIR: contextos de paciente guardados durante o Bundle (os mais antigos são descartados)
+FHIR_MAX_PATIENT_CONTEXTS = int(os.getenv("FHIR_MAX_PATIENT_CONTEXTS", "1000"))
+
+# Base de conhecimento: intervalo máximo entre checagens de versão no banco
+KB_REFRESH_SECONDS = float(os.getenv("KB_REFRESH_SECONDS", "2.0"))
+
+# Controle de admissão: vagas totais, vagas para tráfego não clínico,
+# tamanho das filas por classe e espera máxima na fila
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32"))
+ADMISSION_MAX_CONCURRENCY_OTHER = int(os.getenv("ADMISSION_MAX_CONCURRENCY_OTHER", "8"))
+ADMISSION_QUEUE_CLINICAL = int(os.getenv("ADMISSION_QUEUE_CLINICAL", "128"))
+ADMISSION_QUEUE_OTHER = int(os.getenv("ADMISSION_QUEUE_OTHER", "16"))
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "2000"))
+
+# WebSocket de validação em tempo real: limites por processo e por conexão
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "500"))
+WS_MAX_ITEMS = int(os.getenv("WS_MAX_ITEMS", "100"))
+WS_MAX_PENDING_ITEMS = int(os.getenv("WS_MAX_PENDING_ITEMS", "50"))
+WS_MAX_MESSAGE_BYTES = int(os.getenv("WS_MAX_MESSAGE_BYTES", "65536"))
+WS_IDLE_TIMEOUT_S = float(os.getenv("WS_IDLE_TIMEOUT_S", "900"))
+
+# Explicação de alertas: LLM para gerar explicações ausentes em segundo
+# plano (vazio = só explicações pré-calculadas ou montadas da regra)
+EXPLAIN_LLM_URL = os.getenv("EXPLAIN_LLM_URL", "")
+EXPLAIN_LLM_MODEL = os.getenv("EXPLAIN_LLM_MODEL", "llama3.1:8b")
+EXPLAIN_FILL_CONCURRENCY = int(os.getenv("EXPLAIN_FILL_CONCURRENCY", "2"))
+EXPLAIN_MAX_ALERTS = int(os.getenv("EXPLAIN_MAX_ALERTS", "50"))
+
+# Checagem em lote (/api/clinical-check/batch): requisições por chamada
+CLINICAL_BATCH_MAX_REQUESTS = int(os.getenv("CLINICAL_BATCH_MAX_REQUESTS", "64"))
+
+# Conjunto de alterações (/api/admin/changeset): itens por chamada, somando
+# todas as listas (tudo vai numa transação só)
+ADMIN_CHANGESET_MAX_ITEMS = int(os.getenv("ADMIN_CHANGESET_MAX_ITEMS", "5000"))
+
+# Tabela de doses por peso: largura da faixa de peso (kg) usada no cache
+DOSE_SHEET_BAND_KG = float(os.getenv("DOSE_SHEET_BAND_KG", "0.5"))
+
+# Feed de mudanças da base: mudanças por resposta, atraso a partir do qual
+# vai um snapshot, mudanças mantidas no banco e intervalo do descarte
+KB_CHANGES_PAGE_SIZE = int(os.getenv("KB_CHANGES_PAGE_SIZE", "1000"))
+KB_CHANGES_MAX_DELTA = int(os.getenv("KB_CHANGES_MAX_DELTA", "5000"))
+KB_CHANGES_RETENTION = int(os.getenv("KB_CHANGES_RETENTION", "100000"))
+KB_CHANGES_PRUNE_INTERVAL_S = float(os.getenv("KB_CHANGES_PRUNE_INTERVAL_S", "3600"))
+
+# Auditoria das checagens clínicas: destino (db, ndjson ou off), fila,
+# lote, intervalo de gravação e política com fila cheia (block ou drop)
+AUDIT_SINK = os.getenv("AUDIT_SINK", "db")
+AUDIT_DIR = os.getenv("AUDIT_DIR", "./audit")
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL_MS = float(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "200"))
+AUDIT_ON_FULL = os.getenv("AUDIT_ON_FULL", "block")
+AUDIT_ENQUEUE_TIMEOUT_MS = float(os.getenv("AUDIT_ENQUEUE_TIMEOUT_MS", "5"))
+AUDIT_FSYNC = os.getenv("AUDIT_FSYNC", "0") == "1"
+AUDIT_SEGMENT_MAX_EVENTS = int(os.getenv("AUDIT_SEGMENT_MAX_EVENTS", "100000"))
+
 app = FastAPI(
     title="ValidRx API",
     version="3.6.0",
     description="Open Source Clinical Decision Support System"
 )
 
+# Controle de admissão (prioridade clínica + load shedding).
+# Registrado antes do CORS para que as respostas 503 também levem os headers CORS.
+app.add_middleware(
+    AdmissionMiddleware,
+    limiter=PriorityLimiter(
+        max_concurrency=ADMISSION_MAX_CONCURRENCY,
+        max_concurrency_other=ADMISSION_MAX_CONCURRENCY_OTHER,
+        max_queue={CLINICAL: ADMISSION_QUEUE_CLINICAL, OTHER: ADMISSION_QUEUE_OTHER},
+    ),
+    queue_timeout_s=ADMISSION_QUEUE_TIMEOUT_MS / 1000.0,
+)
+
 # CORS (opcional)
 app.add_middleware(
     CORSMiddleware,
@@ -80,6 +141,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Métricas de latência por rota (Prometheus)
+app.add_middleware(metrics.PrometheusMiddleware)
+
 # ============================
 # 🔷 SCHEMAS CLÍNICOS
 # ============================
@@ -104,7 +168,7 @@ class PrescriptionItem(BaseModel):
     dose_input: float
     dose_unidade: str
     route: str
-    freq_hours: int
+    freq_hours: int = Field(gt=0)  # dose diária = dose * 24 / freq
 
     # ID interno do banco (PRIMARY KEY)
     drug_id: str
@@ -116,6 +180,20 @@ class ClinicalRequest(BaseModel):
     items: List[PrescriptionItem]
 
 
+class FormularyScreenRequest(BaseModel):
+    """Paciente para a triagem do formulário (sem dose: só bloqueios de cadastro)."""
+    age_months: int
+    conditions: List[str] = []
+    allergies: List[str] = []
+    current_meds: List[str] = []
+    route: Optional[str] = None
+    classe: Optional[str] = None
+
+
+class ClinicalBatchRequest(BaseModel):
+    requests: List[ClinicalRequest]
+
+
 # ============================
 # 🔷 SCHEMAS ADMIN
 # ============================
@@ -136,6 +214,20 @@ class DrugCreate(BaseModel):
     pediatria: dict
 
 
+class DrugOverride(BaseModel):
+    """Sobrescrita parcial de um medicamento no formulário local: só os campos enviados mudam."""
+    nome: Optional[str] = None
+    principio_ativo: Optional[str] = None
+    classe_terapeutica: Optional[str] = None
+    familias_alergia: Optional[List[str]] = None
+    concentracao_mg_ml: Optional[float] = None
+    min_idade_meses: Optional[int] = None
+    dose_max_diaria_adulto_mg: Optional[float] = None
+    contra_indicacoes: Optional[List[str]] = None
+    vias_permitidas: Optional[List[str]] = None
+    pediatria: Optional[dict] = None
+
+
 class InteractionCreate(BaseModel):
     substancia_a: str
     substancia_b: str
@@ -143,11 +235,92 @@ class InteractionCreate(BaseModel):
     mensagem: str
 
 
+class InteractionUpsert(InteractionCreate):
+    """Com `id`, atualiza a interação existente; sem `id`, cria uma nova."""
+    id: Optional[int] = None
+
+
+class PediatricRuleEdit(BaseModel):
+    """Troca só a regra pediátrica de um medicamento (vazia ou null remove)."""
+    drug_id: str
+    pediatria: Optional[dict] = None
+
+
+class Changeset(BaseModel):
+    upsert_drugs: List[DrugCreate] = []
+    delete_drugs: List[str] = []
+    pediatric_rules: List[PediatricRuleEdit] = []
+    upsert_interactions: List[InteractionUpsert] = []
+    delete_interactions: List[int] = []
+
+
+class CrossReactivityCreate(BaseModel):
+    familia_alergia: str
+    familia_reativa: str
+    nota: Optional[str] = None
+
+
+class AlertRef(BaseModel):
+    drug_id: str
+    code: str
+
+
+class ExplainRequest(BaseModel):
+    alerts: List[AlertRef]
+
+
 # ============================
 # 🔷 BANCO DE DADOS
 # ============================
 
 db_manager = DatabaseManager()
+kb_cache = KnowledgeBaseCache(db_manager, refresh_seconds=KB_REFRESH_SECONDS)
+dose_sheet_cache = DoseSheetCache(band_kg=DOSE_SHEET_BAND_KG)
+change_feed = ChangeFeed(
+    db_manager,
+    page_size=KB_CHANGES_PAGE_SIZE,
+    max_delta=KB_CHANGES_MAX_DELTA,
+    retention=KB_CHANGES_RETENTION,
+    prune_interval_s=KB_CHANGES_PRUNE_INTERVAL_S,
+)
+explanation_service = ExplanationService(
+    db_manager,
+    generate=OllamaExplainer(EXPLAIN_LLM_URL, EXPLAIN_LLM_MODEL) if EXPLAIN_LLM_URL else None,
+    max_concurrency=EXPLAIN_FILL_CONCURRENCY,
+)
+
+
+def _build_audit_log() -> Optional[AuditLog]:
+    if AUDIT_SINK == "off":
+        return None
+    if AUDIT_SINK == "ndjson":
+        sink = NdjsonSink(AUDIT_DIR, segment_max_events=AUDIT_SEGMENT_MAX_EVENTS, fsync=AUDIT_FSYNC)
+    else:
+        sink = DatabaseSink(db_manager)
+    return AuditLog(
+        sink,
+        max_queue=AUDIT_QUEUE_SIZE,
+        batch_size=AUDIT_BATCH_SIZE,
+        flush_interval_s=AUDIT_FLUSH_INTERVAL_MS / 1000.0,
+        on_full=AUDIT_ON_FULL,
+        enqueue_timeout_s=AUDIT_ENQUEUE_TIMEOUT_MS / 1000.0,
+    )
+
+
+audit_log = _build_audit_log()
+
+
+@app.on_event("startup")
+def _start_audit():
+    if audit_log is not None:
+        audit_log.start()
+
+
+@app.on_event("shutdown")
+def _drain_audit():
+    # Grava o que ainda está na fila antes de o processo sair
+    if audit_log is not None:
+        audit_log.close()
 
 
 def _check_admin(x_admin_key: Optional[str]):
@@ -155,6 +328,36 @@ def _check_admin(x_admin_key: Optional[str]):
         raise HTTPException(status_code=403, detail="Chave de Admin Inválida")
 
 
+def _load_engine(tenant: Optional[str] = None):
+    """
+    ClinicalEngine da versão corrente da base (compilada e em cache),
+    com o formulário local do tenant por cima, se houver.
+    """
+    return kb_cache.get().for_tenant(tenant).engine
+
+
+def _check_contraindications(terms: List[str]):
+    for term in terms:
+        try:
+            expand_rule(term)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+
+def _check_interaction_level(nivel: str):
+    if nivel not in INTERACTION_LEVELS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Nível de interação inválido: '{nivel}' (use {' ou '.join(INTERACTION_LEVELS)}).",
+        )
+
+
+async def _current_kb(tenant: Optional[str] = None):
+    # Só vai ao threadpool quando a base precisa checar versão no banco
+    kb = kb_cache.get() if kb_cache.is_fresh() else await run_in_threadpool(kb_cache.get)
+    return kb.for_tenant(tenant)
+
+
 # ============================
 # 🔷 ENDPOINTS ADMIN - DRUGS
 # ============================
@@ -171,6 +374,8 @@ def create_drug(
     _check_admin(x_admin_key)
 
     d = drug
+    _check_contraindications(d.contra_indicacoes)
+
     db_manager.add_drug(
         id=d.id,
         nome=d.nome,
@@ -184,19 +389,31 @@ def create_drug(
         vias=d.vias_permitidas,
         ped_rule=d.pediatria,
     )
+    kb_cache.invalidate()
 
     return {"msg": f"Medicamento {drug.nome} cadastrado/atualizado com sucesso."}
 
 
 @app.get("/api/admin/drugs")
-def admin_list_drugs(x_admin_key: Optional[str] = Header(None)):
+def admin_list_drugs(
+    x_admin_key: Optional[str] = Header(None),
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    q: Optional[str] = Query(None, description="Busca por ID, nome ou princípio ativo"),
+):
     """
-    Lista todos os medicamentos (admin).
+    Lista os medicamentos (admin).
+    Sem `limit`, devolve o catálogo inteiro (compatibilidade); com `limit`,
+    devolve uma página ordenada por ID e o total de resultados da busca.
     """
     _check_admin(x_admin_key)
-    drugs = db_manager.get_all_drugs_dict()
-    # retorna como lista
-    return {"drugs": list(drugs.values())}
+    if limit is None and not q and not offset:
+        drugs = db_manager.get_all_drugs_dict()
+        # retorna como lista
+        return {"drugs": list(drugs.values())}
+
+    page, total = db_manager.list_drugs_page(offset=offset, limit=limit or 50, search=q)
+    return {"drugs": page, "total": total, "offset": offset, "limit": limit or 50}
 
 
 @app.get("/api/admin/drugs/{drug_id}")
@@ -205,8 +422,7 @@ def admin_get_drug(drug_id: str, x_admin_key: Optional[str] = Header(None)):
     Busca um medicamento específico (admin).
     """
     _check_admin(x_admin_key)
-    drugs = db_manager.get_all_drugs_dict()
-    drug = drugs.get(drug_id)
+    drug = db_manager.get_drug(drug_id)
     if not drug:
         raise HTTPException(status_code=404, detail="Medicamento não encontrado")
     return drug
@@ -230,6 +446,8 @@ def admin_update_drug(
         )
 
     d = drug
+    _check_contraindications(d.contra_indicacoes)
+
     db_manager.add_drug(
         id=d.id,
         nome=d.nome,
@@ -243,6 +461,7 @@ def admin_update_drug(
         vias=d.vias_permitidas,
         ped_rule=d.pediatria,
     )
+    kb_cache.invalidate()
 
     return {"msg": f"Medicamento {drug.nome} atualizado com sucesso."}
 
@@ -256,6 +475,7 @@ def admin_delete_drug(drug_id: str, x_admin_key: Optional[str] = Header(None)):
     deleted = db_manager.delete_drug(drug_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Medicamento não encontrado")
+    kb_cache.invalidate()
     return {"msg": f"Medicamento {drug_id} removido com sucesso."}
 
 
@@ -288,9 +508,175 @@ def admin_create_interaction(
         nivel=interaction.nivel,
         msg=interaction.mensagem,
     )
+    kb_cache.invalidate()
     return {"msg": "Interação criada com sucesso."}
 
 
+# ============================
+# 🔷 ENDPOINTS ADMIN - CONJUNTO DE ALTERAÇÕES
+# ============================
+
+@app.post("/api/admin/changeset")
+def admin_apply_changeset(
+    changeset: Changeset,
+    x_admin_key: Optional[str] = Header(None),
+):
+    """
+    Aplica várias alterações de medicamentos, regras pediátricas e
+    interações de uma vez (admin).
+
+    Tudo numa transação, com upsert nativo e um único incremento de versão
+    da base: as checagens clínicas veem o conjunto inteiro ou nada dele.
+    Alterações contraditórias ou que apontam para registros inexistentes
+    são recusadas com 422, sem gravar nada.
+    """
+    _check_admin(x_admin_key)
+
+    c = changeset
+    total = (len(c.upsert_drugs) + len(c.delete_drugs) + len(c.pediatric_rules)
+             + len(c.upsert_interactions) + len(c.delete_interactions))
+    if total > ADMIN_CHANGESET_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo de {ADMIN_CHANGESET_MAX_ITEMS} alterações por conjunto.",
+        )
+    for d in c.upsert_drugs:
+        _check_contraindications(d.contra_indicacoes)
+
+    try:
+        result = db_manager.apply_changeset(
+            upsert_drugs=[d.dict() for d in c.upsert_drugs],
+            delete_drugs=c.delete_drugs,
+            pediatric_rules=[r.dict() for r in c.pediatric_rules],
+            upsert_interactions=[i.dict() for i in c.upsert_interactions],
+            delete_interactions=c.delete_interactions,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    kb_cache.invalidate()
+    return result
+
+
+# ============================
+# 🔷 ENDPOINTS ADMIN - FORMULÁRIO LOCAL (MULTI-TENANT)
+# ============================
+
+@app.get("/api/admin/tenants/{tenant}/overrides")
+def admin_tenant_overrides(tenant: str, x_admin_key: Optional[str] = Header(None)):
+    """
+    Sobrescritas do formulário local de um hospital (admin).
+    """
+    _check_admin(x_admin_key)
+    layer = db_manager.get_tenant_overrides().get(tenant, {"drugs": {}, "interactions": []})
+    return {
+        "tenant": tenant,
+        "drugs": layer["drugs"],
+        "interactions": [dict(rule, pair=sorted(rule["pair"])) for rule in layer["interactions"]],
+    }
+
+
+@app.put("/api/admin/tenants/{tenant}/drugs/{drug_id}")
+def admin_set_tenant_drug(
+    tenant: str,
+    drug_id: str,
+    override: DrugOverride,
+    x_admin_key: Optional[str] = Header(None),
+):
+    """
+    Sobrescreve campos de um medicamento só para este hospital (admin).
+    Só os campos enviados mudam; `pediatria`, se enviada, substitui o bloco
+    inteiro. Medicamento que não existe na base compartilhada precisa de
+    todos os campos.
+    """
+    _check_admin(x_admin_key)
+    fields = override.dict(exclude_unset=True)
+    if not fields:
+        raise HTTPException(status_code=422, detail="Nenhum campo para sobrescrever.")
+    if fields.get("contra_indicacoes"):
+        _check_contraindications(fields["contra_indicacoes"])
+    if drug_id not in kb_cache.get().drugs:
+        missing = [f for f in DRUG_FIELDS if f not in fields]
+        if missing:
+            raise HTTPException(
+                status_code=422,
+                detail=f"{drug_id} não existe na base compartilhada; faltam os campos {missing}.",
+            )
+
+    db_manager.set_tenant_drug(tenant, drug_id, fields)
+    kb_cache.invalidate()
+    return {"msg": f"Medicamento {drug_id} sobrescrito no formulário de {tenant}."}
+
+
+@app.delete("/api/admin/tenants/{tenant}/drugs/{drug_id}")
+def admin_delete_tenant_drug(tenant: str, drug_id: str, x_admin_key: Optional[str] = Header(None)):
+    """
+    Remove a sobrescrita: o hospital volta a ver o medicamento da base (admin).
+    """
+    _check_admin(x_admin_key)
+    if not db_manager.delete_tenant_drug(tenant, drug_id):
+        raise HTTPException(status_code=404, detail="Sobrescrita não encontrada")
+    kb_cache.invalidate()
+    return {"msg": f"Sobrescrita de {drug_id} removida do formulário de {tenant}."}
+
+
+@app.post("/api/admin/tenants/{tenant}/interactions")
+def admin_create_tenant_interaction(
+    tenant: str,
+    interaction: InteractionCreate,
+    x_admin_key: Optional[str] = Header(None),
+):
+    """
+    Cadastra uma interação só para este hospital, somada às da base (admin).
+    """
+    _check_admin(x_admin_key)
+    _check_interaction_level(interaction.nivel)
+    db_manager.add_tenant_interaction(
+        tenant,
+        sub_a=interaction.substancia_a,
+        sub_b=interaction.substancia_b,
+        nivel=interaction.nivel,
+        msg=interaction.mensagem,
+    )
+    kb_cache.invalidate()
+    return {"msg": f"Interação criada no formulário de {tenant}."}
+
+
+# ============================
+# 🔷 ENDPOINTS ADMIN - REATIVIDADE CRUZADA
+# ============================
+
+@app.get("/api/admin/cross-reactivity")
+def admin_list_cross_reactivity(x_admin_key: Optional[str] = Header(None)):
+    """
+    Lista as arestas do grafo de reatividade cruzada entre famílias de alergia (admin).
+    """
+    _check_admin(x_admin_key)
+    return {"cross_reactivity": db_manager.get_cross_reactivity()}
+
+
+@app.post("/api/admin/cross-reactivity")
+def admin_create_cross_reactivity(
+    edge: CrossReactivityCreate,
+    x_admin_key: Optional[str] = Header(None),
+):
+    """
+    Cadastra uma reatividade cruzada (alergia a `familia_alergia` -> risco
+    com `familia_reativa`). O fecho transitivo entra na próxima compilação
+    da base.
+    """
+    _check_admin(x_admin_key)
+    if edge.familia_alergia == edge.familia_reativa:
+        raise HTTPException(status_code=422, detail="As duas famílias devem ser diferentes.")
+
+    db_manager.add_cross_reactivity(
+        familia_alergia=edge.familia_alergia,
+        familia_reativa=edge.familia_reativa,
+        nota=edge.nota,
+    )
+    kb_cache.invalidate()
+    return {"msg": "Reatividade cruzada cadastrada com sucesso."}
+
+
 # ============================
 # 🔷 ENDPOINT PÚBLICO - LISTAR DRUGS
 # ============================
@@ -304,48 +690,451 @@ def list_drugs():
     return {"drugs": list(drugs.values())}
 
 
+@app.get("/api/drugs/search")
+def search_drugs(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    route: Optional[str] = None,
+    classe: Optional[str] = None,
+):
+    """
+    Autocompletar de medicamentos por nome ou princípio ativo, sem acento e
+    tolerante a erro de digitação ("amoxcilina"). Cada palavra digitada
+    pode ser o começo de uma palavra do nome ("amox 500").
+
+    Filtros opcionais: `route` (aceita siglas, ex: EV) e `classe`
+    (classe terapêutica). Com o header X-ValidRx-Tenant, busca no
+    formulário do hospital.
+    """
+    kb = kb_cache.get().for_tenant(request.headers.get(TENANT_HEADER))
+    results = kb.search_index.search(q, limit=limit, route=route, classe=classe)
+    return {"kb_version": kb.version, "results": results}
+
+
+@app.post("/api/formulary/screen")
+def screen_formulary(
+    req: FormularyScreenRequest,
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Medicamentos do catálogo (ou da `classe`) que não são bloqueados para o
+    paciente: idade mínima, alergia, contraindicação (rótulo ou CID-10),
+    interação ALTO com `current_meds` e, se informada, a `route`.
+
+    Bloqueios de posologia dependem da dose e não entram; alertas WARNING não
+    excluem. `excluded_by` conta os excluídos por camada (um medicamento
+    pode contar em mais de uma). Com o header X-ValidRx-Tenant, triagem no
+    formulário do hospital.
+    """
+    kb = kb_cache.get().for_tenant(request.headers.get(TENANT_HEADER))
+    screen = kb.formulary_screen
+    allowed, excluded_by = screen.screen(
+        req.age_months,
+        conditions=req.conditions,
+        allergies=req.allergies,
+        current_meds=req.current_meds,
+        route=req.route,
+        classe=req.classe,
+    )
+    return {
+        "kb_version": kb.version,
+        "total": len(allowed),
+        "offset": offset,
+        "limit": limit,
+        "excluded_by": excluded_by,
+        "drugs": screen.describe(allowed[offset:offset + limit].tolist()),
+    }
+
+
+@app.get("/api/kb/version")
+def kb_version():
+    """
+    Versão atual da base de conhecimento (muda a cada escrita).
+    Usada por clientes para invalidar caches locais.
+    """
+    return {"version": db_manager.get_kb_version()}
+
+
+@app.get("/api/kb/changes")
+def kb_changes(request: Request, since: Optional[int] = Query(None, ge=0)):
+    """
+    Mudanças da base desde `since` (o `seq` da última resposta; omitido na
+    primeira sincronização), para clientes que guardam a base localmente.
+
+    - type=delta: só a última mudança de cada registro alterado; com
+      `has_more`, peça de novo com since=`seq`
+    - type=snapshot: a base inteira no mesmo formato; o cliente descarta a
+      cópia local antes de aplicar (vai na primeira sincronização, para quem
+      ficou antes do piso do feed ou atrasado demais)
+
+    Cada mudança: {"seq", "entity", "key", "op": "upsert"|"delete", "data"}.
+    Com o header X-ValidRx-Tenant entram também as mudanças do formulário
+    daquele hospital (com o campo `tenant`).
+    """
+    body, compressed = change_feed.get(since, request.headers.get(TENANT_HEADER))
+    if compressed:
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            return Response(content=body, media_type="application/json", headers={"Content-Encoding": "gzip"})
+        body = gzip.decompress(body)
+    return Response(content=body, media_type="application/json")
+
+
+# ============================
+# 🔷 TABELA DE DOSES POR PESO (EMERGÊNCIA)
+# ============================
+
+@app.get("/api/dose-sheet")
+def dose_sheet(
+    request: Request,
+    weight_kg: float = Query(..., gt=0, le=300),
+    age_months: int = Query(..., ge=0, le=1800),
+):
+    """
+    Faixa de dose segura (mg e mL) de todos os medicamentos do catálogo
+    para um peso e idade, com o teto absoluto aplicado. Pensada para o
+    carrinho de parada pediátrica: uma chamada, a tabela inteira.
+
+    O peso é arredondado para baixo para a faixa de DOSE_SHEET_BAND_KG
+    (a resposta informa `weight_band_kg`). `por` indica se a faixa é por
+    dose ou por dia; adultos recebem só a dose máxima diária.
+    """
+    kb = kb_cache.get().for_tenant(request.headers.get(TENANT_HEADER))
+    body = dose_sheet_cache.get(kb, weight_kg, age_months)
+    return Response(content=body, media_type="application/json")
+
+
+# ============================
+# 🔷 EXPLICAÇÃO DE ALERTAS
+# ============================
+
+@app.post("/api/alerts/explain")
+async def explain_alerts(req: ExplainRequest, request: Request):
+    """
+    Explica por que alertas dispararam, a partir de (drug_id, code) de cada
+    alerta devolvido por /api/clinical-check.
+
+    Responde do cache (memória/banco) sem chamar LLM. `status`:
+    - ready: explicação válida para a regra atual
+    - stale: explicação de uma versão antiga da regra (campo `rule` traz a regra atual)
+    - pending: ainda não há explicação; vai a regra e a geração foi agendada
+    - not_found: medicamento inexistente
+    - not_applicable: o medicamento não tem a regra desse código
+
+    Códigos que a engine não emite são recusados com 422.
+    """
+    if len(req.alerts) > EXPLAIN_MAX_ALERTS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {EXPLAIN_MAX_ALERTS} alertas por chamada.")
+    unknown = sorted({a.code for a in req.alerts if a.code not in CODE_LABELS})
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Códigos de alerta desconhecidos: {unknown}")
+
+    kb = await _current_kb(request.headers.get(TENANT_HEADER))
+    explanations = [await explanation_service.explain(kb, a.drug_id, a.code) for a in req.alerts]
+    return {"kb_version": kb.version, "explanations": explanations}
+
+
 # ============================
 # 🔷 ENDPOINT CLÍNICO PRINCIPAL
 # ============================
 
 @app.post("/api/clinical-check")
-def clinical_check(req: ClinicalRequest):
+def clinical_check(req: ClinicalRequest, request: Request, response: Response):
     """
     Endpoint principal de checagem clínica.
     Usa ClinicalEngine com dados vindos do banco.
     Aceita siglas como EV, IM, VO e traduz para o padrão do ValidRx.
+
+    Se o cliente enviar X-ValidRx-Deadline-Ms e o prazo estourar, os itens
+    restantes não são avaliados: a resposta volta com "degraded": true e a
+    lista "not_evaluated", em vez de passar do prazo.
+
+    Toda chamada vai para a auditoria (fila em memória, gravação em lote
+    em segundo plano); o ID do registro volta no header X-ValidRx-Audit-Id.
+
+    Com o header X-ValidRx-Tenant, vale o formulário local do hospital.
     """
+    deadline = getattr(request.state, "validrx_deadline", None)
+    tenant = request.headers.get(TENANT_HEADER)
 
-    # Carrega engine com drogas e interações
-    engine = ClinicalEngine(
-        db_manager.get_all_drugs_dict(),
-        db_manager.get_interactions()
-    )
+    # Carrega engine com drogas e interações (e o formulário local, se houver)
+    kb = kb_cache.get().for_tenant(tenant)
+    audit_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    body = _run_clinical_check(req, kb, tenant, deadline, audit_id)
+    if audit_log is not None:
+        response.headers["X-ValidRx-Audit-Id"] = audit_id
+    return body
+
+
+@app.post("/api/clinical-check/batch")
+def clinical_check_batch(batch: ClinicalBatchRequest, request: Request):
+    """
+    Várias checagens (pacientes diferentes) numa chamada só, avaliadas
+    com a mesma versão da base. Usado pelo SDK (sdk/validrx_client.py) para
+    juntar chamadas concorrentes.
+
+    `responses` traz, na ordem do pedido, o mesmo corpo que
+    /api/clinical-check devolveria para cada requisição; cada uma tem seu
+    registro na auditoria (IDs em `audit_ids`). Tenant e deadline valem
+    para o lote inteiro.
+    """
+    if len(batch.requests) > CLINICAL_BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo de {CLINICAL_BATCH_MAX_REQUESTS} requisições por lote.",
+        )
+
+    deadline = getattr(request.state, "validrx_deadline", None)
+    tenant = request.headers.get(TENANT_HEADER)
+    kb = kb_cache.get().for_tenant(tenant)
+
+    responses = []
+    audit_ids = []
+    for req in batch.requests:
+        audit_id = uuid.uuid4().hex
+        responses.append(_run_clinical_check(req, kb, tenant, deadline, audit_id))
+        audit_ids.append(audit_id)
+
+    body = {"responses": responses}
+    if audit_log is not None:
+        body["audit_ids"] = audit_ids
+    return body
+
+
+def _run_clinical_check(req: ClinicalRequest, kb, tenant: Optional[str], deadline, audit_id: str) -> dict:
+    """Avalia os itens de uma requisição e registra a checagem na auditoria."""
+    start = time.perf_counter()
+    engine = kb.engine
+    patient = req.patient.dict()
 
     results = []
+    not_evaluated = []
+    items_raw = []
 
     for item in req.items:
+        item_raw = item.dict()
+        items_raw.append(item_raw)
+        if deadline_expired(deadline):
+            not_evaluated.append(item.cd_item_prescricao)
+            continue
+
         # 1. Normaliza a rota (Ex: "EV" vira "Endovenosa (IV)")
         route_normalized = normalize_route(item.route)
 
         # 2. Cria um dicionário dos dados do item e injeta a rota traduzida
         # Isso garante que a engine receba a string exata que está no banco de dados
-        prescription_data = item.dict()
+        prescription_data = dict(item_raw)
         prescription_data['route'] = route_normalized
 
         # 3. Chama a validação
         alert = engine.validate(
-            patient=req.patient.dict(),
+            patient=patient,
             prescription=prescription_data
         )
-        
+        metrics.record_alerts(alert)
+
         results.append({
             "item": item.cd_item_prescricao,
             "route_interpreted": route_normalized, # Retorna qual rota foi entendida (útil para debug)
             "alerts": alert
         })
 
-    return {"results": results}
+    if not_evaluated:
+        metrics.DEADLINE_DEGRADED.inc()
+        body = {"results": results, "degraded": True, "not_evaluated": not_evaluated}
+    else:
+        body = {"results": results, "degraded": False}
+
+    if audit_log is not None:
+        audit_log.record(build_event(
+            audit_id,
+            kb.version,
+            {"cd_medico": req.cd_medico, "patient": patient, "items": items_raw},
+            body,
+            (time.perf_counter() - start) * 1000.0,
+            tenant=tenant,
+        ))
+
+    return body
+
+
+def _audit_item(kb, tenant: Optional[str], channel: str, cd_medico: Optional[str], patient: dict,
+                item: dict, route_normalized: str, alerts: list, start: float) -> Optional[str]:
+    """
+    Registra na auditoria a avaliação de um item isolado (WebSocket, FHIR),
+    no mesmo formato de /api/clinical-check. Devolve o ID do registro.
+    """
+    if audit_log is None:
+        return None
+    audit_id = uuid.uuid4().hex
+    audit_log.record(build_event(
+        audit_id,
+        kb.version,
+        {"canal": channel, "cd_medico": cd_medico, "patient": patient, "items": [item]},
+        {"results": [{
+            "item": item.get("cd_item_prescricao"),
+            "route_interpreted": route_normalized,
+            "alerts": alerts,
+        }], "degraded": False},
+        (time.perf_counter() - start) * 1000.0,
+        tenant=tenant,
+    ))
+    return audit_id
+
+
+# ============================
+# 🔷 WEBSOCKET - VALIDAÇÃO EM TEMPO REAL
+# ============================
+
+_ws_connections = 0
+
+
+async def _evaluate_ws_item(patient: dict, item: dict, cd_medico: Optional[str] = None,
+                            tenant: Optional[str] = None) -> dict:
+    kb = await _current_kb(tenant)
+    start = time.perf_counter()
+
+    route_normalized = normalize_route(item["route"])
+    prescription_data = dict(item)
+    prescription_data["route"] = route_normalized
+
+    alerts = kb.engine.validate(patient=patient, prescription=prescription_data)
+    metrics.record_alerts(alerts)
+    result = {"route_interpreted": route_normalized, "alerts": alerts, "kb_version": kb.version}
+    audit_id = _audit_item(kb, tenant, "websocket", cd_medico, patient, item, route_normalized, alerts, start)
+    if audit_id is not None:
+        result["audit_id"] = audit_id
+    return result
+
+
+@app.websocket("/ws/clinical-check")
+async def clinical_check_ws(websocket: WebSocket):
+    """
+    Canal persistente para UIs de prescrição: o paciente é enviado uma vez,
+    as edições de item chegam em sequência e os alertas de cada item voltam
+    assim que ele é avaliado. Protocolo descrito em src/realtime.py.
+    """
+    global _ws_connections
+
+    await websocket.accept()
+    if _ws_connections >= WS_MAX_CONNECTIONS:
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="too many connections")
+        return
+
+    _ws_connections += 1
+    metrics.WS_CONNECTIONS.set(_ws_connections)
+    try:
+        session = ClinicalSession(
+            websocket,
+            patient_model=Patient,
+            item_model=PrescriptionItem,
+            evaluate=partial(_evaluate_ws_item, tenant=websocket.headers.get(TENANT_HEADER)),
+            max_items=WS_MAX_ITEMS,
+            max_pending=WS_MAX_PENDING_ITEMS,
+            max_message_bytes=WS_MAX_MESSAGE_BYTES,
+            idle_timeout_s=WS_IDLE_TIMEOUT_S,
+        )
+        await session.run()
+    finally:
+        _ws_connections -= 1
+        metrics.WS_CONNECTIONS.set(_ws_connections)
+
+
+# ============================
+# 🔷 ENDPOINT FHIR - $validate
+# ============================
+
+def _iter_spool(spool, chunk_size: int = 64 * 1024):
+    try:
+        while True:
+            chunk = spool.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        spool.close()
+
+
+@app.post("/api/fhir/Bundle/$validate")
+async def fhir_validate_bundle(request: Request):
+    """
+    Valida um Bundle HL7 FHIR (MedicationRequest + Patient, Observation de
+    peso, AllergyIntolerance, Condition, MedicationStatement).
+
+    O corpo é lido em chunks e as entries são extraídas por um parser JSON
+    incremental (ijson): só uma entry por vez existe como objeto Python.
+    Os issues vão sendo escritos num OperationOutcome em arquivo temporário
+    (memória até FHIR_SPOOL_MAX_BYTES, depois disco) e a resposta é enviada
+    em streaming. O resultado não é enviado enquanto o upload ainda corre
+    para evitar deadlock com clientes HTTP que não leem a resposta antes de
+    terminar de enviar o corpo.
+    """
+    tenant = request.headers.get(TENANT_HEADER)
+    kb = await _current_kb(tenant)
+    engine = kb.engine
+
+    def evaluate(patient: dict, item: dict):
+        start = time.perf_counter()
+        route_normalized = normalize_route(item["route"])
+        prescription_data = dict(item)
+        prescription_data["route"] = route_normalized
+        alerts = engine.validate(patient=patient, prescription=prescription_data)
+        metrics.record_alerts(alerts)
+        _audit_item(kb, tenant, "fhir", None, patient, item, route_normalized, alerts, start)
+        return alerts
+
+    def concentration(drug_id: str):
+        drug = engine.drugs.get(drug_id)
+        return drug.get("concentracao_mg_ml") if drug else None
+
+    validator = BundleValidator(
+        evaluate,
+        max_pending=FHIR_MAX_PENDING_ITEMS,
+        max_contexts=FHIR_MAX_PATIENT_CONTEXTS,
+        concentration=concentration,
+    )
+    spool = tempfile.SpooledTemporaryFile(max_size=FHIR_SPOOL_MAX_BYTES, mode="w+b")
+    streaming = False
+    try:
+        writer = OperationOutcomeWriter(spool)
+
+        def process(entries):
+            for entry in entries:
+                writer.write_all(validator.feed(entry))
+
+        entries = ijson.sendable_list()
+        parser = ijson.items_coro(entries, "entry.item")
+        try:
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                parser.send(chunk)
+                if entries:
+                    # Avaliação da engine fora do event loop, um lote por chunk de rede
+                    batch = list(entries)
+                    del entries[:]
+                    await run_in_threadpool(process, batch)
+            parser.close()
+            if entries:
+                await run_in_threadpool(process, list(entries))
+            writer.write_all(validator.finish())
+            summary = f"{validator.items_evaluated} itens avaliados."
+            writer.close([{"severity": "information", "code": "informational", "details": {"text": summary}}])
+        except ijson.JSONError as e:
+            writer.close([{
+                "severity": "fatal",
+                "code": "structure",
+                "details": {"text": f"Bundle inválido: {e}"},
+            }])
+
+        spool.seek(0)
+        streaming = True  # a partir daqui _iter_spool fecha o arquivo
+        return StreamingResponse(_iter_spool(spool), media_type="application/fhir+json")
+    finally:
+        if not streaming:
+            spool.close()
 
 # ============================
 # 🔷 HEALTHCHECK
@@ -356,5 +1145,20 @@ def root():
     return {"status": "ValidRx API online"}
 
 
+# ============================
+# 🔷 MÉTRICAS (PROMETHEUS)
+# ============================
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """
+    Exposição no formato Prometheus (latência por rota, itens validados,
+    alertas por tipo/camada, carga da base, queries SQL, pools).
+    Async de propósito: roda no event loop para ler a ocupação do threadpool.
+    """
+    payload, content_type = metrics.render_latest()
+    return Response(content=payload, media_type=content_type)
+
+
 
 
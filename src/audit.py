@@ -0,0 +1,260 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from src import metrics
+
+# ==============================================================================
+# AUDITORIA DAS CHECAGENS CLÍNICAS (FILA + GRAVAÇÃO EM LOTE)
+# ==============================================================================
+#
+# A requisição só monta o evento (referências, sem serializar) e o coloca
+# numa fila limitada em memória. Uma thread de fundo tira os eventos em
+# lotes (até `batch_size` ou a cada `flush_interval_s`) e grava de uma vez:
+#
+#   - "db":     INSERT multi-linha na tabela auditoria_checagem
+#   - "ndjson": segmentos append-only NDJSON comprimidos (.ndjson.gz), um
+#               membro gzip por lote; um lote incompleto após queda não
+#               corrompe os anteriores
+#
+# Fila cheia (gravação mais lenta que o tráfego): com on_full="block" a
+# requisição espera até `enqueue_timeout_s` por espaço e depois descarta;
+# com "drop" descarta na hora. Descartes e esperas viram métricas.
+#
+# Durabilidade: lotes pequenos e frequentes reduzem o que se perde numa
+# queda do processo; com fsync=True cada lote NDJSON vai para o disco antes
+# do próximo. No desligamento, close() grava tudo o que ainda está na fila.
+
+_STOP = object()
+
+DECISION_RANK = {"OK": 0, "WARNING": 1, "BLOCK": 2}
+
+
+def decision_of(results: list) -> str:
+    """Pior resultado entre os itens: BLOCK > WARNING > OK."""
+    worst = "OK"
+    for result in results:
+        for alert in result["alerts"]:
+            if DECISION_RANK.get(alert["type"], 0) > DECISION_RANK[worst]:
+                worst = alert["type"]
+    return worst
+
+
+def build_event(request_id: str, kb_version: int, request: dict, response: dict, duration_ms: float,
+                tenant: Optional[str] = None) -> dict:
+    """Evento de auditoria no formato da tabela auditoria_checagem."""
+    return {
+        "recebido_em": datetime.now(timezone.utc),
+        "id_requisicao": request_id,
+        "tenant": tenant,
+        "versao_base": kb_version,
+        "cd_medico": request.get("cd_medico"),
+        "nr_atendimento": (request.get("patient") or {}).get("nr_atendimento"),
+        "decisao": decision_of(response["results"]),
+        "duracao_ms": round(duration_ms, 3),
+        "requisicao": request,
+        "resultado": response,
+    }
+
+
+class DatabaseSink:
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+
+    def write(self, events: List[dict]):
+        self.db_manager.insert_audit_batch(events)
+
+    def close(self):
+        pass
+
+
+class NdjsonSink:
+    """Segmentos audit-<início>-<pid>.ndjson.gz, trocados a cada `segment_max_events`."""
+
+    def __init__(self, directory: str, segment_max_events: int = 100_000, fsync: bool = False):
+        self.directory = directory
+        self.segment_max_events = segment_max_events
+        self.fsync = fsync
+        self._file = None
+        self._events_in_segment = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        path = os.path.join(self.directory, f"audit-{stamp}-{os.getpid()}.ndjson.gz")
+        self._file = open(path, "ab")
+        self._events_in_segment = 0
+
+    def write(self, events: List[dict]):
+        if self._file is None or self._events_in_segment >= self.segment_max_events:
+            self._open_segment()
+        lines = "".join(json.dumps(e, ensure_ascii=False, default=_json_default) + "\n" for e in events)
+        self._file.write(gzip.compress(lines.encode("utf-8"), compresslevel=6))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._events_in_segment += len(events)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"{type(value).__name__} não serializável")
+
+
+class AuditLog:
+    def __init__(self, sink, max_queue: int = 10_000, batch_size: int = 500,
+                 flush_interval_s: float = 0.2, on_full: str = "block",
+                 enqueue_timeout_s: float = 0.005, max_retries: int = 3):
+        if on_full not in ("block", "drop"):
+            raise ValueError("on_full deve ser 'block' ou 'drop'")
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.on_full = on_full
+        self.enqueue_timeout_s = enqueue_timeout_s
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        metrics.AUDIT_QUEUE_DEPTH.set_function(self._queue.qsize)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="validrx-audit", daemon=True)
+                self._thread.start()
+
+    def record(self, event: dict) -> bool:
+        """Enfileira um evento. Nunca grava no caminho da requisição."""
+        if self._thread is None:
+            self.start()
+        if self._closed:
+            metrics.AUDIT_EVENTS.labels("dropped").inc()
+            return False
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+
+        if self.on_full == "block":
+            start = time.perf_counter()
+            try:
+                self._queue.put(event, timeout=self.enqueue_timeout_s)
+                return True
+            except queue.Full:
+                pass
+            finally:
+                metrics.AUDIT_ENQUEUE_WAIT.observe(time.perf_counter() - start)
+
+        metrics.AUDIT_EVENTS.labels("dropped").inc()
+        return False
+
+    def close(self, timeout: float = 10.0):
+        """Para de aceitar eventos, grava o que está na fila e encerra a thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            # A fila pode estar cheia neste momento: espera espaço para o sentinela
+            deadline = time.monotonic() + timeout
+            stop_queued = True
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                stop_queued = False
+            thread.join(max(deadline - time.monotonic(), 0))
+            if thread.is_alive():
+                # A thread ainda grava: fechar o destino agora corromperia o
+                # lote em andamento. O que sobrou na fila conta como descartado.
+                remaining = max(self._queue.qsize() - stop_queued, 0)
+                metrics.AUDIT_EVENTS.labels("dropped").inc(remaining)
+                print(f"⚠️ Auditoria: gravação não terminou em {timeout}s; {remaining} eventos descartados, destino mantido aberto.")
+                return
+        self.sink.close()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                first = self._queue.get(timeout=self.flush_interval_s)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval_s
+            item = first
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if stopping:
+                # Drena o que entrou antes do sentinela (produtores já barrados)
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            for start in range(0, len(batch), self.batch_size):
+                self._flush(batch[start:start + self.batch_size])
+
+    def _flush(self, batch: List[dict]):
+        if not batch:
+            return
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                self.sink.write(batch)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    metrics.AUDIT_EVENTS.labels("failed").inc(len(batch))
+                    print(f"⚠️ Auditoria: lote de {len(batch)} eventos perdido após {attempt + 1} tentativas: {e}")
+                    return
+                time.sleep(min(0.1 * 2 ** attempt, 2.0))
+                continue
+            metrics.AUDIT_FLUSH_DURATION.observe(time.perf_counter() - start)
+            metrics.AUDIT_BATCH_SIZE.observe(len(batch))
+            metrics.AUDIT_EVENTS.labels("written").inc(len(batch))
+            return
@@ -0,0 +1,136 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from src import metrics
+
+# ==============================================================================
+# FEED DE MUDANÇAS DA BASE (SINCRONIZAÇÃO INCREMENTAL)
+# ==============================================================================
+#
+# Validadores de borda e apps offline guardam a base localmente e pedem só o
+# que mudou desde o último `seq` (tabela mudancas_base). Cada mudança traz o
+# estado final do registro ("upsert") ou a remoção ("delete"), então um
+# delta pode ser compactado (só a última mudança de cada registro) e
+# aplicado mais de uma vez sem efeito colateral.
+#
+# Quem está começando, ficou antes do piso do feed (mudanças já descartadas)
+# ou atrasado demais recebe um snapshot: a base inteira no mesmo formato,
+# um upsert por registro. O snapshot é montado uma vez por seq/tenant e
+# guardado já serializado e comprimido.
+
+
+def compact(changes: list) -> list:
+    """Só a última mudança de cada registro, na ordem em que ocorreram."""
+    latest = {}
+    for change in changes:
+        key = (change["entity"], change.get("tenant"), change["key"])
+        latest.pop(key, None)  # reinsere no fim: a ordem segue a última mudança
+        latest[key] = change
+    return list(latest.values())
+
+
+class ChangeFeed:
+    """
+    Responde GET /api/kb/changes a partir do DatabaseManager.
+
+    - `page_size`: mudanças lidas por resposta (o cliente segue com `has_more`)
+    - `max_delta`: atraso (em mudanças) a partir do qual o snapshot compensa
+    - `retention`: mudanças mantidas no banco; as mais antigas são
+      descartadas a cada `prune_interval_s` segundos
+    """
+
+    def __init__(self, db_manager, page_size: int = 1000, max_delta: int = 5000,
+                 retention: int = 100000, prune_interval_s: float = 3600.0, max_snapshots: int = 32):
+        self.db_manager = db_manager
+        self.page_size = page_size
+        self.max_delta = max_delta
+        self.retention = max(retention, 1)  # o último seq fica sempre no banco
+        self.prune_interval_s = prune_interval_s
+        self.max_snapshots = max_snapshots
+        self._snapshots = OrderedDict()
+        self._pruned_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def get(self, since: int = None, tenant: str = None):
+        """
+        (corpo JSON, comprimido em gzip?) da resposta para um cliente em
+        `since` (None: primeira sincronização).
+        """
+        self._maybe_prune()
+        floor, last = self.db_manager.get_change_bounds()
+
+        # since > last: cliente de outro banco (ou banco recriado)
+        if since is None or since < floor or since > last or last - since > self.max_delta:
+            metrics.KB_SYNC_RESPONSES.labels(type="snapshot").inc()
+            return self._snapshot(tenant, last), True
+
+        metrics.KB_SYNC_RESPONSES.labels(type="delta").inc()
+        page = self.db_manager.get_changes(since, self.page_size, tenant) if since < last else []
+        has_more = len(page) == self.page_size
+        kb_version = None
+        for change in page:
+            kb_version = change.pop("kb_version")
+        # Página cheia: continua do último lido. Senão tudo até `last` foi visto
+        # (inclusive mudanças de outros tenants, que ficam de fora do filtro).
+        seq = page[-1]["seq"] if has_more else max(last, page[-1]["seq"] if page else since)
+
+        body = json.dumps({
+            "type": "delta",
+            "since": since,
+            "seq": seq,
+            "kb_version": kb_version,
+            "has_more": has_more,
+            "changes": compact(page),
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return body, False
+
+    def _snapshot(self, tenant: str, last: int) -> bytes:
+        key = (tenant, last)
+        with self._lock:
+            body = self._snapshots.get(key)
+            if body is not None:
+                self._snapshots.move_to_end(key)
+                metrics.record_cache("kb_snapshot", True)
+                return body
+
+        metrics.record_cache("kb_snapshot", False)
+        snapshot = self.db_manager.get_sync_snapshot(tenant)
+        body = gzip.compress(json.dumps({
+            "type": "snapshot",
+            "seq": snapshot["seq"],
+            "kb_version": snapshot["kb_version"],
+            "has_more": False,
+            "changes": snapshot["changes"],
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+        with self._lock:
+            self._snapshots[key] = body
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return body
+
+    def _maybe_prune(self):
+        now = time.monotonic()
+        if now - self._pruned_at < self.prune_interval_s:
+            return
+        self._pruned_at = now
+        removed = self.db_manager.prune_changes(self.retention)
+        if removed:
+            print(f"Feed de mudanças: {removed} mudanças antigas descartadas.")
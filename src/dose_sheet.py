@@ -0,0 +1,160 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import json
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from src import metrics
+from src.engine import CHILD_AGE_LIMIT_MONTHS
+
+# ==============================================================================
+# TABELA DE DOSES POR PESO (CARRINHO DE EMERGÊNCIA)
+# ==============================================================================
+#
+# As regras pediátricas de todo o catálogo ficam em arrays NumPy (uma
+# posição por medicamento); a tabela para um peso é calculada de uma vez,
+# sem loop por medicamento. O peso é arredondado PARA BAIXO para a faixa
+# (DOSE_SHEET_BAND_KG): a dose máxima nunca é calculada com peso maior que o
+# real. A resposta serializada fica em cache por (versão da base, faixa, idade).
+
+
+class DoseTable:
+    """Regras de dose do catálogo compiladas em arrays (uma linha por medicamento)."""
+
+    def __init__(self, drugs: dict):
+        items = sorted(drugs.values(), key=lambda d: d["id"])
+        peds = [d.get("pediatria") or {} for d in items]
+
+        self.ids = [d["id"] for d in items]
+        self.names = [d["nome"] for d in items]
+        self.has_ped = np.array([bool(p) for p in peds], dtype=bool)
+        self.per_dose = np.array([p.get("modo") == "mg_kg_dose" for p in peds], dtype=bool)
+        self.min_mg_kg = np.array([p.get("min") or 0.0 for p in peds], dtype=np.float64)
+        self.max_mg_kg = np.array([p.get("max") or 0.0 for p in peds], dtype=np.float64)
+        self.ceiling_mg = np.array([p.get("teto_dose") or 0.0 for p in peds], dtype=np.float64)
+        self.conc = np.array([d.get("concentracao_mg_ml") or 0.0 for d in items], dtype=np.float64)
+        self.min_age = np.array([d.get("min_idade_meses") or 0 for d in items], dtype=np.int64)
+        self.adult_max = np.array([d.get("dose_max_diaria_adulto_mg") or 0.0 for d in items], dtype=np.float64)
+
+    def compute(self, weight_kg: float, age_months: int) -> list:
+        child = age_months < CHILD_AGE_LIMIT_MONTHS
+
+        if child:
+            min_mg = self.min_mg_kg * weight_kg
+            max_mg = self.max_mg_kg * weight_kg
+            # Teto absoluto, comparado na mesma unidade da regra (dose ou dia), como na engine
+            capped = self.ceiling_mg > 0
+            max_mg = np.where(capped, np.minimum(max_mg, self.ceiling_mg), max_mg)
+            min_mg = np.minimum(min_mg, max_mg)
+            available = self.has_ped
+        else:
+            min_mg = np.zeros_like(self.adult_max)
+            max_mg = self.adult_max
+            capped = np.zeros_like(self.has_ped)
+            available = self.adult_max > 0
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            has_conc = self.conc > 0
+            min_ml = np.where(has_conc, min_mg / self.conc, np.nan)
+            max_ml = np.where(has_conc, max_mg / self.conc, np.nan)
+
+        ceiling_hit = capped & (max_mg == self.ceiling_mg)
+        per_dose = self.per_dose if child else np.zeros_like(self.per_dose)
+
+        # Conversão para listas Python de uma vez (indexar arrays item a item é lento)
+        cols = zip(
+            self.ids, self.names, (age_months < self.min_age).tolist(), available.tolist(),
+            per_dose.tolist(), np.round(min_mg, 4).tolist(), np.round(max_mg, 4).tolist(),
+            np.round(min_ml, 4).tolist(), np.round(max_ml, 4).tolist(), ceiling_hit.tolist(),
+        )
+        rows = []
+        for drug_id, name, too_young, ok, dose, mn, mx, mn_ml, mx_ml, hit in cols:
+            row = {"drug_id": drug_id, "nome": name, "abaixo_idade_minima": too_young}
+            if ok:
+                row.update({
+                    "por": "dose" if dose else "dia",
+                    "min_mg": mn,
+                    "max_mg": mx,
+                    "min_ml": None if math.isnan(mn_ml) else mn_ml,
+                    "max_ml": None if math.isnan(mx_ml) else mx_ml,
+                    "teto_aplicado": hit,
+                })
+            else:
+                row["sem_regra"] = True
+            rows.append(row)
+        return rows
+
+
+class TenantDoseTable:
+    """
+    Tabela de um formulário local sem recompilar o catálogo: a tabela da
+    base é calculada como sempre e as linhas dos medicamentos sobrescritos
+    são trocadas pelas da tabela local (só os medicamentos do hospital).
+    """
+
+    def __init__(self, base: DoseTable, local_drugs: dict):
+        self.base = base
+        self.local = DoseTable(local_drugs)
+        self.hidden = set(local_drugs)
+
+    def compute(self, weight_kg: float, age_months: int) -> list:
+        shared = (row for row in self.base.compute(weight_kg, age_months) if row["drug_id"] not in self.hidden)
+        # As duas listas já saem ordenadas por ID
+        return list(heapq.merge(shared, self.local.compute(weight_kg, age_months), key=lambda row: row["drug_id"]))
+
+
+class DoseSheetCache:
+    """LRU das tabelas já serializadas (bytes JSON), por tenant/versão/faixa/idade."""
+
+    def __init__(self, band_kg: float, max_entries: int = 512):
+        self.band_kg = band_kg
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def band(self, weight_kg: float) -> float:
+        # Pequena tolerância para 12.0 / 0.5 não cair em 23.999...
+        band = round(math.floor(weight_kg / self.band_kg + 1e-9) * self.band_kg, 4)
+        # Abaixo da primeira faixa (prematuros) usa o peso exato
+        return band if band > 0 else weight_kg
+
+    def get(self, kb, weight_kg: float, age_months: int) -> bytes:
+        band = self.band(weight_kg)
+        key = (kb.tenant, kb.version, band, age_months)
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                metrics.record_cache("dose_sheet", True)
+                return body
+
+        metrics.record_cache("dose_sheet", False)
+        body = json.dumps({
+            "kb_version": kb.version,
+            "weight_band_kg": band,
+            "age_months": age_months,
+            "pediatric": age_months < CHILD_AGE_LIMIT_MONTHS,
+            "drugs": kb.dose_table.compute(band, age_months),
+        }, ensure_ascii=False).encode("utf-8")
+
+        with self._lock:
+            self._entries[key] = body
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return body
@@ -12,25 +12,193 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List, Dict
+from collections import ChainMap
+from typing import Dict, Iterable, List, Optional
+
+from src.icd10 import IcdTrie, expand_rule
+
+# Abaixo desta idade valem as regras pediátricas (mg/kg)
+CHILD_AGE_LIMIT_MONTHS = 144
+
+# Condição que libera Adrenalina IV (regra fatal da camada 1)
+PCR_CONDITION = "parada_cardiaca"
+
+
+class Vocabulary:
+    """
+    Internamento de strings em IDs inteiros. Um conjunto de termos vira um
+    bitset (int Python): o bit i ligado = termo de ID i presente.
+    Termos desconhecidos são ignorados (não casam com nada da base).
+
+    Com `parent`, é uma extensão do vocabulário pai (que não muda mais):
+    termos do pai mantêm o ID e os novos continuam a numeração.
+    """
+
+    def __init__(self, parent: Optional["Vocabulary"] = None):
+        self.parent = parent
+        self.offset = len(parent) if parent is not None else 0
+        self.ids: Dict[str, int] = {}
+        self.terms: List[str] = []
+
+    def __len__(self):
+        return self.offset + len(self.terms)
+
+    def get(self, term: str) -> Optional[int]:
+        tid = self.ids.get(term)
+        if tid is None and self.parent is not None:
+            tid = self.parent.get(term)
+        return tid
+
+    def term(self, tid: int) -> str:
+        return self.terms[tid - self.offset] if tid >= self.offset else self.parent.term(tid)
+
+    def add(self, term: str) -> int:
+        tid = self.get(term)
+        if tid is None:
+            tid = len(self)
+            self.ids[term] = tid
+            self.terms.append(term)
+        return tid
+
+    def add_mask(self, terms: Iterable[str]) -> int:
+        mask = 0
+        for t in terms:
+            mask |= 1 << self.add(t)
+        return mask
+
+    def mask(self, terms: Iterable[str]) -> int:
+        mask = 0
+        for t in terms:
+            tid = self.get(t)
+            if tid is not None:
+                mask |= 1 << tid
+        return mask
+
+    def decode(self, mask: int) -> List[str]:
+        out = []
+        while mask:
+            low = mask & -mask
+            out.append(self.term(low.bit_length() - 1))
+            mask ^= low
+        return out
+
+
+class CompiledDrug:
+    """Campos de conjunto de um medicamento já como bitsets/IDs."""
+
+    __slots__ = ("allergy_mask", "cross_mask", "contra_mask", "class_bit", "principle_id", "principle_bit", "routes")
+
+    def __init__(self, allergy_mask, cross_mask, contra_mask, class_bit, principle_id, routes):
+        self.allergy_mask = allergy_mask
+        self.cross_mask = cross_mask
+        self.contra_mask = contra_mask
+        self.class_bit = class_bit
+        self.principle_id = principle_id
+        self.principle_bit = 1 << principle_id
+        self.routes = routes
+
 
 class ClinicalEngine:
-    def __init__(self, drugs_dict, interactions_list):
-        self.drugs = drugs_dict
-        self.interactions = interactions_list
+    """
+    Sem `base`, compila o catálogo inteiro. Com `base`, é uma camada por
+    cima de outra engine já compilada (formulário local de um hospital):
+    compila só os medicamentos e interações da camada, e o resto é lido
+    da base. A base não é alterada.
+    """
+
+    def __init__(self, drugs_dict, interactions_list, base: Optional["ClinicalEngine"] = None):
+        self.base = base
+        self.interactions = interactions_list  # só as regras desta camada
+
+        # Vocabulários da base: cada string distinta vira um ID inteiro
+        # (numa camada, extensões dos vocabulários da base)
+        self.allergies = Vocabulary(base.allergies if base else None)
+        self.conditions = Vocabulary(base.conditions if base else None)
+        self.classes = Vocabulary(base.classes if base else None)
+        self.principles = Vocabulary(base.principles if base else None)
+        self.conditions.add(PCR_CONDITION)
+
+        # Contraindicações em CID-10 (código ou intervalo) também vão para a
+        # árvore de prefixos, apontando para o mesmo ID do vocabulário
+        self.icd = IcdTrie()
+
+        compiled: Dict[str, CompiledDrug] = {}
+        for drug_id, d in drugs_dict.items():
+            for term in d['contra_indicacoes'] or []:
+                self._add_icd_rule(term)
+            compiled[drug_id] = CompiledDrug(
+                allergy_mask=self.allergies.add_mask(d['familias_alergia'] or []),
+                # Já expandido pelo fecho da reatividade cruzada (knowledge_base.py)
+                cross_mask=self.allergies.add_mask(d.get('familias_reacao_cruzada') or []),
+                contra_mask=self.conditions.add_mask(d['contra_indicacoes'] or []),
+                class_bit=1 << self.classes.add(d['classe_terapeutica']),
+                principle_id=self.principles.add(d['principio_ativo']),
+                routes=frozenset(d['vias_permitidas'] or []),
+            )
+
+        if base is None:
+            self.drugs = drugs_dict
+            self.compiled = compiled
+        else:
+            # Medicamentos da camada encobrem os da base com o mesmo ID
+            self.drugs = ChainMap(drugs_dict, base.drugs)
+            self.compiled = ChainMap(compiled, base.compiled)
+
+        # Interações: (bitset do par, índice da regra); indexadas por princípio
+        # para só olhar as regras dos princípios ativos do paciente
+        self._rule_masks = []
+        self._rules_by_principle: Dict[int, List[int]] = {}
+        for idx, rule in enumerate(interactions_list):
+            mask = self.principles.add_mask(rule['pair'])
+            self._rule_masks.append(mask)
+            for pid in {self.principles.get(p) for p in rule['pair']}:
+                self._rules_by_principle.setdefault(pid, []).append(idx)
+
+        self._pcr_bit = 1 << self.conditions.get(PCR_CONDITION)
+
+    def _add_icd_rule(self, term: str):
+        try:
+            prefixes = expand_rule(term)
+        except ValueError:
+            prefixes = None  # intervalo malformado: fica só como rótulo exato
+        if prefixes:
+            bit = 1 << self.conditions.add(term)
+            for prefix in prefixes:
+                self.icd.add(prefix, bit)
+
+    def _condition_mask(self, terms: List[str]) -> int:
+        mask = self.conditions.mask(terms)
+        layer = self
+        while layer is not None:
+            mask |= layer.icd.match_all(terms)
+            layer = layer.base
+        return mask
+
+    def _matching_rules(self, active_mask: int, active_ids: Iterable[int]) -> List[dict]:
+        # Regras da base primeiro, depois as da camada (ordem de cadastro)
+        rules = self.base._matching_rules(active_mask, active_ids) if self.base is not None else []
+        found = set()
+        for pid in active_ids:
+            for idx in self._rules_by_principle.get(pid, ()):
+                mask = self._rule_masks[idx]
+                if mask & active_mask == mask:
+                    found.add(idx)
+        rules.extend(self.interactions[idx] for idx in sorted(found))
+        return rules
 
     def validate(self, patient, prescription):
         alerts = []
         drug = self.drugs.get(prescription['drug_id'])
-        if not drug: return [{"type": "WARNING", "msg": f"Medicamento ID {prescription['drug_id']} não encontrado."}]
+        if not drug: return [{"type": "WARNING", "layer": "cadastro", "code": "MEDICAMENTO_NAO_CADASTRADO", "msg": f"Medicamento ID {prescription['drug_id']} não encontrado."}]
+        cd = self.compiled[prescription['drug_id']]
 
         # Dados
         weight = patient['weight_kg']
         age_months = patient['age_months']
-        conditions = set(patient['conditions'])
-        allergies = set(patient['allergies'])
-        current_meds = patient['current_meds'] # Lista de IDs
-        
+        conditions = self._condition_mask(patient['conditions'])
+        allergies = self.allergies.mask(patient['allergies'])
+        current_meds = [self.compiled[mid] for mid in patient['current_meds'] if mid in self.compiled] # Lista de IDs
+
         dose_input = prescription['dose_input']
         route = prescription['route']
         freq = prescription['freq_hours']
@@ -39,41 +207,47 @@ class ClinicalEngine:
         dose_mg = dose_input * drug['concentracao_mg_ml'] if drug['concentracao_mg_ml'] else dose_input
 
         # --- CAMADA 1: VIA ---
-        if route not in drug['vias_permitidas']:
-            alerts.append({"type": "BLOCK", "msg": f"⛔ ERRO DE VIA: {drug['nome']} permite apenas {drug['vias_permitidas']}."})
+        if route not in cd.routes:
+            alerts.append({"type": "BLOCK", "layer": "via", "code": "VIA_NAO_PERMITIDA", "msg": f"⛔ ERRO DE VIA: {drug['nome']} permite apenas {drug['vias_permitidas']}."})
         
         # Regra Fatal Adrenalina
-        if "Adrenalina" in drug['nome'] and route == "Endovenosa (IV)" and "parada_cardiaca" not in conditions:
-             alerts.append({"type": "BLOCK", "msg": "⛔ ERRO FATAL: Adrenalina IV só permitida em Parada Cardíaca (PCR)."})
+        if "Adrenalina" in drug['nome'] and route == "Endovenosa (IV)" and not conditions & self._pcr_bit:
+             alerts.append({"type": "BLOCK", "layer": "via", "code": "ADRENALINA_IV_SEM_PCR", "msg": "⛔ ERRO FATAL: Adrenalina IV só permitida em Parada Cardíaca (PCR)."})
 
         # --- CAMADA 2: IDADE ---
         if age_months < drug['min_idade_meses']:
-            alerts.append({"type": "BLOCK", "msg": f"⛔ PROIBIDO PARA IDADE ({age_months} meses)."})
+            alerts.append({"type": "BLOCK", "layer": "idade", "code": "IDADE_MINIMA", "msg": f"⛔ PROIBIDO PARA IDADE ({age_months} meses)."})
 
         # --- CAMADA 3: ALERGIAS ---
-        match_alg = set(drug['familias_alergia']).intersection(allergies)
-        if match_alg: alerts.append({"type": "BLOCK", "msg": f"⛔ ALERGIA DETECTADA: {list(match_alg)}."})
+        match_alg = cd.allergy_mask & allergies
+        if match_alg: alerts.append({"type": "BLOCK", "layer": "alergia", "code": "ALERGIA", "msg": f"⛔ ALERGIA DETECTADA: {self.allergies.decode(match_alg)}."})
+
+        match_cross = cd.cross_mask & allergies
+        if match_cross: alerts.append({"type": "WARNING", "layer": "alergia", "code": "ALERGIA_CRUZADA", "msg": f"⚠️ POSSÍVEL REAÇÃO CRUZADA: alergia a {self.allergies.decode(match_cross)} e medicamento da família {drug['familias_alergia']}."})
 
-        # --- CAMADA 4: CONTRAINDICAÇÕES ---
-        match_cond = set(drug['contra_indicacoes']).intersection(conditions)
-        if match_cond: alerts.append({"type": "BLOCK", "msg": f"⛔ CONTRAINDICADO PARA: {list(match_cond)}."})
+        # --- CAMADA 4: CONTRAINDICAÇÕES (rótulo exato ou prefixo CID-10) ---
+        match_cond = cd.contra_mask & conditions
+        if match_cond: alerts.append({"type": "BLOCK", "layer": "contraindicacao", "code": "CONTRAINDICACAO", "msg": f"⛔ CONTRAINDICADO PARA: {self.conditions.decode(match_cond)}."})
 
         # --- CAMADA 5: DUPLICIDADE ---
-        existing_classes = {self.drugs[mid]['classe_terapeutica'] for mid in current_meds if mid in self.drugs}
-        if drug['classe_terapeutica'] in existing_classes:
-            alerts.append({"type": "WARNING", "msg": f"⚠️ DUPLICIDADE: Classe '{drug['classe_terapeutica']}' já em uso."})
+        existing_classes = 0
+        for med in current_meds:
+            existing_classes |= med.class_bit
+        if cd.class_bit & existing_classes:
+            alerts.append({"type": "WARNING", "layer": "duplicidade", "code": "DUPLICIDADE_TERAPEUTICA", "msg": f"⚠️ DUPLICIDADE: Classe '{drug['classe_terapeutica']}' já em uso."})
 
         # --- CAMADA 6: INTERAÇÕES ---
-        active_principles = {drug['principio_ativo']}
-        for mid in current_meds:
-            if mid in self.drugs: active_principles.add(self.drugs[mid]['principio_ativo'])
-        
-        for rule in self.interactions:
-            if rule['pair'].issubset(active_principles):
-                alerts.append({"type": "BLOCK" if rule['level'] == 'ALTO' else "WARNING", "msg": rule['msg']})
+        active_principles = cd.principle_bit
+        active_ids = {cd.principle_id}
+        for med in current_meds:
+            active_principles |= med.principle_bit
+            active_ids.add(med.principle_id)
+
+        for rule in self._matching_rules(active_principles, active_ids):
+            alerts.append({"type": "BLOCK" if rule['level'] == 'ALTO' else "WARNING", "layer": "interacao", "code": "INTERACAO", "msg": rule['msg']})
 
         # --- CAMADA 7: POSOLOGIA ---
-        is_child = age_months < 144
+        is_child = age_months < CHILD_AGE_LIMIT_MONTHS
         ped_rule = drug.get('pediatria')
         
         if is_child and ped_rule:
@@ -84,16 +258,16 @@ class ClinicalEngine:
             val = round(raw_val, 4)
             
             if ped_rule.get('teto_dose', 0) > 0 and val > ped_rule['teto_dose']:
-                alerts.append({"type": "BLOCK", "msg": f"⛔ TETO ABSOLUTO EXCEDIDO: {val}mg > {ped_rule['teto_dose']}mg."})
+                alerts.append({"type": "BLOCK", "layer": "posologia", "code": "TETO_DOSE_EXCEDIDO", "msg": f"⛔ TETO ABSOLUTO EXCEDIDO: {val}mg > {ped_rule['teto_dose']}mg."})
             elif val > max_dose:
-                alerts.append({"type": "BLOCK", "msg": f"⛔ SOBREDOSE TÓXICA: {val}mg > {max_dose}mg."})
+                alerts.append({"type": "BLOCK", "layer": "posologia", "code": "SOBREDOSE", "msg": f"⛔ SOBREDOSE TÓXICA: {val}mg > {max_dose}mg."})
             elif val < min_dose:
-                alerts.append({"type": "WARNING", "msg": f"⚠️ SUBDOSE: {val}mg < {min_dose}mg."})
+                alerts.append({"type": "WARNING", "layer": "posologia", "code": "SUBDOSE", "msg": f"⚠️ SUBDOSE: {val}mg < {min_dose}mg."})
         
         elif not is_child:
              val_adulto = round(dose_mg * (24/freq), 4)
              if val_adulto > drug['dose_max_diaria_adulto_mg']:
-                 alerts.append({"type": "BLOCK", "msg": "⛔ DOSE MÁXIMA ADULTO EXCEDIDA."})
+                 alerts.append({"type": "BLOCK", "layer": "posologia", "code": "DOSE_MAX_ADULTO", "msg": "⛔ DOSE MÁXIMA ADULTO EXCEDIDA."})
 
 
         return alerts
@@ -0,0 +1,331 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+
+from src import metrics
+
+# ==============================================================================
+# EXPLICAÇÃO DE ALERTAS (CACHE VERSIONADO)
+# ==============================================================================
+#
+# Uma explicação é gerada por (medicamento, código do alerta) e guardada com
+# a "impressão" da regra que a originou: hash dos campos do medicamento e
+# das interações que a regra usa. Se a regra muda no banco, a impressão muda
+# e a explicação guardada passa a ser "stale" até ser regenerada.
+#
+# No caminho da requisição nada é gerado: a explicação vem da memória ou do
+# banco. Sem explicação guardada, a resposta traz a explicação montada da
+# própria regra (instantânea) e, se houver LLM configurado, a geração é
+# disparada em segundo plano para as próximas chamadas.
+#
+# As explicações com trechos de protocolo (RAG) são pré-calculadas offline
+# por test_rag_Fusion-in-Decoder/precompute_explanations.py.
+
+# Incrementar quando o formato/prompt das explicações mudar (invalida todas)
+EXPLANATION_VERSION = 1
+
+CODE_LABELS = {
+    "MEDICAMENTO_NAO_CADASTRADO": "medicamento não cadastrado",
+    "VIA_NAO_PERMITIDA": "via de administração não permitida",
+    "ADRENALINA_IV_SEM_PCR": "adrenalina endovenosa fora de parada cardíaca",
+    "IDADE_MINIMA": "idade mínima",
+    "ALERGIA": "alergia",
+    "ALERGIA_CRUZADA": "reação alérgica cruzada",
+    "CONTRAINDICACAO": "contraindicação",
+    "DUPLICIDADE_TERAPEUTICA": "duplicidade terapêutica",
+    "INTERACAO": "interação medicamentosa",
+    "TETO_DOSE_EXCEDIDO": "teto absoluto de dose",
+    "SOBREDOSE": "sobredose",
+    "SUBDOSE": "subdose",
+    "DOSE_MAX_ADULTO": "dose máxima diária do adulto",
+}
+
+# Campos do medicamento que cada regra usa (entram na impressão)
+_RULE_FIELDS = {
+    "VIA_NAO_PERMITIDA": ("vias_permitidas",),
+    "ADRENALINA_IV_SEM_PCR": ("nome", "vias_permitidas"),
+    "IDADE_MINIMA": ("min_idade_meses",),
+    "ALERGIA": ("familias_alergia",),
+    "ALERGIA_CRUZADA": ("familias_alergia", "familias_reacao_cruzada"),
+    "CONTRAINDICACAO": ("contra_indicacoes",),
+    "DUPLICIDADE_TERAPEUTICA": ("classe_terapeutica",),
+    "INTERACAO": ("principio_ativo",),
+    "TETO_DOSE_EXCEDIDO": ("pediatria", "concentracao_mg_ml"),
+    "SOBREDOSE": ("pediatria", "concentracao_mg_ml"),
+    "SUBDOSE": ("pediatria", "concentracao_mg_ml"),
+    "DOSE_MAX_ADULTO": ("dose_max_diaria_adulto_mg", "concentracao_mg_ml"),
+}
+
+
+def _drug_interactions(drug: dict, interactions: list) -> list:
+    principle = drug["principio_ativo"]
+    return [
+        {"substancias": sorted(rule["pair"]), "nivel": rule["level"], "mensagem": rule["msg"]}
+        for rule in interactions
+        if principle in rule["pair"]
+    ]
+
+
+def applicable_codes(drug: dict, interactions: list) -> List[str]:
+    """Códigos de alerta que este medicamento pode disparar."""
+    codes = ["VIA_NAO_PERMITIDA", "DUPLICIDADE_TERAPEUTICA"]
+    if "Adrenalina" in drug["nome"]:
+        codes.append("ADRENALINA_IV_SEM_PCR")
+    if drug.get("min_idade_meses"):
+        codes.append("IDADE_MINIMA")
+    if drug.get("familias_alergia"):
+        codes.append("ALERGIA")
+    if drug.get("familias_reacao_cruzada"):
+        codes.append("ALERGIA_CRUZADA")
+    if drug.get("contra_indicacoes"):
+        codes.append("CONTRAINDICACAO")
+    if _drug_interactions(drug, interactions):
+        codes.append("INTERACAO")
+    ped = drug.get("pediatria")
+    if ped:
+        codes += ["SOBREDOSE", "SUBDOSE"]
+        if ped.get("teto_dose"):
+            codes.append("TETO_DOSE_EXCEDIDO")
+    # A engine sempre compara a dose do adulto (máximo zero dispara com qualquer dose)
+    codes.append("DOSE_MAX_ADULTO")
+    return codes
+
+
+def rule_facts(drug: dict, code: str, interactions: list) -> dict:
+    """Os dados da base que a regra usa (o que a explicação precisa citar)."""
+    facts = {field: drug.get(field) for field in _RULE_FIELDS.get(code, ())}
+    if code == "INTERACAO":
+        facts["interacoes"] = _drug_interactions(drug, interactions)
+    return facts
+
+
+def rule_fingerprint(drug: dict, code: str, interactions: list) -> str:
+    payload = json.dumps(
+        {"v": EXPLANATION_VERSION, "drug": drug["id"], "code": code, "facts": rule_facts(drug, code, interactions)},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=list,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def rule_explanation(drug: dict, code: str, interactions: list) -> Tuple[str, list]:
+    """
+    Explicação determinística montada da própria regra da base.
+    Devolve (texto, fontes).
+    """
+    nome = drug["nome"]
+    ped = drug.get("pediatria") or {}
+    facts = rule_facts(drug, code, interactions)
+
+    if code == "VIA_NAO_PERMITIDA":
+        text = f"{nome} está cadastrado apenas para as vias: {', '.join(drug['vias_permitidas'] or [])}."
+    elif code == "ADRENALINA_IV_SEM_PCR":
+        text = (f"{nome} por via endovenosa só é aceita em parada cardiorrespiratória "
+                "(condição 'parada_cardiaca'); fora dela o risco de arritmia grave justifica o bloqueio.")
+    elif code == "IDADE_MINIMA":
+        text = f"{nome} não é indicado abaixo de {drug['min_idade_meses']} meses de idade."
+    elif code == "ALERGIA":
+        text = (f"{nome} pertence às famílias de alergia {', '.join(drug['familias_alergia'] or [])}; "
+                "paciente com alergia registrada a uma delas não deve recebê-lo.")
+    elif code == "ALERGIA_CRUZADA":
+        text = (f"{nome} pertence às famílias {', '.join(drug['familias_alergia'] or [])}, com reatividade "
+                f"cruzada cadastrada para alergia a {', '.join(drug['familias_reacao_cruzada'])}; "
+                "o risco é menor que o da alergia direta, por isso o alerta é de atenção.")
+    elif code == "CONTRAINDICACAO":
+        text = f"{nome} é contraindicado em: {', '.join(drug['contra_indicacoes'] or [])}."
+    elif code == "DUPLICIDADE_TERAPEUTICA":
+        text = (f"{nome} é da classe '{drug['classe_terapeutica']}'; o paciente já usa outro "
+                "medicamento da mesma classe.")
+    elif code == "INTERACAO":
+        lines = [f"{' + '.join(i['substancias'])} ({i['nivel']}): {i['mensagem']}" for i in facts["interacoes"]]
+        text = f"Interações cadastradas para {drug['principio_ativo']}: " + "; ".join(lines) + "."
+    elif code in ("SOBREDOSE", "SUBDOSE") and ped:
+        unit = "mg/kg por dose" if ped.get("modo") == "mg_kg_dose" else "mg/kg por dia"
+        text = (f"Em pediatria (< 12 anos), a faixa de {nome} é {ped['min']} a {ped['max']} {unit}, "
+                "calculada sobre o peso do paciente.")
+    elif code == "TETO_DOSE_EXCEDIDO" and ped:
+        text = f"Independentemente do peso, a dose pediátrica de {nome} não pode passar de {ped['teto_dose']} mg."
+    elif code == "DOSE_MAX_ADULTO":
+        text = f"A dose máxima diária de {nome} para adultos é {drug['dose_max_diaria_adulto_mg']} mg."
+    else:
+        text = f"Alerta '{CODE_LABELS.get(code, code)}' disparado pela regra cadastrada para {nome}."
+
+    sources = [{"type": "regra", "drug_id": drug["id"], "facts": facts}]
+    return text, sources
+
+
+# ==============================================================================
+# SERVIÇO (MEMÓRIA -> BANCO -> PREENCHIMENTO ASSÍNCRONO)
+# ==============================================================================
+
+Generator = Callable[[dict, str, str], Awaitable[str]]
+
+
+class ExplanationService:
+    """
+    Camadas: memória do processo (LRU) -> tabela explicacao_alerta -> regra.
+
+    Ausência no banco também fica em memória por `recheck_seconds`, para que
+    alertas sem explicação pré-calculada não consultem o banco a cada
+    chamada; explicações gravadas por outro processo (ex.: o script offline)
+    aparecem depois desse intervalo.
+    """
+
+    def __init__(self, db_manager, generate: Optional[Generator] = None,
+                 max_concurrency: int = 2, memory_entries: int = 10_000,
+                 recheck_seconds: float = 60.0):
+        self.db_manager = db_manager
+        self.generate = generate
+        self.memory_entries = memory_entries
+        self.recheck_seconds = recheck_seconds
+        self._memory = OrderedDict()  # (drug_id, code) -> (checado_em, explicação ou None)
+        self._inflight = set()
+        self._tasks = set()
+        self._sem = asyncio.Semaphore(max_concurrency)
+
+    def _remember(self, key, entry: Optional[dict]):
+        self._memory[key] = (time.monotonic(), entry)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def _stored(self, key, fingerprint: str) -> Optional[dict]:
+        cached = self._memory.get(key)
+        if cached is not None:
+            checked_at, entry = cached
+            valid = entry is not None and entry["fingerprint"] == fingerprint
+            if valid or time.monotonic() - checked_at < self.recheck_seconds:
+                metrics.record_cache("alert_explanation", valid)
+                return entry
+
+        metrics.record_cache("alert_explanation", False)
+        entry = await run_in_threadpool(self.db_manager.get_explanation, *key)
+        self._remember(key, entry)
+        return entry
+
+    async def explain(self, kb, drug_id: str, code: str) -> dict:
+        drug = kb.drugs.get(drug_id)
+        if drug is None:
+            return {"drug_id": drug_id, "code": code, "status": "not_found",
+                    "text": f"Medicamento {drug_id} não encontrado na base.", "sources": []}
+        if code not in CODE_LABELS or code not in applicable_codes(drug, kb.interactions):
+            # Regra que este medicamento não tem: nada a explicar nem a gerar
+            return {"drug_id": drug_id, "code": code, "status": "not_applicable",
+                    "text": f"O alerta {code} não se aplica a {drug['nome']} na base atual.", "sources": []}
+
+        fingerprint = rule_fingerprint(drug, code, kb.interactions)
+        if kb.tenant is not None and self._differs_from_base(kb, drug_id, code, fingerprint):
+            # Regra do formulário local: o cache é o da base compartilhada,
+            # então a explicação sai da própria regra do hospital
+            text, sources = rule_explanation(drug, code, kb.interactions)
+            return self._response(drug_id, code, "ready",
+                                  {"text": text, "sources": sources, "origin": "regra", "fingerprint": fingerprint})
+
+        entry = await self._stored((drug_id, code), fingerprint)
+
+        if entry is not None and entry["fingerprint"] == fingerprint:
+            return self._response(drug_id, code, "ready", entry)
+
+        # Sem explicação válida: devolve a da regra agora e gera em segundo plano
+        text, sources = rule_explanation(drug, code, kb.interactions)
+        self._schedule_fill(drug, code, fingerprint, text, sources)
+        fallback = {"text": text, "sources": sources, "origin": "regra", "fingerprint": fingerprint}
+        if entry is not None:
+            # Texto anterior (de uma versão antiga da regra) vai junto, marcado
+            return {**self._response(drug_id, code, "stale", entry), "rule": fallback}
+        status = "pending" if self.generate else "ready"
+        return self._response(drug_id, code, status, fallback)
+
+    @staticmethod
+    def _differs_from_base(kb, drug_id: str, code: str, fingerprint: str) -> bool:
+        base_drug = kb.base.drugs.get(drug_id)
+        return base_drug is None or rule_fingerprint(base_drug, code, kb.base.interactions) != fingerprint
+
+    @staticmethod
+    def _response(drug_id: str, code: str, status: str, entry: dict) -> dict:
+        return {
+            "drug_id": drug_id,
+            "code": code,
+            "label": CODE_LABELS.get(code, code),
+            "status": status,
+            "origin": entry["origin"],
+            "text": entry["text"],
+            "sources": entry["sources"],
+            "fingerprint": entry["fingerprint"],
+        }
+
+    def _schedule_fill(self, drug: dict, code: str, fingerprint: str, rule_text: str, sources: list):
+        key = (drug["id"], code, fingerprint)
+        if self.generate is None or key in self._inflight:
+            return
+        self._inflight.add(key)
+        task = asyncio.create_task(self._fill(drug, code, fingerprint, rule_text, sources))
+        # Referência forte até terminar (o event loop só guarda referência fraca)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fill(self, drug: dict, code: str, fingerprint: str, rule_text: str, sources: list):
+        try:
+            async with self._sem:
+                text = await self.generate(drug, code, rule_text)
+                entry = {"text": text, "sources": sources, "origin": "llm", "fingerprint": fingerprint}
+                await run_in_threadpool(self.db_manager.save_explanation, drug["id"], code, entry)
+                self._remember((drug["id"], code), entry)
+                metrics.EXPLANATION_FILLS.labels("ok").inc()
+        except Exception:
+            metrics.EXPLANATION_FILLS.labels("error").inc()
+        finally:
+            self._inflight.discard((drug["id"], code, fingerprint))
+
+
+# ==============================================================================
+# GERAÇÃO VIA LLM (OLLAMA)
+# ==============================================================================
+
+EXPLAIN_PROMPT = """Você explica alertas de um sistema de apoio à prescrição para médicos e farmacêuticos.
+Explique em até 3 frases, em português, por que o alerta abaixo foi disparado.
+Use SOMENTE a regra fornecida; não invente doses nem referências.
+
+Medicamento: {nome} ({principio})
+Alerta: {label}
+Regra cadastrada: {rule}
+
+Explicação:"""
+
+
+class OllamaExplainer:
+    def __init__(self, base_url: str, model: str, timeout: float = 120.0):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+
+    async def __call__(self, drug: dict, code: str, rule_text: str) -> str:
+        prompt = EXPLAIN_PROMPT.format(
+            nome=drug["nome"], principio=drug["principio_ativo"],
+            label=CODE_LABELS.get(code, code), rule=rule_text,
+        )
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout) as client:
+            response = await client.post("/generate", json={"model": self.model, "prompt": prompt, "stream": False})
+            response.raise_for_status()
+            return response.json().get("response", "").strip()
@@ -0,0 +1,443 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import traceback
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, List, Optional
+
+from src import metrics
+from src.engine import CHILD_AGE_LIMIT_MONTHS
+
+# ==============================================================================
+# ADAPTADOR HL7 FHIR (Bundle -> ClinicalEngine)
+# ==============================================================================
+
+# Sistema de codificação usado para carregar o ID interno do ValidRx
+# em MedicationRequest.medicationCodeableConcept.coding
+VALIDRX_DRUG_SYSTEM = "urn:validrx:drug"
+GTIN_SYSTEM = "http://www.gs1.org/gtin"
+ALERT_LAYER_SYSTEM = "urn:validrx:alert-layer"
+
+# LOINC 29463-7 = Peso corporal
+BODY_WEIGHT_LOINC = "29463-7"
+
+# Conversão de FHIR Timing.repeat.periodUnit para horas
+PERIOD_UNIT_HOURS = {
+    "s": 1 / 3600,
+    "min": 1 / 60,
+    "h": 1,
+    "d": 24,
+    "wk": 24 * 7,
+    "mo": 24 * 30.4375,  # mês UCUM (1/12 do ano juliano)
+    "a": 24 * 365.25,
+}
+
+# Unidades de doseQuantity (UCUM e grafias comuns) -> (unidade da engine, fator).
+# A engine recebe mL; dose em massa é convertida pela concentração do medicamento.
+DOSE_UNITS = {
+    "ml": ("mL", 1.0),
+    "l": ("mL", 1000.0),
+    "mg": ("mg", 1.0),
+    "g": ("mg", 1000.0),
+    "ug": ("mg", 0.001),
+    "mcg": ("mg", 0.001),
+    "µg": ("mg", 0.001),
+}
+
+
+def _ref_id(reference: Optional[dict]) -> Optional[str]:
+    """'Patient/123' -> '123'. Aceita também 'urn:uuid:...' como ID."""
+    if not reference:
+        return None
+    ref = reference.get("reference")
+    if not ref:
+        return None
+    return ref.split("/", 1)[1] if ref.startswith("Patient/") else ref
+
+
+def _concept_terms(concept: Optional[dict]) -> List[str]:
+    """
+    Todos os termos de um CodeableConcept (códigos, displays e texto).
+    Ex: CID-10 "J00" e o texto livre "resfriado" entram ambos.
+    """
+    if not concept:
+        return []
+    terms = []
+    for coding in concept.get("coding", []):
+        for key in ("code", "display"):
+            if coding.get(key):
+                terms.append(str(coding[key]).strip())
+    if concept.get("text"):
+        terms.append(str(concept["text"]).strip())
+    return terms
+
+
+def _age_in_months(birth_date: str, today: date) -> int:
+    # birthDate pode vir como "2019", "2019-05" ou "2019-05-20" (hora, se vier, é ignorada)
+    parts = [int(p) for p in str(birth_date)[:10].split("-")]
+    year, month, day = (parts + [1, 1])[:3]
+    months = (today.year - year) * 12 + (today.month - month)
+    if today.day < day:
+        months -= 1
+    return max(months, 0)
+
+
+def _as_float(value):
+    # ijson entrega números como Decimal
+    return float(value) if value is not None else None
+
+
+def map_medication_request(resource: dict) -> dict:
+    """
+    Converte um MedicationRequest no dicionário de item de prescrição
+    usado pela API (mesmos campos de PrescriptionItem).
+    A rota é devolvida crua (sigla/texto); a normalização fica com a API.
+    """
+    concept = resource.get("medicationCodeableConcept") or {}
+    drug_id = None
+    ean = ""
+    for coding in concept.get("coding", []):
+        if coding.get("system") == VALIDRX_DRUG_SYSTEM:
+            drug_id = coding.get("code")
+        elif coding.get("system") == GTIN_SYSTEM:
+            ean = coding.get("code", "")
+    if drug_id is None:
+        codings = concept.get("coding", [])
+        if codings:
+            drug_id = codings[0].get("code")
+        elif resource.get("medicationReference"):
+            drug_id = resource["medicationReference"].get("reference", "").split("/")[-1]
+
+    dosage = (resource.get("dosageInstruction") or [{}])[0]
+    dose_qty = ((dosage.get("doseAndRate") or [{}])[0]).get("doseQuantity") or {}
+    route_concept = dosage.get("route") or {}
+    route_codings = route_concept.get("coding") or [{}]
+    route = route_codings[0].get("code") or route_concept.get("text") or ""
+
+    # Sem period/periodUnit conhecido a frequência fica None: nunca é inventada
+    freq_hours = None
+    repeat = (dosage.get("timing") or {}).get("repeat") or {}
+    if repeat.get("period") and repeat.get("periodUnit") in PERIOD_UNIT_HOURS:
+        period_h = float(repeat["period"]) * PERIOD_UNIT_HOURS[repeat["periodUnit"]]
+        frequency = int(repeat.get("frequency") or 1)
+        freq_hours = max(int(round(period_h / frequency)), 1)
+
+    # Unidade reconhecida vira "mL" ou "mg" (valor convertido); outra fica como veio
+    dose = _as_float(dose_qty.get("value"))
+    unit = str(dose_qty.get("code") or dose_qty.get("unit") or "").strip()
+    known = DOSE_UNITS.get(unit.lower())
+    if known and dose is not None:
+        unit, dose = known[0], dose * known[1]
+
+    return {
+        "cd_item_prescricao": resource.get("id", ""),
+        "ean_codigo": ean,
+        "nm_medicamento": concept.get("text") or (concept.get("coding") or [{}])[0].get("display", ""),
+        "dose_input": dose,
+        "dose_unidade": unit,
+        "route": route,
+        "freq_hours": freq_hours,
+        "drug_id": drug_id,
+    }
+
+
+class PatientContext:
+    """
+    Contexto clínico acumulado de um paciente ao longo do Bundle.
+    """
+
+    __slots__ = ("age_months", "weight_kg", "conditions", "allergies", "current_meds", "evaluated", "unusable")
+
+    def __init__(self, unusable: Optional[str] = None):
+        self.age_months = None
+        self.weight_kg = None
+        self.conditions = []
+        self.allergies = []
+        self.current_meds = []
+        self.evaluated = False
+        # Motivo para não avaliar os itens: recurso de contexto inválido ou
+        # paciente que voltou depois de ter o contexto descartado
+        self.unusable = unusable
+
+    def as_engine_patient(self, patient_id: str) -> dict:
+        return {
+            "cd_pessoa_fisica": patient_id,
+            "weight_kg": self.weight_kg if self.weight_kg is not None else 0.0,
+            "age_months": self.age_months,
+            "conditions": self.conditions,
+            "allergies": self.allergies,
+            "current_meds": self.current_meds,
+        }
+
+
+def _issue(severity: str, code: str, text: str, expression: str, layer: Optional[str] = None) -> dict:
+    issue = {
+        "severity": severity,
+        "code": code,
+        "details": {"text": text},
+        "expression": [expression],
+    }
+    if layer:
+        issue["details"]["coding"] = [{"system": ALERT_LAYER_SYSTEM, "code": layer}]
+    return issue
+
+
+class BundleValidator:
+    """
+    Processa as entries de um Bundle FHIR uma a uma (vindas de um parser
+    incremental) e devolve issues de OperationOutcome.
+
+    Os MedicationRequests são agrupados por paciente: o contexto do paciente
+    (idade, peso, condições, alergias, medicamentos em uso) é montado uma vez
+    e reaproveitado para todo o grupo. Um grupo é avaliado quando o Bundle
+    passa para outro paciente, quando atinge `max_pending` itens ou no fim.
+
+    Convenção esperada (a mesma dos Bundles de transação dos PEPs):
+    Patient, Observation de peso, AllergyIntolerance, Condition e
+    MedicationStatement chegam antes dos MedicationRequests do paciente.
+    Contexto que chega depois de o grupo ter sido avaliado gera um issue
+    "incomplete", nunca é ignorado em silêncio.
+
+    A memória não cresce com o número de pacientes: só os `max_contexts`
+    contextos usados mais recentemente ficam guardados. Os IDs descartados
+    são lembrados (até `max_evicted`); se um deles reaparece, seus itens
+    não são avaliados e saem com um issue de erro.
+    """
+
+    def __init__(self, evaluate: Callable[[dict, dict], List[dict]], max_pending: int = 500, today: Optional[date] = None,
+                 max_contexts: int = 1000, max_evicted: int = 100000,
+                 concentration: Optional[Callable[[str], Optional[float]]] = None):
+        self.evaluate = evaluate
+        # mg/mL do medicamento, para converter doses em massa (None: desconhecida)
+        self.concentration = concentration or (lambda drug_id: None)
+        self.max_pending = max_pending
+        self.today = today or date.today()
+        self.max_contexts = max_contexts
+        self.max_evicted = max_evicted
+        self.contexts: Dict[str, PatientContext] = OrderedDict()
+        self._evicted = OrderedDict()  # IDs de pacientes cujo contexto foi descartado
+        self.current_patient: Optional[str] = None
+        self.pending: List[tuple] = []
+        self.index = -1
+        self.items_evaluated = 0
+
+    # ------------------------------------------------------------------
+    # Entrada
+    # ------------------------------------------------------------------
+
+    def feed(self, entry: dict) -> List[dict]:
+        self.index += 1
+        expression = f"Bundle.entry[{self.index}].resource"
+        resource = entry.get("resource") if isinstance(entry, dict) else None
+        if not isinstance(resource, dict):
+            return [_issue("error", "invalid", "Entry sem resource (objeto JSON).", expression)]
+        rtype = resource.get("resourceType")
+        issues = []  # preenchida por _feed; issues de um grupo já avaliado não se perdem no erro
+        try:
+            self._feed(entry, resource, rtype, expression, issues)
+        except (ValueError, TypeError, AttributeError, KeyError, ArithmeticError) as e:
+            # Um recurso malformado vira issue da própria entry; o resto do Bundle segue
+            issues.append(_issue("error", "invalid", f"{rtype} inválido: {e}", expression))
+        return issues
+
+    def _feed(self, entry: dict, resource: dict, rtype: str, expression: str, issues: List[dict]):
+        if rtype == "Patient":
+            patient_id = resource.get("id") or entry.get("fullUrl")
+        elif rtype in ("MedicationRequest", "MedicationStatement", "Condition", "AllergyIntolerance", "Observation"):
+            patient_id = _ref_id(resource.get("subject") or resource.get("patient"))
+        else:
+            # Recursos que não afetam a validação são ignorados
+            return
+
+        if not patient_id:
+            issues.append(_issue("error", "required", f"{rtype} sem referência de paciente.", expression))
+            return
+
+        if self.pending and patient_id != self.current_patient:
+            issues.extend(self._flush())
+        self.current_patient = patient_id
+
+        ctx = self._context(patient_id)
+
+        if rtype == "MedicationRequest":
+            self.pending.append((expression, map_medication_request(resource)))
+            if len(self.pending) >= self.max_pending:
+                issues.extend(self._flush())
+            return
+
+        if ctx.evaluated:
+            issues.append(_issue(
+                "warning", "incomplete",
+                f"{rtype} do paciente {patient_id} chegou após a avaliação de seus itens; "
+                "itens anteriores foram avaliados sem este dado.",
+                expression,
+            ))
+
+        try:
+            self._apply_context(ctx, resource, rtype)
+        except (ValueError, TypeError, AttributeError, KeyError, ArithmeticError):
+            # Alergia/condição/peso perdido: os itens do paciente não podem
+            # ser avaliados como se o dado não existisse
+            ctx.unusable = f"{rtype} inválido em {expression}"
+            raise
+
+    def _apply_context(self, ctx: PatientContext, resource: dict, rtype: str):
+        if rtype == "Patient":
+            if resource.get("birthDate"):
+                ctx.age_months = _age_in_months(resource["birthDate"], self.today)
+        elif rtype == "Observation":
+            codes = {c.get("code") for c in (resource.get("code") or {}).get("coding", [])}
+            qty = resource.get("valueQuantity") or {}
+            if BODY_WEIGHT_LOINC in codes and qty.get("value") is not None:
+                value = float(qty["value"])
+                ctx.weight_kg = value / 1000.0 if qty.get("code") == "g" or qty.get("unit") == "g" else value
+        elif rtype == "AllergyIntolerance":
+            ctx.allergies.extend(_concept_terms(resource.get("code")))
+        elif rtype == "Condition":
+            ctx.conditions.extend(_concept_terms(resource.get("code")))
+        elif rtype == "MedicationStatement":
+            if resource.get("status", "active") == "active":
+                mapped = map_medication_request(resource)
+                if mapped["drug_id"]:
+                    ctx.current_meds.append(mapped["drug_id"])
+
+    def finish(self) -> List[dict]:
+        return self._flush() if self.pending else []
+
+    def _context(self, patient_id: str) -> PatientContext:
+        ctx = self.contexts.get(patient_id)
+        if ctx is not None:
+            self.contexts.move_to_end(patient_id)
+            return ctx
+
+        unusable = None
+        if patient_id in self._evicted:
+            unusable = f"contexto descartado (mais de {self.max_contexts} pacientes intercalados no Bundle)"
+        ctx = self.contexts[patient_id] = PatientContext(unusable)
+        while len(self.contexts) > self.max_contexts:
+            # O mais antigo nunca é o paciente atual (acabou de ser usado)
+            evicted_id, _ = self.contexts.popitem(last=False)
+            self._evicted[evicted_id] = None
+            if len(self._evicted) > self.max_evicted:
+                self._evicted.popitem(last=False)
+        return ctx
+
+    # ------------------------------------------------------------------
+    # Avaliação de um grupo
+    # ------------------------------------------------------------------
+
+    def _flush(self) -> List[dict]:
+        patient_id = self.current_patient
+        ctx = self.contexts[patient_id]
+        pending, self.pending = self.pending, []
+        ctx.evaluated = True
+
+        if ctx.unusable:
+            return [
+                _issue("error", "incomplete", f"Paciente {patient_id} com {ctx.unusable}: item não avaliado.", expr)
+                for expr, _ in pending
+            ]
+        if ctx.age_months is None:
+            return [
+                _issue("error", "required", f"Paciente {patient_id} sem birthDate: item não avaliado.", expr)
+                for expr, _ in pending
+            ]
+        if ctx.weight_kg is None and ctx.age_months < CHILD_AGE_LIMIT_MONTHS:
+            return [
+                _issue("error", "required", f"Paciente pediátrico {patient_id} sem peso (LOINC {BODY_WEIGHT_LOINC}): item não avaliado.", expr)
+                for expr, _ in pending
+            ]
+
+        # Contexto do paciente calculado uma única vez para o grupo
+        patient = ctx.as_engine_patient(patient_id)
+        issues = []
+        for expression, item in pending:
+            if item["drug_id"] is None or item["dose_input"] is None:
+                issues.append(_issue("error", "required", "MedicationRequest sem medicamento ou dose.", expression))
+                continue
+            if item["dose_unidade"] not in ("mL", "mg"):
+                issues.append(_issue(
+                    "error", "not-supported",
+                    f"{item['cd_item_prescricao']}: unidade de dose '{item['dose_unidade']}' não suportada "
+                    "(use mL, L, mg, g ou mcg): item não avaliado.",
+                    expression,
+                ))
+                continue
+            item = self._engine_dose(item)
+
+            # Sem frequência válida a dose diária não pode ser checada: a engine
+            # roda com um valor qualquer e os alertas de posologia são descartados
+            no_frequency = item["freq_hours"] is None
+            try:
+                alerts = self.evaluate(patient, dict(item, freq_hours=24) if no_frequency else item)
+            except Exception:
+                print(f"Erro ao avaliar {expression} do Bundle FHIR:")
+                traceback.print_exc()
+                metrics.EVALUATION_ERRORS.labels(channel="fhir").inc()
+                issues.append(_issue("error", "exception", "Falha interna ao avaliar o item.", expression))
+                continue
+            self.items_evaluated += 1
+            if no_frequency:
+                alerts = [a for a in alerts if a.get("layer") != "posologia"]
+                issues.append(_issue(
+                    "warning", "incomplete",
+                    f"{item['cd_item_prescricao']}: timing.repeat sem period/periodUnit reconhecido; "
+                    "posologia não verificada.",
+                    expression, "posologia",
+                ))
+            if not alerts:
+                issues.append(_issue("information", "informational", f"{item['cd_item_prescricao']}: OK", expression))
+            for alert in alerts:
+                severity = "error" if alert["type"] == "BLOCK" else "warning"
+                issues.append(_issue(severity, "business-rule", alert["msg"], expression, alert.get("layer")))
+        return issues
+
+    def _engine_dose(self, item: dict) -> dict:
+        """
+        Dose em mg -> mL pela concentração: a engine multiplica a dose pela
+        concentração. Sem concentração cadastrada a engine já lê a dose
+        como mg, então ela vai como veio.
+        """
+        if item["dose_unidade"] != "mg":
+            return item
+        conc = self.concentration(item["drug_id"])
+        if not conc:
+            return item
+        return dict(item, dose_input=item["dose_input"] / conc, dose_unidade="mL")
+
+
+class OperationOutcomeWriter:
+    """
+    Escreve um OperationOutcome incrementalmente (issue a issue) em um
+    arquivo binário, sem manter a lista de issues em memória.
+    """
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.count = 0
+        self.fh.write(b'{"resourceType":"OperationOutcome","issue":[')
+
+    def write_all(self, issues: List[dict]):
+        for issue in issues:
+            if self.count:
+                self.fh.write(b",")
+            self.fh.write(json.dumps(issue, ensure_ascii=False).encode("utf-8"))
+            self.count += 1
+
+    def close(self, extra_issues: Optional[List[dict]] = None):
+        if extra_issues:
+            self.write_all(extra_issues)
+        self.fh.write(b"]}")
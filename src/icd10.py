@@ -0,0 +1,127 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import re
+from typing import Dict, Iterable, List, Optional
+
+# ==============================================================================
+# CONTRAINDICAÇÕES POR CID-10 (ÁRVORE DE PREFIXOS)
+# ==============================================================================
+#
+# Uma contraindicação pode ser um rótulo livre ("mononucleose"), um código
+# CID-10 ("B27", "I21.9") ou um intervalo ("J00-J06"). Código vale para ele e
+# todos os subcódigos: "J45" casa com "J45.0" e "J459". Intervalos são
+# expandidos, na compilação da base, no menor conjunto de prefixos
+# ("J00-J09" -> "J0") e tudo vai para uma árvore de prefixos. Casar um código
+# do paciente custa o comprimento do código, não o número de regras.
+
+_CODE_RE = re.compile(r"^([A-Z])(\d{2})(?:\.?(\d{1,2}))?$")
+
+
+def normalize_code(term: str) -> Optional[str]:
+    """'j45.0 ' -> 'J450'. None se o termo não for um código CID-10."""
+    m = _CODE_RE.match(term.strip().upper())
+    if not m:
+        return None
+    letter, category, sub = m.groups()
+    return letter + category + (sub or "")
+
+
+def expand_rule(term: str) -> Optional[List[str]]:
+    """
+    Prefixos (sem ponto) cobertos por um código ou intervalo CID-10.
+    None para rótulos livres; ValueError para intervalo inválido.
+    """
+    if "-" not in term:
+        code = normalize_code(term)
+        return [code] if code else None
+
+    start, _, end = term.partition("-")
+    lo, hi = normalize_code(start), normalize_code(end)
+    if lo is None or hi is None:
+        return None
+    if len(lo) != len(hi):
+        raise ValueError(f"Intervalo CID-10 com precisões diferentes: {term!r}")
+    if lo > hi:
+        raise ValueError(f"Intervalo CID-10 invertido: {term!r}")
+
+    # Letra + dígitos como um número só: A99 -> B00 é o "próximo" código
+    digits = len(lo) - 1
+    base = 10 ** digits
+    first = (ord(lo[0]) - ord("A")) * base + int(lo[1:])
+    last = (ord(hi[0]) - ord("A")) * base + int(hi[1:])
+    codes = [chr(ord("A") + n // base) + str(n % base).zfill(digits) for n in range(first, last + 1)]
+    return _compress(codes)
+
+
+def _compress(codes: List[str]) -> List[str]:
+    # Dez irmãos presentes (X0..X9) viram o prefixo pai X; no máximo até a letra
+    level = set(codes)
+    while True:
+        parents: Dict[str, int] = {}
+        for code in level:
+            if len(code) > 1:
+                parents[code[:-1]] = parents.get(code[:-1], 0) + 1
+        full = {p for p, n in parents.items() if n == 10}
+        if not full:
+            return sorted(level)
+        level = {c for c in level if c[:-1] not in full} | full
+
+
+class _Node:
+    __slots__ = ("children", "mask")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.mask = 0
+
+
+class IcdTrie:
+    """Árvore de prefixos CID-10 -> bitset das contraindicações (IDs do vocabulário)."""
+
+    def __init__(self):
+        self.root = _Node()
+        self.size = 0
+
+    def add(self, prefix: str, mask: int):
+        node = self.root
+        for ch in prefix:
+            nxt = node.children.get(ch)
+            if nxt is None:
+                nxt = node.children[ch] = _Node()
+                self.size += 1
+            node = nxt
+        node.mask |= mask
+
+    def match(self, code: str) -> int:
+        """OR dos bitsets de todos os prefixos de `code` (já normalizado)."""
+        mask = 0
+        node = self.root
+        for ch in code:
+            node = node.children.get(ch)
+            if node is None:
+                break
+            mask |= node.mask
+        return mask
+
+    def match_all(self, terms: Iterable[str]) -> int:
+        mask = 0
+        if not self.size:
+            return mask
+        for term in terms:
+            code = normalize_code(term)
+            if code:
+                mask |= self.match(code)
+        return mask
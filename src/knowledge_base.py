@@ -0,0 +1,297 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from collections import ChainMap, defaultdict
+from functools import cached_property
+from typing import Dict, List, Optional, Set
+
+from src import metrics
+from src.dose_sheet import DoseTable, TenantDoseTable
+from src.engine import ClinicalEngine
+from src.screening import FormularyScreen, TenantFormularyScreen
+from src.search import DrugSearchIndex, TenantSearchIndex
+
+# ==============================================================================
+# BASE DE CONHECIMENTO COMPILADA (CACHE POR VERSÃO)
+# ==============================================================================
+
+
+def cross_reactivity_closure(edges: List[dict]) -> Dict[str, Set[str]]:
+    """
+    Fecho transitivo do grafo de reatividade cruzada: para cada família de
+    alergia, todas as famílias alcançáveis (sem ela mesma). Tolera ciclos.
+    """
+    graph = defaultdict(set)
+    for e in edges:
+        graph[e["from"]].add(e["to"])
+
+    closure = {}
+    for start in list(graph):
+        seen = set()
+        stack = list(graph[start])
+        while stack:
+            fam = stack.pop()
+            if fam in seen:
+                continue
+            seen.add(fam)
+            stack.extend(graph.get(fam, ()))
+        seen.discard(start)
+        closure[start] = seen
+    return closure
+
+
+def expand_cross_families(drugs: dict, closure: Dict[str, Set[str]]):
+    """
+    Grava em cada medicamento `familias_reacao_cruzada`: as alergias do
+    paciente que, pelo fecho, reagem com alguma família do medicamento
+    (fora as próprias famílias, que já são casamento direto).
+    """
+    # Índice reverso: família do medicamento -> alergias que chegam nela
+    reaches = defaultdict(set)
+    for allergy, families in closure.items():
+        for fam in families:
+            reaches[fam].add(allergy)
+
+    for drug in drugs.values():
+        own = set(drug["familias_alergia"] or [])
+        cross = set()
+        for fam in own:
+            cross |= reaches.get(fam, set())
+        drug["familias_reacao_cruzada"] = sorted(cross - own)
+
+
+# Campos de um medicamento que um formulário local pode sobrescrever
+DRUG_FIELDS = (
+    "nome", "principio_ativo", "classe_terapeutica", "familias_alergia",
+    "concentracao_mg_ml", "min_idade_meses", "dose_max_diaria_adulto_mg",
+    "contra_indicacoes", "vias_permitidas", "pediatria",
+)
+
+
+class KnowledgeBase:
+    """
+    Snapshot imutável da base de conhecimento (medicamentos + interações +
+    reatividade cruzada) com a ClinicalEngine já montada. Nunca é alterado
+    depois de criado: uma nova versão da base gera um novo objeto.
+
+    Os formulários locais (tenants) são camadas por cima desta base,
+    montadas no primeiro uso de cada tenant (for_tenant).
+    """
+
+    tenant = None
+
+    def __init__(self, version: int, drugs: dict, interactions: list, cross_reactivity: list = (),
+                 tenant_overrides: Optional[dict] = None):
+        self.version = version
+        self.drugs = drugs
+        self.interactions = interactions
+        self.cross_reactivity = list(cross_reactivity)
+        # O grafo só é percorrido aqui; a requisição vê a lista já expandida
+        self.cross_closure = cross_reactivity_closure(self.cross_reactivity)
+        expand_cross_families(drugs, self.cross_closure)
+        self.engine = ClinicalEngine(drugs, interactions)
+
+        self.tenant_overrides = tenant_overrides or {}
+        self._tenants: Dict[str, "TenantKnowledgeBase"] = {}
+        self._tenants_lock = threading.Lock()
+
+    def for_tenant(self, tenant: Optional[str]) -> "KnowledgeBase":
+        """Base vista por um hospital; sem sobrescritas, a própria base."""
+        if not tenant or tenant not in self.tenant_overrides:
+            return self
+        kb = self._tenants.get(tenant)
+        if kb is None:
+            with self._tenants_lock:
+                kb = self._tenants.get(tenant)
+                if kb is None:
+                    kb = TenantKnowledgeBase(self, tenant, self.tenant_overrides[tenant])
+                    self._tenants[tenant] = kb
+        return kb
+
+    def to_snapshot(self) -> dict:
+        """Base em JSON puro (campos derivados de fora), para ferramentas offline."""
+        return {
+            "version": self.version,
+            "drugs": {
+                drug_id: {k: v for k, v in d.items() if k != "familias_reacao_cruzada"}
+                for drug_id, d in self.drugs.items()
+            },
+            "interactions": [
+                {"pair": sorted(rule["pair"]), "level": rule["level"], "msg": rule["msg"]}
+                for rule in self.interactions
+            ],
+            "cross_reactivity": self.cross_reactivity,
+            "tenant_overrides": {
+                tenant: {
+                    "drugs": layer["drugs"],
+                    "interactions": [dict(rule, pair=sorted(rule["pair"])) for rule in layer["interactions"]],
+                }
+                for tenant, layer in self.tenant_overrides.items()
+            },
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: dict) -> "KnowledgeBase":
+        interactions = [dict(rule, pair=set(rule["pair"])) for rule in data["interactions"]]
+        drugs = {drug_id: dict(d) for drug_id, d in data["drugs"].items()}
+        tenants = {
+            tenant: {
+                "drugs": layer.get("drugs", {}),
+                "interactions": [dict(rule, pair=set(rule["pair"])) for rule in layer.get("interactions", [])],
+            }
+            for tenant, layer in data.get("tenant_overrides", {}).items()
+        }
+        return cls(data.get("version", 0), drugs, interactions, data.get("cross_reactivity", []), tenants)
+
+    @cached_property
+    def dose_table(self) -> DoseTable:
+        """Regras de dose em arrays, montadas no primeiro uso da tabela de doses."""
+        return DoseTable(self.drugs)
+
+    @cached_property
+    def search_index(self) -> DrugSearchIndex:
+        """Índice de busca (autocompletar), montado na primeira busca desta versão."""
+        return DrugSearchIndex(self.drugs)
+
+    @cached_property
+    def formulary_screen(self) -> FormularyScreen:
+        """Índices invertidos da triagem por paciente, montados na primeira triagem desta versão."""
+        return FormularyScreen(self.drugs, self.interactions)
+
+
+class TenantKnowledgeBase:
+    """
+    Formulário local de um hospital como camada copy-on-write sobre a base
+    compartilhada: só os medicamentos sobrescritos e as interações locais
+    são copiados e compilados; o resto é lido da base (ChainMap e a engine
+    em camada). A memória cresce com as sobrescritas, não com o catálogo.
+    """
+
+    def __init__(self, base: KnowledgeBase, tenant: str, overrides: dict):
+        self.base = base
+        self.tenant = tenant
+        self.version = base.version
+        self.cross_reactivity = base.cross_reactivity
+
+        local_drugs = {}
+        for drug_id, fields in overrides["drugs"].items():
+            shared = base.drugs.get(drug_id)
+            if shared is None and any(f not in fields for f in DRUG_FIELDS):
+                continue  # exclusivo do hospital e incompleto (ex: base removeu o original)
+            drug = dict(shared or {})
+            drug.update({k: v for k, v in fields.items() if k in DRUG_FIELDS})
+            drug["id"] = drug_id
+            local_drugs[drug_id] = drug
+        expand_cross_families(local_drugs, base.cross_closure)
+
+        self.local_drugs = local_drugs
+        self.local_interactions = overrides["interactions"]
+        self.drugs = ChainMap(local_drugs, base.drugs)
+        self.engine = ClinicalEngine(local_drugs, self.local_interactions, base=base.engine)
+
+    def for_tenant(self, tenant: Optional[str]) -> KnowledgeBase:
+        return self.base.for_tenant(tenant)
+
+    @cached_property
+    def interactions(self) -> list:
+        # Só usado fora do caminho clínico (explicações); montado sob demanda
+        return self.base.interactions + self.local_interactions
+
+    # Índices: os da base, compartilhados, mais uma camada só com os
+    # medicamentos (e interações) do hospital; nada do catálogo é recompilado
+
+    @cached_property
+    def dose_table(self):
+        if not self.local_drugs:
+            return self.base.dose_table
+        return TenantDoseTable(self.base.dose_table, self.local_drugs)
+
+    @cached_property
+    def search_index(self):
+        if not self.local_drugs:
+            return self.base.search_index
+        return TenantSearchIndex(self.base.search_index, self.local_drugs)
+
+    @cached_property
+    def formulary_screen(self):
+        if not self.local_drugs and not self.local_interactions:
+            return self.base.formulary_screen
+        return TenantFormularyScreen(self.base.formulary_screen, self.local_drugs, self.local_interactions)
+
+
+class KnowledgeBaseCache:
+    """
+    Mantém a KnowledgeBase compilada em memória.
+
+    A versão no banco (tabela versao_base) é consultada no máximo a cada
+    `refresh_seconds`; a base só é recarregada quando a versão muda.
+    Escritas feitas por este processo chamam invalidate() e são vistas na
+    próxima requisição; escritas de outros workers aparecem em até
+    `refresh_seconds`. Assim a checagem clínica não disputa o pool de
+    conexões com o tráfego administrativo a cada requisição.
+    """
+
+    def __init__(self, db_manager, refresh_seconds: float = 2.0):
+        self.db_manager = db_manager
+        self.refresh_seconds = refresh_seconds
+        self._kb = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> KnowledgeBase:
+        kb = self._kb
+        if kb is not None and time.monotonic() - self._checked_at < self.refresh_seconds:
+            metrics.record_cache("knowledge_base", True)
+            return kb
+
+        with self._lock:
+            kb = self._kb
+            now = time.monotonic()
+            if kb is not None and now - self._checked_at < self.refresh_seconds:
+                metrics.record_cache("knowledge_base", True)
+                return kb
+
+            version = self.db_manager.get_kb_version()
+            if kb is not None and kb.version == version:
+                self._checked_at = now
+                metrics.record_cache("knowledge_base", True)
+                return kb
+
+            metrics.record_cache("knowledge_base", False)
+            kb = self._load(version)
+            self._kb = kb
+            self._checked_at = now
+            return kb
+
+    def is_fresh(self) -> bool:
+        """True se get() vai responder da memória, sem consultar o banco."""
+        return self._kb is not None and time.monotonic() - self._checked_at < self.refresh_seconds
+
+    def invalidate(self):
+        """Força a checagem de versão na próxima chamada de get()."""
+        self._checked_at = 0.0
+
+    def _load(self, version: int) -> KnowledgeBase:
+        start = time.perf_counter()
+        drugs = self.db_manager.get_all_drugs_dict()
+        interactions = self.db_manager.get_interactions()
+        cross_reactivity = self.db_manager.get_cross_reactivity()
+        tenant_overrides = self.db_manager.get_tenant_overrides()
+        kb = KnowledgeBase(version, drugs, interactions, cross_reactivity, tenant_overrides)
+        metrics.KB_LOAD_DURATION.observe(time.perf_counter() - start)
+        metrics.KB_DRUGS.set(len(drugs))
+        metrics.KB_INTERACTIONS.set(len(interactions))
+        return kb
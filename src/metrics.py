@@ -0,0 +1,301 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from functools import wraps
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from sqlalchemy import event
+
+# ==============================================================================
+# MÉTRICAS (PROMETHEUS)
+# ==============================================================================
+
+# Buckets pensados para latência de API clínica (1ms até 10s)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075,
+    0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0,
+)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "validrx_http_request_duration_seconds",
+    "Latência das requisições HTTP por rota.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+ITEMS_VALIDATED = Counter(
+    "validrx_items_validated_total",
+    "Itens de prescrição validados pela ClinicalEngine.",
+)
+
+ALERTS = Counter(
+    "validrx_alerts_total",
+    "Alertas emitidos pela ClinicalEngine, por tipo e camada.",
+    ["type", "layer"],
+)
+
+KB_LOAD_DURATION = Histogram(
+    "validrx_kb_load_duration_seconds",
+    "Tempo de carga da base de conhecimento (medicamentos + interações).",
+    buckets=LATENCY_BUCKETS,
+)
+
+KB_DRUGS = Gauge(
+    "validrx_kb_drugs",
+    "Quantidade de medicamentos na última carga da base de conhecimento.",
+)
+
+KB_INTERACTIONS = Gauge(
+    "validrx_kb_interactions",
+    "Quantidade de interações na última carga da base de conhecimento.",
+)
+
+KB_SYNC_RESPONSES = Counter(
+    "validrx_kb_sync_responses_total",
+    "Respostas do feed de mudanças da base, por tipo (delta ou snapshot).",
+    ["type"],
+)
+
+DB_QUERY_DURATION = Histogram(
+    "validrx_db_query_duration_seconds",
+    "Duração das queries SQL executadas, por tipo de comando.",
+    ["statement"],
+    buckets=LATENCY_BUCKETS,
+)
+
+DB_OPERATION_DURATION = Histogram(
+    "validrx_db_operation_duration_seconds",
+    "Duração das operações do DatabaseManager, por método.",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+CACHE_REQUESTS = Counter(
+    "validrx_cache_requests_total",
+    "Consultas aos caches internos, por cache e resultado (hit/miss).",
+    ["cache", "result"],
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "validrx_admission_in_flight",
+    "Requisições em execução, por classe de prioridade.",
+    ["class"],
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "validrx_admission_queue_depth",
+    "Requisições aguardando vaga, por classe de prioridade.",
+    ["class"],
+)
+
+ADMISSION_REJECTED = Counter(
+    "validrx_admission_rejected_total",
+    "Requisições rejeitadas com 503 (load shedding), por classe e motivo.",
+    ["class", "reason"],
+)
+
+EVALUATION_ERRORS = Counter(
+    "validrx_evaluation_errors_total",
+    "Itens em que a ClinicalEngine levantou exceção, por canal (websocket, fhir).",
+    ["channel"],
+)
+
+DEADLINE_DEGRADED = Counter(
+    "validrx_deadline_degraded_total",
+    "Checagens clínicas que estouraram o deadline e voltaram parciais.",
+)
+
+EXPLANATION_FILLS = Counter(
+    "validrx_explanation_fills_total",
+    "Explicações de alerta geradas em segundo plano após cache miss, por resultado.",
+    ["result"],
+)
+
+AUDIT_QUEUE_DEPTH = Gauge(
+    "validrx_audit_queue_depth",
+    "Decisões clínicas aguardando gravação na fila da auditoria.",
+)
+
+AUDIT_EVENTS = Counter(
+    "validrx_audit_events_total",
+    "Decisões da auditoria por destino: written, dropped (fila cheia) ou failed (erro ao gravar).",
+    ["result"],
+)
+
+AUDIT_ENQUEUE_WAIT = Histogram(
+    "validrx_audit_enqueue_wait_seconds",
+    "Espera da requisição para enfileirar na auditoria (backpressure com fila cheia).",
+    buckets=LATENCY_BUCKETS,
+)
+
+AUDIT_FLUSH_DURATION = Histogram(
+    "validrx_audit_flush_duration_seconds",
+    "Duração da gravação de um lote da auditoria.",
+    buckets=LATENCY_BUCKETS,
+)
+
+AUDIT_BATCH_SIZE = Histogram(
+    "validrx_audit_batch_size",
+    "Decisões por lote gravado pela auditoria.",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+
+WS_CONNECTIONS = Gauge(
+    "validrx_ws_connections",
+    "Conexões WebSocket de validação abertas.",
+)
+
+DB_POOL_SIZE = Gauge("validrx_db_pool_size", "Tamanho configurado do pool de conexões.")
+DB_POOL_CHECKED_OUT = Gauge("validrx_db_pool_checked_out", "Conexões do pool em uso.")
+DB_POOL_OVERFLOW = Gauge("validrx_db_pool_overflow", "Conexões abertas além do tamanho do pool.")
+
+THREADPOOL_LIMIT = Gauge(
+    "validrx_threadpool_limit",
+    "Limite de threads do threadpool usado pelos endpoints síncronos.",
+)
+THREADPOOL_IN_USE = Gauge(
+    "validrx_threadpool_in_use",
+    "Threads do threadpool ocupadas no momento da coleta.",
+)
+
+
+def record_cache(cache: str, hit: bool):
+    """
+    Registra um acesso a cache interno (hit ou miss).
+    A razão de acerto sai no PromQL: rate(hit) / rate(hit + miss).
+    """
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_alerts(alerts):
+    """
+    Contabiliza um item validado e os alertas que ele gerou.
+    Custo de alguns incrementos de contador por item.
+    """
+    ITEMS_VALIDATED.inc()
+    for alert in alerts:
+        ALERTS.labels(alert["type"], alert.get("layer", "desconhecida")).inc()
+
+
+def timed_db_operation(func):
+    """
+    Decorator para métodos do DatabaseManager: mede a duração por método.
+    """
+    histogram = DB_OPERATION_DURATION.labels(func.__name__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+def instrument_sqlalchemy(db_engine):
+    """
+    Registra listeners no engine do SQLAlchemy para medir cada query
+    e expõe o estado do pool de conexões como gauges.
+    """
+
+    @event.listens_for(db_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("validrx_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(db_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["validrx_query_start"].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement else "?"
+        DB_QUERY_DURATION.labels(verb).observe(time.perf_counter() - start)
+
+    @event.listens_for(db_engine, "handle_error")
+    def _on_error(exception_context):
+        # Query com erro não passa pelo after_cursor_execute: descarta o início
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("validrx_query_start"):
+            conn.info["validrx_query_start"].pop()
+
+    pool = db_engine.pool
+    # Nem todo pool (ex: SQLite em memória) expõe essas estatísticas
+    if hasattr(pool, "checkedout"):
+        DB_POOL_SIZE.set_function(pool.size)
+        DB_POOL_CHECKED_OUT.set_function(pool.checkedout)
+        DB_POOL_OVERFLOW.set_function(lambda: max(pool.overflow(), 0))
+
+
+def _update_threadpool_gauges():
+    # Só funciona dentro do event loop (endpoint /metrics é async)
+    from anyio import to_thread
+
+    try:
+        limiter = to_thread.current_default_thread_limiter()
+    except Exception:
+        return
+    THREADPOOL_LIMIT.set(limiter.total_tokens)
+    THREADPOOL_IN_USE.set(limiter.borrowed_tokens)
+
+
+def render_latest():
+    """
+    Gera o payload no formato de exposição do Prometheus.
+    Retorna (bytes, content_type).
+    """
+    _update_threadpool_gauges()
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# ==============================================================================
+# MIDDLEWARE ASGI
+# ==============================================================================
+
+class PrometheusMiddleware:
+    """
+    Middleware ASGI puro (sem BaseHTTPMiddleware) que mede a latência por rota.
+    Usa o template da rota ("/api/admin/drugs/{drug_id}") como label para
+    manter a cardinalidade baixa.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], route_path, str(status_holder["status"])
+            ).observe(time.perf_counter() - start)
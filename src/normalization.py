@@ -0,0 +1,54 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# ==============================================================================
+# CAMADA DE NORMALIZAÇÃO (TRADUTOR)
+# ==============================================================================
+#
+# Usada pela API e pelas ferramentas offline (replay da auditoria), para
+# que ambas entreguem à engine exatamente a mesma via.
+
+# Mapeamento de siglas de mercado (MV/Tasy) para o padrão ValidRx
+ROUTE_MAPPING = {
+    # Vias Venosas
+    "EV": "Endovenosa (IV)",
+    "IV": "Endovenosa (IV)",
+    "INTRAVENOSA": "Endovenosa (IV)",
+    
+    # Vias Musculares
+    "IM": "Intramuscular (IM)",
+    "INTRAMUSCULAR": "Intramuscular (IM)",
+    
+    # Vias Orais
+    "VO": "Oral",
+    "ORAL": "Oral",
+    "PO": "Oral", # Per Os (latim)
+    
+    # Subcutânea
+    "SC": "Subcutânea",
+    "SQ": "Subcutânea",
+    "SUBCUTANEA": "Subcutânea"
+}
+
+def normalize_route(route_input: str) -> str:
+    """
+    Traduz siglas (EV, IM, VO) para o padrão do banco de dados.
+    Ex: Recebe 'EV' -> Retorna 'Endovenosa (IV)'
+    """
+    if not route_input:
+        return "Desconhecida"
+    
+    # Converte para maiúsculo e busca no mapa. Se não achar, devolve o original.
+    return ROUTE_MAPPING.get(route_input.upper(), route_input)
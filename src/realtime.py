@@ -0,0 +1,215 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import traceback
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from pydantic import ValidationError
+from starlette.websockets import WebSocket
+
+from src import metrics
+
+# ==============================================================================
+# CANAL WEBSOCKET DE VALIDAÇÃO EM TEMPO REAL
+# ==============================================================================
+#
+# Protocolo (mensagens JSON em texto):
+#
+#   cliente -> {"type": "patient", "cd_medico": "...", "patient": {...}}
+#   cliente -> {"type": "item", "item": {...}}           (PrescriptionItem)
+#   cliente -> {"type": "remove", "cd_item_prescricao": "..."}
+#
+#   servidor -> {"type": "result", "item": "...", "seq": n, "alerts": [...], ...}
+#   servidor -> {"type": "error", "detail": "..."}
+#   servidor -> {"type": "error", "item": "...", "detail": "..."}  (item não avaliado)
+#
+# O contexto do paciente é enviado uma vez (ou quando muda; nesse caso todos
+# os itens já conhecidos são reavaliados). Cada edição de item é avaliada e
+# respondida assim que possível.
+
+# Códigos de fechamento (RFC 6455)
+CLOSE_TOO_BIG = 1009
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_POLICY_VIOLATION = 1008
+
+
+class PendingItems:
+    """
+    Fila de itens aguardando avaliação, com coalescência por item:
+    se o médico edita o mesmo item várias vezes antes de ele ser avaliado,
+    só a última versão é avaliada. O número de itens distintos é limitado
+    (exceto na reavaliação forçada, já limitada pelos itens da conexão).
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._event = asyncio.Event()
+
+    def put(self, item_id: str, item, force: bool = False) -> bool:
+        if not force and item_id not in self._items and len(self._items) >= self.max_items:
+            return False
+        self._items[item_id] = item
+        self._event.set()
+        return True
+
+    def discard(self, item_id: str):
+        self._items.pop(item_id, None)
+
+    async def get(self):
+        while not self._items:
+            self._event.clear()
+            await self._event.wait()
+        return self._items.popitem(last=False)
+
+
+class ClinicalSession:
+    """
+    Uma conexão WebSocket de validação.
+
+    Leitura e avaliação rodam em tarefas separadas: enquanto o cliente está
+    lento para ler as respostas (send bloqueado), novas edições continuam
+    sendo recebidas e coalescidas em PendingItems, sem acumular trabalho.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        patient_model: type,
+        item_model: type,
+        evaluate: Callable[[dict, dict, Optional[str]], Awaitable[dict]],
+        max_items: int,
+        max_pending: int,
+        max_message_bytes: int,
+        idle_timeout_s: float,
+    ):
+        self.ws = websocket
+        self.patient_model = patient_model
+        self.item_model = item_model
+        self.evaluate = evaluate
+        self.max_items = max_items
+        self.max_message_bytes = max_message_bytes
+        self.idle_timeout_s = idle_timeout_s
+
+        self.patient: Optional[dict] = None
+        self.cd_medico: Optional[str] = None
+        self.items = {}  # último estado de cada item (para reavaliar)
+        self.pending = PendingItems(max_pending)
+        self.seq = 0
+        self._send_lock = asyncio.Lock()
+
+    async def run(self):
+        evaluator = asyncio.create_task(self._evaluate_loop())
+        try:
+            await self._read_loop()
+        finally:
+            evaluator.cancel()
+            try:
+                await evaluator
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    async def _read_loop(self):
+        while True:
+            try:
+                message = await asyncio.wait_for(self.ws.receive(), self.idle_timeout_s)
+            except asyncio.TimeoutError:
+                await self.ws.close(code=CLOSE_POLICY_VIOLATION, reason="idle timeout")
+                return
+
+            if message["type"] == "websocket.disconnect":
+                return
+
+            raw = message.get("text")
+            if raw is None and message.get("bytes") is not None:
+                raw = message["bytes"].decode("utf-8", errors="replace")
+            if raw is None:
+                continue
+            # Limite em bytes (UTF-8), não em caracteres
+            if len(raw.encode("utf-8")) > self.max_message_bytes:
+                await self.ws.close(code=CLOSE_TOO_BIG, reason="message too big")
+                return
+
+            try:
+                data = json.loads(raw)
+                await self._handle(data)
+            except (ValueError, ValidationError, KeyError, TypeError) as e:
+                await self._send({"type": "error", "detail": f"Mensagem inválida: {e}"})
+
+    async def _handle(self, data: dict):
+        kind = data.get("type")
+
+        if kind == "patient":
+            self.patient = self.patient_model(**data["patient"]).dict()
+            self.cd_medico = data.get("cd_medico")
+            # Contexto mudou (peso, alergias...): reavalia TODOS os itens
+            # conhecidos. A fila é por item, então não passa de max_items.
+            for item_id, item in self.items.items():
+                self.pending.put(item_id, item, force=True)
+            return
+
+        if kind == "item":
+            item = self.item_model(**data["item"]).dict()
+            item_id = item["cd_item_prescricao"]
+            if item_id not in self.items and len(self.items) >= self.max_items:
+                await self._send({"type": "error", "detail": f"Limite de {self.max_items} itens por conexão."})
+                return
+            self.items[item_id] = item
+            if self.patient is None:
+                await self._send({"type": "error", "item": item_id, "detail": "Item guardado; será avaliado quando o paciente for enviado."})
+                return
+            if not self.pending.put(item_id, item):
+                await self._send({"type": "error", "item": item_id, "detail": "Muitos itens pendentes; reenvie."})
+            return
+
+        if kind == "remove":
+            item_id = data["cd_item_prescricao"]
+            self.items.pop(item_id, None)
+            self.pending.discard(item_id)
+            return
+
+        await self._send({"type": "error", "detail": f"Tipo de mensagem desconhecido: {kind}"})
+
+    # ------------------------------------------------------------------
+    # Avaliação
+    # ------------------------------------------------------------------
+
+    async def _evaluate_loop(self):
+        while True:
+            item_id, item = await self.pending.get()
+            try:
+                result = await self.evaluate(self.patient, item, self.cd_medico)
+            except Exception:
+                # Um item com problema não pode parar a avaliação dos demais.
+                # O detalhe fica no log do servidor (com traceback) e na
+                # métrica; o cliente recebe só uma mensagem genérica.
+                print(f"Erro ao avaliar item {item_id} no WebSocket:")
+                traceback.print_exc()
+                metrics.EVALUATION_ERRORS.labels(channel="websocket").inc()
+                await self._send({"type": "error", "item": item_id, "detail": "Falha interna ao avaliar o item."})
+                continue
+            self.seq += 1
+            await self._send({"type": "result", "item": item_id, "seq": self.seq, **result})
+
+    async def _send(self, payload: dict):
+        # Leitura e avaliação enviam de tarefas diferentes
+        async with self._send_lock:
+            await self.ws.send_text(json.dumps(payload, ensure_ascii=False))
@@ -0,0 +1,268 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+from collections import ChainMap, defaultdict
+from typing import List, Optional, Set
+
+import numpy as np
+
+from src.engine import PCR_CONDITION, Vocabulary
+from src.icd10 import IcdTrie, expand_rule
+from src.normalization import normalize_route
+from src.search import fold
+
+# ==============================================================================
+# TRIAGEM DO FORMULÁRIO PARA UM PACIENTE
+# ==============================================================================
+#
+# "Quais medicamentos do catálogo (ou de uma classe) não são bloqueados para
+# este paciente?" sem chamar a engine medicamento a medicamento. Índices
+# invertidos apontam, para cada família de alergia, contraindicação, via e
+# princípio ativo, os medicamentos que ela exclui; a idade mínima fica num
+# array ordenado. O conjunto excluído sai de algumas uniões de máscaras e um
+# corte por faixa de idade.
+#
+# Mesmas regras de bloqueio da engine que dependem só do paciente e do
+# medicamento: via, Adrenalina IV sem PCR, idade mínima, alergia,
+# contraindicação (rótulo ou CID-10) e interação ALTO com os medicamentos em
+# uso. Bloqueios de posologia dependem da dose prescrita e ficam de fora;
+# alertas WARNING (reação cruzada, duplicidade) não excluem.
+
+LAYERS = ("via", "idade", "alergia", "contraindicacao", "interacao")
+
+
+def _blocked_principles(active: set, *rule_sets) -> Optional[Set[str]]:
+    # Regra cujo par fica completo com o princípio do candidato. Par já
+    # completo entre os medicamentos em uso bloqueia qualquer candidato na
+    # engine: None = exclui o formulário inteiro.
+    completing = set()
+    for rules in rule_sets:
+        for principle in active:
+            for pair in rules.get(principle, ()):
+                missing = pair - active
+                if not missing:
+                    return None
+                if len(missing) == 1:
+                    completing |= missing
+    return completing
+
+
+def _summary(d: dict) -> dict:
+    return {
+        "drug_id": d["id"],
+        "nome": d["nome"],
+        "principio_ativo": d.get("principio_ativo"),
+        "classe_terapeutica": d.get("classe_terapeutica"),
+        "vias_permitidas": d.get("vias_permitidas"),
+    }
+
+
+class FormularyScreen:
+    """Índices invertidos de um catálogo (dicionário id -> medicamento)."""
+
+    def __init__(self, drugs, interactions: list):
+        items = sorted(drugs.values(), key=lambda d: d["id"])
+        self.drugs = items
+        self.ids = [d["id"] for d in items]
+        n = len(items)
+
+        docs_by_allergy = defaultdict(list)
+        docs_by_condition = defaultdict(list)
+        docs_by_route = defaultdict(list)
+        docs_by_principle = defaultdict(list)
+        docs_by_class = defaultdict(list)
+        adrenaline = []
+        for doc, d in enumerate(items):
+            for fam in set(d.get("familias_alergia") or ()):
+                docs_by_allergy[fam].append(doc)
+            for term in set(d.get("contra_indicacoes") or ()):
+                docs_by_condition[term].append(doc)
+            for route in set(d.get("vias_permitidas") or ()):
+                docs_by_route[route].append(doc)
+            docs_by_principle[d.get("principio_ativo")].append(doc)
+            docs_by_class[fold(d.get("classe_terapeutica"))].append(doc)
+            if "Adrenalina" in d["nome"]:
+                adrenaline.append(doc)
+
+        def postings(index):
+            return {key: np.array(docs, dtype=np.int32) for key, docs in index.items()}
+
+        self._allergy_docs = postings(docs_by_allergy)
+        self._condition_docs = postings(docs_by_condition)
+        self._principle_docs = postings(docs_by_principle)
+        self._class_docs = postings(docs_by_class)
+        self._adrenaline_docs = np.array(adrenaline, dtype=np.int32)
+        # Via: o índice aponta quem NÃO aceita a via (quem ela exclui)
+        self._route_excluded = {}
+        for route, docs in docs_by_route.items():
+            mask = np.ones(n, dtype=bool)
+            mask[docs] = False
+            self._route_excluded[route] = mask
+
+        # Contraindicações em CID-10 (código ou intervalo): árvore de prefixos
+        # -> bit do termo, como na engine
+        self._conditions = Vocabulary()
+        self._icd = IcdTrie()
+        for term in docs_by_condition:
+            try:
+                prefixes = expand_rule(term)
+            except ValueError:
+                prefixes = None  # intervalo malformado: só o rótulo exato
+            if prefixes:
+                bit = 1 << self._conditions.add(term)
+                for prefix in prefixes:
+                    self._icd.add(prefix, bit)
+
+        # Idade mínima ordenada: excluídos pela idade = sufixo do array
+        min_age = np.array([d.get("min_idade_meses") or 0 for d in items], dtype=np.int64)
+        self._age_order = np.argsort(min_age, kind="stable").astype(np.int32)
+        self._sorted_ages = min_age[self._age_order].tolist()
+
+        # Interações que bloqueiam (ALTO), por princípio
+        self._principle_of = {d["id"]: d.get("principio_ativo") for d in items}
+        self._blocking_rules = defaultdict(list)
+        for rule in interactions:
+            if rule["level"] == "ALTO":
+                pair = frozenset(rule["pair"])
+                for principle in pair:
+                    self._blocking_rules[principle].append(pair)
+
+    def __len__(self):
+        return len(self.drugs)
+
+    # --------------------------------------------------------------------------
+    # Exclusões por camada
+    # --------------------------------------------------------------------------
+
+    def _union(self, postings: dict, keys) -> np.ndarray:
+        mask = np.zeros(len(self.drugs), dtype=bool)
+        for key in keys:
+            docs = postings.get(key)
+            if docs is not None:
+                mask[docs] = True
+        return mask
+
+    def _condition_terms(self, conditions: List[str]) -> set:
+        # Rótulo exato ou código do paciente dentro de uma regra CID-10
+        terms = set(conditions)
+        terms.update(self._conditions.decode(self._icd.match_all(conditions)))
+        return terms
+
+    def _route_mask(self, route: str, conditions: List[str]) -> np.ndarray:
+        mask = self._route_excluded.get(route)
+        mask = mask.copy() if mask is not None else np.ones(len(self.drugs), dtype=bool)
+        if route == "Endovenosa (IV)" and PCR_CONDITION not in conditions:
+            mask[self._adrenaline_docs] = True
+        return mask
+
+    def _age_mask(self, age_months: int) -> np.ndarray:
+        mask = np.zeros(len(self.drugs), dtype=bool)
+        mask[self._age_order[bisect.bisect_right(self._sorted_ages, age_months):]] = True
+        return mask
+
+    def _interaction_mask(self, blocked: Optional[Set[str]]) -> np.ndarray:
+        if blocked is None:
+            return np.ones(len(self.drugs), dtype=bool)
+        return self._union(self._principle_docs, blocked)
+
+    # --------------------------------------------------------------------------
+    # Triagem
+    # --------------------------------------------------------------------------
+
+    def screen(self, age_months: int, conditions: List[str] = (), allergies: List[str] = (),
+               current_meds: List[str] = (), route: Optional[str] = None,
+               classe: Optional[str] = None):
+        """
+        (índices dos medicamentos não bloqueados, excluídos por camada).
+        Um medicamento pode ser excluído por mais de uma camada.
+        """
+        active = {self._principle_of[m] for m in current_meds if m in self._principle_of}
+        allowed, counts = self._screen(age_months, conditions, allergies,
+                                       _blocked_principles(active, self._blocking_rules), route, classe)
+        return np.flatnonzero(allowed), counts
+
+    def _screen(self, age_months: int, conditions, allergies, blocked: Optional[Set[str]],
+                route: Optional[str], classe: Optional[str], hidden: Optional[np.ndarray] = None):
+        # Máscara dos não bloqueados e contagem por camada; `hidden` tira
+        # medicamentos da triagem (sobrescritos num formulário local)
+        excluded = {
+            "idade": self._age_mask(age_months),
+            "alergia": self._union(self._allergy_docs, allergies),
+            "contraindicacao": self._union(self._condition_docs, self._condition_terms(conditions)),
+            "interacao": self._interaction_mask(blocked),
+        }
+        if route:
+            excluded["via"] = self._route_mask(normalize_route(route), conditions)
+
+        if classe:
+            candidates = np.zeros(len(self.drugs), dtype=bool)
+            docs = self._class_docs.get(fold(classe))
+            if docs is not None:
+                candidates[docs] = True
+        else:
+            candidates = np.ones(len(self.drugs), dtype=bool)
+        if hidden is not None:
+            candidates[hidden] = False
+
+        allowed = candidates.copy()
+        for mask in excluded.values():
+            allowed &= ~mask
+        counts = {layer: int(np.count_nonzero(excluded[layer] & candidates)) for layer in LAYERS if layer in excluded}
+        return allowed, counts
+
+    def describe(self, docs) -> list:
+        return [_summary(self.drugs[doc]) for doc in docs]
+
+
+class TenantFormularyScreen:
+    """
+    Triagem num formulário local sem reindexar o catálogo: os índices da
+    base (com os medicamentos sobrescritos mascarados) e índices pequenos
+    só com os medicamentos e interações do hospital. Os índices devolvidos
+    apontam para a base ou, deslocados de len(base), para a camada local, e
+    vêm na ordem por ID do formulário.
+    """
+
+    def __init__(self, base: FormularyScreen, local_drugs: dict, local_interactions: list):
+        self.base = base
+        self.local = FormularyScreen(local_drugs, local_interactions)
+        self._principle_of = ChainMap(self.local._principle_of, base._principle_of)
+        # Posição de cada medicamento local na ordem da base
+        self._insert_at = np.array([bisect.bisect_left(base.ids, drug_id) for drug_id in self.local.ids], dtype=np.int64)
+        self._hidden = np.array([doc for doc, drug_id in zip(self._insert_at.tolist(), self.local.ids)
+                                 if doc < len(base.ids) and base.ids[doc] == drug_id], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.base) - len(self._hidden) + len(self.local)
+
+    def screen(self, age_months: int, conditions: List[str] = (), allergies: List[str] = (),
+               current_meds: List[str] = (), route: Optional[str] = None,
+               classe: Optional[str] = None):
+        """Mesmo contrato de FormularyScreen.screen, sobre o formulário local."""
+        active = {self._principle_of[m] for m in current_meds if m in self._principle_of}
+        blocked = _blocked_principles(active, self.base._blocking_rules, self.local._blocking_rules)
+        shared, counts = self.base._screen(age_months, conditions, allergies, blocked, route, classe, self._hidden)
+        local, local_counts = self.local._screen(age_months, conditions, allergies, blocked, route, classe)
+        for layer, count in local_counts.items():
+            counts[layer] += count
+
+        shared_docs = np.flatnonzero(shared)
+        local_docs = np.flatnonzero(local)
+        at = np.searchsorted(shared_docs, self._insert_at[local_docs])
+        return np.insert(shared_docs, at, local_docs + len(self.base)), counts
+
+    def describe(self, docs) -> list:
+        n = len(self.base)
+        return [_summary(self.base.drugs[doc] if doc < n else self.local.drugs[doc - n]) for doc in docs]
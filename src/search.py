@@ -0,0 +1,275 @@
+# Copyright 2025 ValidRx Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import re
+import unicodedata
+from collections import defaultdict
+from typing import List, Optional
+
+import numpy as np
+
+from src.normalization import normalize_route
+
+# ==============================================================================
+# BUSCA DE MEDICAMENTOS (AUTOCOMPLETAR)
+# ==============================================================================
+#
+# Índice em memória sobre `nome` e `principio_ativo`, montado a partir da base
+# compilada (um por versão, como a tabela de doses). Texto sem acento e em
+# minúsculas ("Dipirona Sódica" == "dipirona sodica").
+#
+# - Vocabulário ordenado: os termos que começam com um prefixo são uma faixa
+#   contínua (bisect), e os medicamentos desses termos ficam contíguos em um
+#   único array (postings em formato CSR). Prefixo = uma fatia do array.
+# - Erro de digitação: trigramas dos termos do vocabulário. Só é consultado
+#   quando prefixo/termo exato não bastam para completar a página.
+# - Cada termo da consulta precisa casar com o medicamento (E); a pontuação
+#   soma o melhor casamento de cada termo: exato > prefixo > aproximado.
+
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+FUZZY_WEIGHT = 0.6  # multiplicado pela fração de trigramas em comum
+FUZZY_MIN_SIMILARITY = 0.5
+FUZZY_MIN_TERM_LENGTH = 4
+NAME_PREFIX_BONUS = 0.5  # nome começa com a consulta digitada
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Diacríticos combinantes (U+0300-U+036F) que o NFKD separa das letras
+_STRIP_ACCENTS = dict.fromkeys(range(0x300, 0x370))
+
+
+def fold(text: str) -> str:
+    """Minúsculas e sem acento."""
+    return unicodedata.normalize("NFKD", (text or "").lower()).translate(_STRIP_ACCENTS)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(fold(text))
+
+
+def trigrams(term: str) -> set:
+    # "^" marca o início: favorece termos que começam igual à consulta
+    padded = "^" + term
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class DrugSearchIndex:
+    """Índice de busca de um catálogo (dicionário id -> medicamento)."""
+
+    def __init__(self, drugs: dict):
+        items = sorted(drugs.values(), key=lambda d: d["id"])
+        self.drugs = items
+        self.ids = [d["id"] for d in items]
+        names = [fold(d["nome"]) for d in items]
+
+        # Nomes ordenados: os que começam com o texto digitado são uma faixa
+        by_name = sorted(range(len(items)), key=lambda doc: names[doc])
+        self.sorted_names = [names[doc] for doc in by_name]
+        self.sorted_name_docs = np.array(by_name, dtype=np.int32)
+        # Desempate: nome mais curto, depois ordem alfabética
+        self.name_rank = np.empty(len(items), dtype=np.int64)
+        self.name_rank[sorted(range(len(items)), key=lambda doc: (len(names[doc]), names[doc]))] = np.arange(len(items))
+
+        # Princípios, classes e vias se repetem muito: cada valor é normalizado uma vez
+        folded = {}
+        docs_by_token = defaultdict(set)
+        docs_by_class = defaultdict(list)
+        docs_by_route = defaultdict(list)
+        for doc, d in enumerate(items):
+            principle = d.get("principio_ativo") or ""
+            if principle not in folded:
+                folded[principle] = _TOKEN_RE.findall(fold(principle))
+            for token in _TOKEN_RE.findall(names[doc]) + folded[principle]:
+                docs_by_token[token].add(doc)
+            docs_by_class[d.get("classe_terapeutica")].append(doc)
+            for route in d.get("vias_permitidas") or ():
+                docs_by_route[route].append(doc)
+
+        # Vocabulário ordenado + postings concatenados na mesma ordem (CSR)
+        self.vocab = sorted(docs_by_token)
+        postings = [sorted(docs_by_token[t]) for t in self.vocab]
+        self.offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in postings], out=self.offsets[1:])
+        self.postings = np.fromiter((doc for p in postings for doc in p), dtype=np.int32, count=int(self.offsets[-1]))
+
+        grams_by_token = defaultdict(list)
+        for token_id, token in enumerate(self.vocab):
+            for gram in trigrams(token):
+                grams_by_token[gram].append(token_id)
+        self.gram_postings = {g: np.array(ids, dtype=np.int32) for g, ids in grams_by_token.items()}
+
+        self._route_masks = {route: self._mask(docs) for route, docs in docs_by_route.items()}
+        self._class_masks = defaultdict(lambda: np.zeros(len(items), dtype=bool))
+        for classe, docs in docs_by_class.items():
+            self._class_masks[fold(classe)] |= self._mask(docs)
+
+    def __len__(self):
+        return len(self.drugs)
+
+    # --------------------------------------------------------------------------
+    # Filtros (uma máscara por via e por classe)
+    # --------------------------------------------------------------------------
+
+    def _mask(self, docs: list) -> np.ndarray:
+        mask = np.zeros(len(self.drugs), dtype=bool)
+        mask[docs] = True
+        return mask
+
+    def _route_mask(self, route: str) -> np.ndarray:
+        mask = self._route_masks.get(normalize_route(route))
+        return mask if mask is not None else np.zeros(len(self.drugs), dtype=bool)
+
+    def _class_mask(self, classe: str) -> np.ndarray:
+        mask = self._class_masks.get(fold(classe))
+        return mask if mask is not None else np.zeros(len(self.drugs), dtype=bool)
+
+    # --------------------------------------------------------------------------
+    # Casamento de um termo
+    # --------------------------------------------------------------------------
+
+    def _docs(self, token_lo: int, token_hi: int) -> np.ndarray:
+        return self.postings[self.offsets[token_lo]:self.offsets[token_hi]]
+
+    def _term_scores(self, term: str, fuzzy: bool) -> np.ndarray:
+        """Melhor pontuação do termo em cada medicamento (0 = não casou)."""
+        scores = np.zeros(len(self.drugs), dtype=np.float32)
+        lo = bisect.bisect_left(self.vocab, term)
+        hi = bisect.bisect_left(self.vocab, term + "\uffff")
+        if hi > lo:
+            scores[self._docs(lo, hi)] = PREFIX_SCORE
+            if self.vocab[lo] == term:
+                scores[self._docs(lo, lo + 1)] = EXACT_SCORE
+
+        if fuzzy and len(term) >= FUZZY_MIN_TERM_LENGTH:
+            query_grams = trigrams(term)
+            grams = [g for g in query_grams if g in self.gram_postings]
+            if grams:
+                # Fração dos trigramas da consulta presentes em cada termo do vocabulário
+                common = np.bincount(
+                    np.concatenate([self.gram_postings[g] for g in grams]), minlength=len(self.vocab)
+                )
+                similarity = common / len(query_grams)
+                tokens = np.flatnonzero(similarity >= FUZZY_MIN_SIMILARITY)
+                # Postings de todos os termos próximos de uma vez (várias fatias do CSR)
+                starts = self.offsets[tokens]
+                lengths = self.offsets[tokens + 1] - starts
+                positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+                values = np.repeat((FUZZY_WEIGHT * similarity[tokens]).astype(np.float32), lengths)
+                np.maximum.at(scores, self.postings[positions], values)
+        return scores
+
+    # --------------------------------------------------------------------------
+    # Busca
+    # --------------------------------------------------------------------------
+
+    def search(self, query: str, limit: int = 10, route: Optional[str] = None,
+               classe: Optional[str] = None) -> list:
+        terms = tokenize(query)
+        if not terms or not self.drugs:
+            return []
+
+        allowed = self._allowed(route, classe)
+        total, matched = self._score(terms, allowed, fuzzy=False)
+        if np.count_nonzero(matched) < limit:
+            # Poucos resultados por prefixo: tenta também erros de digitação
+            total, matched = self._score(terms, allowed, fuzzy=True)
+        return self._top(query, total, matched, limit)
+
+    def _allowed(self, route: Optional[str], classe: Optional[str]) -> np.ndarray:
+        allowed = np.ones(len(self.drugs), dtype=bool)
+        if route:
+            allowed &= self._route_mask(route)
+        if classe:
+            allowed &= self._class_mask(classe)
+        return allowed
+
+    def _top(self, query: str, total: np.ndarray, matched: np.ndarray, limit: int) -> list:
+        candidates = np.flatnonzero(matched)
+        if candidates.size == 0:
+            return []
+
+        # Bônus para o nome que começa com o texto digitado (faixa dos nomes ordenados)
+        typed = fold(query).strip()
+        lo = bisect.bisect_left(self.sorted_names, typed)
+        hi = bisect.bisect_left(self.sorted_names, typed + "\uffff")
+        total[self.sorted_name_docs[lo:hi]] += NAME_PREFIX_BONUS
+        scores = total[candidates]
+
+        # Maior pontuação; empate: nome mais curto, depois ordem alfabética
+        key = self.name_rank[candidates] - scores.astype(np.float64) * (len(self.drugs) + 1)
+        if candidates.size > limit:
+            keep = np.argpartition(key, limit - 1)[:limit]
+            candidates, scores, key = candidates[keep], scores[keep], key[keep]
+        order = np.argsort(key, kind="stable")
+
+        results = []
+        for i in order.tolist():
+            d = self.drugs[candidates[i]]
+            results.append({
+                "drug_id": d["id"],
+                "nome": d["nome"],
+                "principio_ativo": d.get("principio_ativo"),
+                "classe_terapeutica": d.get("classe_terapeutica"),
+                "vias_permitidas": d.get("vias_permitidas"),
+                "score": round(float(scores[i]), 4),
+            })
+        return results
+
+    def _score(self, terms: List[str], allowed: np.ndarray, fuzzy: bool):
+        total = np.zeros(len(self.drugs), dtype=np.float32)
+        matched = allowed.copy()
+        for term in terms:
+            scores = self._term_scores(term, fuzzy)
+            matched &= scores > 0
+            total += scores
+        return total, matched
+
+
+class TenantSearchIndex:
+    """
+    Busca num formulário local sem reindexar o catálogo: consulta o índice
+    da base com os medicamentos sobrescritos mascarados e um índice pequeno
+    só com os medicamentos do hospital, e junta as duas páginas.
+    """
+
+    def __init__(self, base: DrugSearchIndex, local_drugs: dict):
+        self.base = base
+        self.local = DrugSearchIndex(local_drugs)
+        docs = [bisect.bisect_left(base.ids, drug_id) for drug_id in self.local.ids]
+        self._hidden = np.array([doc for doc, drug_id in zip(docs, self.local.ids)
+                                 if doc < len(base.ids) and base.ids[doc] == drug_id], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.base) - len(self._hidden) + len(self.local)
+
+    def search(self, query: str, limit: int = 10, route: Optional[str] = None,
+               classe: Optional[str] = None) -> list:
+        terms = tokenize(query)
+        if not terms or not len(self):
+            return []
+
+        indexes = (self.base, self.local)
+        allowed = [index._allowed(route, classe) for index in indexes]
+        allowed[0][self._hidden] = False
+        scored = [index._score(terms, mask, fuzzy=False) for index, mask in zip(indexes, allowed)]
+        if sum(np.count_nonzero(matched) for _, matched in scored) < limit:
+            # Mesmo critério da busca direta, contando o formulário inteiro
+            scored = [index._score(terms, mask, fuzzy=True) for index, mask in zip(indexes, allowed)]
+
+        results = [r for index, (total, matched) in zip(indexes, scored) for r in index._top(query, total, matched, limit)]
+        # Mesma ordem do índice: pontuação, nome mais curto, ordem alfabética
+        results.sort(key=lambda r: (-r["score"], len(fold(r["nome"])), fold(r["nome"]), r["drug_id"]))
+        return results[:limit]
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import re
+from typing import Callable, List, Sequence
+
+import numpy as np
+
+
+# ======================================
+# Cache persistente de embeddings
+# ======================================
+#
+# Um diretório por modelo:
+#
+#   <raiz>/<modelo>/index.json        {"model", "dim", "file", "hashes": [...]}
+#   <raiz>/<modelo>/vectors-<n>.npy   matriz float32 (linhas na ordem de "hashes")
+#
+# A chave de cada linha é o sha256 do texto do chunk; trocar de modelo usa
+# outro diretório. Os vetores são gravados já normalizados (norma L2 = 1).
+#
+# A matriz é aberta com np.load(mmap_mode="r"): subir o índice não lê o
+# arquivo inteiro. Cada gravação gera um vectors-<n>.npy novo e só então
+# troca o index.json (os.replace), então quem está lendo nunca vê metade de
+# uma atualização — e no Windows não se sobrescreve arquivo mapeado.
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _model_dirname(model: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+
+
+class EmbeddingStore:
+    def __init__(self, root: str, model: str):
+        self.model = model
+        self.path = os.path.join(root, _model_dirname(model))
+        self.dim = None
+        self.file = None
+        self.hashes: List[str] = []
+        self.rows = {}
+        self.vectors = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def _index_path(self) -> str:
+        return os.path.join(self.path, "index.json")
+
+    def _load(self):
+        if not os.path.exists(self._index_path()):
+            return
+        with open(self._index_path(), encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("model") != self.model:
+            raise ValueError(f"Cache em {self.path} é do modelo {index.get('model')}, não {self.model}.")
+
+        self.dim = index["dim"]
+        self.file = index["file"]
+        self.hashes = index["hashes"]
+        self.rows = {h: i for i, h in enumerate(self.hashes)}
+        self.vectors = np.load(os.path.join(self.path, self.file), mmap_mode="r")
+        if self.vectors.shape[0] < len(self.hashes):
+            raise ValueError(f"Cache corrompido em {self.path}: menos vetores que hashes.")
+
+    def _save(self, vectors: np.ndarray, hashes: List[str]):
+        os.makedirs(self.path, exist_ok=True)
+        generation = 0
+        if self.file:
+            generation = int(self.file.split("-")[1].split(".")[0]) + 1
+        new_file = f"vectors-{generation}.npy"
+
+        tmp = os.path.join(self.path, new_file + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+        os.replace(tmp, os.path.join(self.path, new_file))
+
+        tmp = self._index_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "dim": int(vectors.shape[1]), "file": new_file, "hashes": hashes}, f)
+        os.replace(tmp, self._index_path())
+
+        old_file = self.file
+        self.vectors = None  # libera o mmap antigo antes de apagar o arquivo
+        self._load()
+        if old_file and old_file != new_file:
+            try:
+                os.remove(os.path.join(self.path, old_file))
+            except OSError:
+                pass  # ainda mapeado por outro leitor (Windows): fica para a próxima
+
+    def missing(self, texts: Sequence[str]) -> List[str]:
+        """Textos (sem repetição) que ainda não têm vetor no cache."""
+        seen = set()
+        out = []
+        for t in texts:
+            h = content_hash(t)
+            if h not in self.rows and h not in seen:
+                seen.add(h)
+                out.append(t)
+        return out
+
+    def add(self, texts: Sequence[str], vectors: np.ndarray):
+        """Acrescenta vetores (normalizados aqui) e persiste em disco."""
+        if not texts:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] != len(texts):
+            raise ValueError("Esperado um vetor por texto.")
+        if self.dim is not None and vectors.shape[1] != self.dim:
+            raise ValueError(f"Dimensão {vectors.shape[1]} diferente do cache ({self.dim}).")
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+
+        hashes = [content_hash(t) for t in texts]
+        if self.vectors is None:
+            self._save(vectors, hashes)
+        else:
+            current = self.vectors[: len(self.hashes)]
+            self._save(np.concatenate([current, vectors]), self.hashes + hashes)
+
+    def matrix(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Matriz (len(texts) x dim) na ordem dos textos. Se a ordem é a mesma
+        do cache, devolve o próprio mmap (sem cópia).
+        """
+        rows = [self.rows[content_hash(t)] for t in texts]
+        if rows == list(range(len(rows))):
+            return self.vectors[: len(rows)]
+        return np.asarray(self.vectors[rows])
+
+    def get_or_embed(self, texts: Sequence[str], embed: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Embeda só os textos novos ou alterados (`embed` recebe a lista e
+        devolve uma matriz) e devolve a matriz de todos, na ordem dada.
+        """
+        new = self.missing(texts)
+        if new:
+            self.add(new, embed(new))
+        return self.matrix(texts)
+
+    def compact(self, keep_texts: Sequence[str], min_dead_ratio: float = 0.0) -> int:
+        """
+        Remove do disco vetores de chunks que não existem mais, se eles
+        passam de `min_dead_ratio` do cache. Devolve quantos foram removidos.
+        """
+        keep = []
+        seen = set()
+        for t in keep_texts:
+            h = content_hash(t)
+            if h in self.rows and h not in seen:
+                seen.add(h)
+                keep.append(h)
+        dead = len(self.hashes) - len(keep)
+        if not dead or dead < min_dead_ratio * len(self.hashes):
+            return 0
+        if not keep:
+            return 0  # corpus vazio (ex: pasta de documentos errada): mantém o cache
+        rows = [self.rows[h] for h in keep]
+        self._save(np.asarray(self.vectors[rows]), keep)
+        return dead
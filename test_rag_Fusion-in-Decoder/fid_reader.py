@@ -0,0 +1,131 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator, List, Sequence, Tuple
+
+import httpx
+
+
+# ======================================
+# Leitura por trecho + fusão (estilo Fusion-in-Decoder)
+# ======================================
+#
+# 1. Cada trecho recuperado é lido separadamente e em paralelo (no máximo
+#    `max_concurrency` chamadas ao LLM ao mesmo tempo): o modelo extrai só a
+#    evidência daquele trecho que responde à pergunta. Prompts curtos, e
+#    `read_max_tokens` limita o tamanho de cada leitura.
+# 2. As evidências são fundidas num prompt final, cuja resposta é enviada
+#    em streaming, token a token.
+#
+# O chamador recebe eventos conforme acontecem:
+#   {"type": "evidence", "rank", "doc_id", "text"}   um por trecho útil, assim que lido
+#   {"type": "token", "text"}                       tokens da resposta final
+#   {"type": "done", "ttft_ms", "total_ms", "passages_used"}
+
+NO_EVIDENCE = "SEM EVIDÊNCIA"
+
+READ_PROMPT = """Você lê UM trecho de protocolo clínico e extrai apenas o que ajuda a responder a pergunta.
+Se o trecho não tiver nada relevante, responda exatamente: {no_evidence}
+
+Pergunta: {question}
+
+=== TRECHO (doc={doc_id}) ===
+{text}
+=== FIM DO TRECHO ===
+
+Evidência (curta, fiel ao texto):"""
+
+FUSION_PROMPT = """Você é um assistente que responde SOMENTE com base nas evidências fornecidas.
+
+Tarefas:
+1. Leia todas as evidências.
+2. Correlacione informações de diferentes documentos.
+3. Responda à pergunta citando de onde veio cada informação.
+
+=== EVIDÊNCIAS ===
+{evidence}
+=== FIM DAS EVIDÊNCIAS ===
+
+Pergunta: {question}
+
+Responda de forma clara e objetiva."""
+
+
+async def generate(client: httpx.AsyncClient, model: str, prompt: str, max_tokens: int = None) -> str:
+    payload = {"model": model, "prompt": prompt, "stream": False}
+    if max_tokens:
+        payload["options"] = {"num_predict": max_tokens}
+    response = await client.post("/generate", json=payload)
+    response.raise_for_status()
+    return response.json().get("response", "").strip()
+
+
+async def stream_generate(client: httpx.AsyncClient, model: str, prompt: str) -> AsyncIterator[str]:
+    """Tokens do /generate com stream=True (NDJSON, uma linha por pedaço)."""
+    payload = {"model": model, "prompt": prompt, "stream": True}
+    async with client.stream("POST", "/generate", json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("response"):
+                yield data["response"]
+            if data.get("done"):
+                break
+
+
+class FiDReader:
+    def __init__(self, base_url: str, model: str, max_concurrency: int = 4,
+                 read_max_tokens: int = 128, timeout: float = 300.0):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.read_max_tokens = read_max_tokens
+        self.timeout = timeout
+
+    async def _read(self, client, sem, question: str, rank: int, chunk) -> Tuple[int, object, str]:
+        prompt = READ_PROMPT.format(no_evidence=NO_EVIDENCE, question=question, doc_id=chunk.doc_id, text=chunk.text)
+        async with sem:
+            text = await generate(client, self.model, prompt, self.read_max_tokens)
+        return rank, chunk, text
+
+    async def stream(self, question: str, retrieved: Sequence[Tuple[object, float]]) -> AsyncIterator[dict]:
+        start = time.perf_counter()
+        limits = httpx.Limits(max_connections=self.max_concurrency + 1, max_keepalive_connections=self.max_concurrency + 1)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits) as client:
+            sem = asyncio.Semaphore(self.max_concurrency)
+            tasks = [
+                asyncio.create_task(self._read(client, sem, question, rank, chunk))
+                for rank, (chunk, _score) in enumerate(retrieved, start=1)
+            ]
+
+            evidence: List[Tuple[int, object, str]] = []
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    rank, chunk, text = await finished
+                    if not text or text.upper().startswith(NO_EVIDENCE):
+                        continue
+                    evidence.append((rank, chunk, text))
+                    yield {"type": "evidence", "rank": rank, "doc_id": chunk.doc_id, "text": text}
+            finally:
+                for t in tasks:
+                    t.cancel()
+
+            # Ordem do ranking de recuperação, não de chegada
+            evidence.sort(key=lambda e: e[0])
+            block = "\n".join(f"[Evidência {rank} | doc={chunk.doc_id}]\n{text}\n" for rank, chunk, text in evidence)
+            prompt = FUSION_PROMPT.format(evidence=block or "(nenhuma)", question=question)
+
+            ttft_ms = None
+            async for token in stream_generate(client, self.model, prompt):
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000.0
+                yield {"type": "token", "text": token}
+
+        yield {
+            "type": "done",
+            "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+            "total_ms": round((time.perf_counter() - start) * 1000.0, 1),
+            "passages_used": len(evidence),
+        }
@@ -0,0 +1,119 @@
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from retrieval import top_k
+
+
+# ======================================
+# Tokenização para português clínico
+# ======================================
+#
+# - minúsculas e sem acento ("epinefrína" == "epinefrina", "criança" == "crianca")
+# - números com vírgula ou ponto decimal viram o mesmo token ("0,01" == "0.01")
+# - unidades compostas ficam juntas ("mg/kg", "ml/h")
+# - plural simples (-s) removido em palavras longas ("criancas" -> "crianca")
+# - stopwords comuns fora
+
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de da do das dos em na no nas nos por para com sem
+e ou que se ao aos ser qual quais como mais menos muito sua seu suas seus
+""".split())
+
+_TOKEN_RE = re.compile(r"\d+(?:[.,]\d+)*|[a-z]+(?:/[a-z]+)?")
+
+
+def fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for tok in _TOKEN_RE.findall(fold(text)):
+        if tok[0].isdigit():
+            tokens.append(tok.replace(".", ","))
+            continue
+        if tok in STOPWORDS:
+            continue
+        if len(tok) > 4 and tok.endswith("s") and "/" not in tok:
+            tok = tok[:-1]
+        tokens.append(tok)
+    return tokens
+
+
+# ======================================
+# Índice invertido BM25
+# ======================================
+
+class BM25Index:
+    """
+    Índice invertido em memória: para cada termo, arrays com os chunks que o
+    contêm e a frequência em cada um. A busca só percorre as listas dos
+    termos da consulta (não toca nos chunks sem nenhum termo em comum).
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_docs = 0
+        self.doc_norm = None  # k1 * (1 - b + b * len/avg_len), fixo por chunk
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.idf: Dict[str, float] = {}
+
+    def build(self, texts: Sequence[str]) -> "BM25Index":
+        docs_by_term = defaultdict(list)
+        tfs_by_term = defaultdict(list)
+        lengths = []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                docs_by_term[term].append(doc_id)
+                tfs_by_term[term].append(tf)
+
+        self.n_docs = len(texts)
+        doc_len = np.asarray(lengths, dtype=np.float32)
+        avg_len = max(float(doc_len.mean()), 1e-9) if self.n_docs else 1.0
+        self.doc_norm = self.k1 * (1.0 - self.b + self.b * doc_len / avg_len)
+        self.postings = {
+            term: (np.asarray(docs, dtype=np.int32), np.asarray(tfs_by_term[term], dtype=np.float32))
+            for term, docs in docs_by_term.items()
+        }
+        self.idf = {
+            term: math.log(1.0 + (self.n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, (docs, _) in self.postings.items()
+        }
+        return self
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (índices, scores) só entre chunks com algum termo da consulta."""
+        terms = [t for t in set(tokenize(query)) if t in self.postings]
+        if not terms or self.n_docs == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in terms:
+            docs, tf = self.postings[term]
+            scores[docs] += self.idf[term] * tf * (self.k1 + 1.0) / (tf + self.doc_norm[docs])
+
+        matched = np.flatnonzero(scores)
+        best = top_k(scores[matched], k)
+        return matched[best], scores[matched[best]]
+
+
+# ======================================
+# Fusão de rankings
+# ======================================
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """RRF: score(d) = soma de 1 / (k + posição de d em cada ranking)."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for pos, doc in enumerate(ranking, start=1):
+            scores[int(doc)] += 1.0 / (k + pos)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,110 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# ======================================
+# Cliente de embeddings em lote
+# ======================================
+#
+# O /api/embed do Ollama aceita uma lista em "input". Em vez de uma
+# requisição por chunk, os textos são agrupados em lotes de `batch_size` e os
+# lotes são enviados por até `max_workers` threads, reaproveitando conexões
+# (keep-alive) de uma única Session. Falhas de conexão e respostas
+# 429/5xx são repetidas com backoff exponencial (embedding é idempotente).
+
+
+class EmbeddingClient:
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        batch_size: int = 32,
+        max_workers: int = 4,
+        retries: int = 3,
+        timeout: float = 120.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["POST"]),
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def _embed_batch(self, batch: List[str]) -> np.ndarray:
+        response = self.session.post(
+            f"{self.base_url}/embed",
+            json={"model": self.model, "input": batch},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        embs = response.json()["embeddings"]
+        if len(embs) != len(batch):
+            raise ValueError(f"Ollama devolveu {len(embs)} embeddings para {len(batch)} textos.")
+        return np.asarray(embs, dtype=np.float32)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Matriz (len(texts) x dim), na ordem dos textos."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.max_workers == 1:
+            return np.vstack([self._embed_batch(b) for b in batches])
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+            return np.vstack(list(pool.map(self._embed_batch, batches)))
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self._embed_batch([text])[0]
+
+
+# ======================================
+# Benchmark (use com stub_ollama.py ou um Ollama real)
+# ======================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara embedding serial x em lote/concorrente.")
+    parser.add_argument("--url", default="http://localhost:11435/api")
+    parser.add_argument("--model", default="embeddinggemma:latest")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    texts = [f"Protocolo {i}: dose pediátrica de referência {i % 97} mg/kg por via oral." for i in range(args.chunks)]
+
+    for label, client in (
+        ("serial (1 texto/requisição)", EmbeddingClient(args.url, args.model, batch_size=1, max_workers=1)),
+        (f"lote={args.batch_size}, workers={args.workers}",
+         EmbeddingClient(args.url, args.model, batch_size=args.batch_size, max_workers=args.workers)),
+    ):
+        start = time.perf_counter()
+        embs = client.embed(texts)
+        elapsed = time.perf_counter() - start
+        client.close()
+        print(f"{label:<32} {elapsed:8.2f}s  ({len(texts) / elapsed:,.0f} chunks/s, dim={embs.shape[1]})")
+
+
+if __name__ == "__main__":
+    main()
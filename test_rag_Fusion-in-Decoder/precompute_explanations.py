@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import importlib.util
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # raiz do projeto (pacote src)
+
+from src.database import DatabaseManager  # noqa: E402
+from src.explanations import CODE_LABELS, applicable_codes, rule_explanation, rule_fingerprint  # noqa: E402
+from src.knowledge_base import cross_reactivity_closure, expand_cross_families  # noqa: E402
+
+
+# ======================================
+# Pré-cálculo offline das explicações de alerta
+# ======================================
+#
+# Para cada (medicamento, código de alerta) que a base pode disparar:
+# recupera trechos de protocolo com o RAG, gera a explicação com leitura por
+# trecho (FiDReader) e grava na tabela explicacao_alerta com a impressão da
+# regra. A API passa a responder /api/alerts/explain direto do cache.
+#
+# Só regenera o que falta ou ficou desatualizado (regra mudou); --force
+# refaz tudo. Rode de novo depois de publicar mudanças na base.
+#
+#   python precompute_explanations.py --protocols ./protocolos --concurrency 4
+
+
+def load_rag_module():
+    # O script principal tem hífen no nome: carrega pelo caminho
+    spec = importlib.util.spec_from_file_location("rag_fid", os.path.join(HERE, "rag_Fusion-in-Decoder.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_protocols(directory: str) -> dict:
+    docs = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".txt", ".md")):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                docs[os.path.splitext(name)[0]] = f.read()
+    return docs
+
+
+async def explain_one(rag, db_manager, drug: dict, code: str, interactions: list, top_k: int) -> dict:
+    label = CODE_LABELS.get(code, code)
+    rule_text, rule_sources = rule_explanation(drug, code, interactions)
+
+    query = f"{drug['nome']} {drug['principio_ativo']} {label}"
+    retrieved = await asyncio.to_thread(rag.retrieve, query, top_k)
+
+    question = (
+        f"Por que o ValidRx dispara o alerta de {label} para {drug['nome']}? "
+        f"Regra cadastrada: {rule_text} Cite o protocolo que fundamenta a regra."
+    )
+    tokens = []
+    async for event in rag.reader.stream(question, retrieved):
+        if event["type"] == "token":
+            tokens.append(event["text"])
+
+    entry = {
+        "text": "".join(tokens).strip() or rule_text,
+        "sources": rule_sources + [
+            {"type": "protocolo", "doc_id": chunk.doc_id, "score": round(score, 4), "excerpt": chunk.text[:500]}
+            for chunk, score in retrieved
+        ],
+        "origin": "rag",
+        "fingerprint": rule_fingerprint(drug, code, interactions),
+    }
+    await asyncio.to_thread(db_manager.save_explanation, drug["id"], code, entry)
+    return entry
+
+
+async def run(args):
+    rag_module = load_rag_module()
+    chunks = rag_module.chunk_documents(load_protocols(args.protocols)) if args.protocols else rag_module.build_corpus()
+    rag = rag_module.OllamaRAG(chunks)
+    rag.build_index()
+
+    db_manager = DatabaseManager()
+    drugs = db_manager.get_all_drugs_dict()
+    interactions = db_manager.get_interactions()
+    # Mesma expansão da base compilada (a impressão das regras depende dela)
+    expand_cross_families(drugs, cross_reactivity_closure(db_manager.get_cross_reactivity()))
+
+    todo = []
+    for drug in drugs.values():
+        if args.drug and drug["id"] not in args.drug:
+            continue
+        for code in applicable_codes(drug, interactions):
+            stored = db_manager.get_explanation(drug["id"], code)
+            if not args.force and stored and stored["fingerprint"] == rule_fingerprint(drug, code, interactions):
+                continue
+            todo.append((drug, code))
+
+    print(f"{len(todo)} explicações a gerar ({len(drugs)} medicamentos na base).")
+    sem = asyncio.Semaphore(args.concurrency)
+    done = 0
+    failed = 0
+    start = time.perf_counter()
+
+    async def worker(drug, code):
+        nonlocal done, failed
+        async with sem:
+            try:
+                await explain_one(rag, db_manager, drug, code, interactions, args.top_k)
+                done += 1
+                print(f"  [{done}/{len(todo)}] {drug['id']} / {code}")
+            except Exception as e:
+                failed += 1
+                print(f"  ERRO {drug['id']} / {code}: {e}")
+
+    await asyncio.gather(*(worker(d, c) for d, c in todo))
+    print(f"Concluído em {time.perf_counter() - start:.1f}s: {done} gravadas, {failed} com erro.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pré-calcula explicações de alerta (RAG) no banco do ValidRx.")
+    parser.add_argument("--protocols", help="diretório com protocolos .txt/.md (padrão: corpus de exemplo)")
+    parser.add_argument("--drug", nargs="*", help="só estes IDs de medicamento")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=2, help="explicações geradas ao mesmo tempo")
+    parser.add_argument("--force", action="store_true", help="regenera mesmo as que estão atualizadas")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,74 @@
-import requests
+import asyncio
+import os
+
 import numpy as np
 from dataclasses import dataclass
 from typing import List, Tuple
 
+from embedding_store import EmbeddingStore
+from fid_reader import FiDReader
+from lexical import BM25Index, reciprocal_rank_fusion
+from ollama_client import EmbeddingClient
+from retrieval import IVFIndex, chunk_text, exact_search
+
 
 # ======================================
 # 1. Configurações
 # ======================================
 
-OLLAMA_URL = "http://localhost:11434/api"
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api")
 
+EMBED_MODEL = "embeddinggemma:latest"
+CHAT_MODEL = "llama3.1:8b"
 
-def ollama_embed(model: str, text: str) -> np.ndarray:
-    """Gera embeddings via Ollama /embed."""
-    payload = {"model": model, "input": text}
+# Cache de embeddings em disco (chave: modelo + sha256 do chunk)
+EMBEDDING_CACHE_DIR = os.getenv(
+    "EMBEDDING_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".embedding_cache"),
+)
 
-    response = requests.post(f"{OLLAMA_URL}/embed", json=payload)
-    response.raise_for_status()
+# Fração de vetores de chunks que saíram do corpus a partir da qual o cache
+# é compactado no fim da indexação (0 = sempre que houver algum)
+EMBEDDING_COMPACT_DEAD_RATIO = float(os.getenv("EMBEDDING_COMPACT_DEAD_RATIO", "0.25"))
 
-    emb = response.json()["embeddings"][0]
-    return np.array(emb, dtype=float)
+# Embeddings em lote: textos por requisição e requisições simultâneas
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "4"))
 
+# Chunking: janela de palavras e sobreposição entre janelas
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "40"))
 
-def ollama_chat(model: str, prompt: str) -> str:
-    """Gera resposta via Ollama /generate sem streaming."""
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False
-    }
+# Acima deste número de chunks a busca usa o índice aproximado (IVF)
+ANN_MIN_CHUNKS = int(os.getenv("ANN_MIN_CHUNKS", "20000"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+
+# Recuperação: "dense" (só embeddings), "lexical" (só BM25, sem chamar o
+# modelo de embedding) ou "hybrid" (BM25 pré-filtra, embeddings reordenam,
+# rankings fundidos por RRF)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+LEXICAL_CANDIDATES = int(os.getenv("LEXICAL_CANDIDATES", "100"))
+
+# Leitura por trecho: chamadas simultâneas ao LLM e tokens por leitura
+READ_MAX_CONCURRENCY = int(os.getenv("READ_MAX_CONCURRENCY", "4"))
+READ_MAX_TOKENS = int(os.getenv("READ_MAX_TOKENS", "128"))
 
-    response = requests.post(f"{OLLAMA_URL}/generate", json=payload)
-    response.raise_for_status()
 
-    data = response.json()
+_embed_clients = {}
 
-    # A resposta correta está SEMPRE aqui
-    return data.get("response", "").strip()
+
+def embedding_client(model: str) -> EmbeddingClient:
+    """Um cliente (sessão HTTP com pool) por modelo, reaproveitado."""
+    if model not in _embed_clients:
+        _embed_clients[model] = EmbeddingClient(
+            OLLAMA_URL, model, batch_size=EMBED_BATCH_SIZE, max_workers=EMBED_MAX_WORKERS
+        )
+    return _embed_clients[model]
+
+
+def ollama_embed(model: str, text: str) -> np.ndarray:
+    """Gera embeddings via Ollama /embed."""
+    return embedding_client(model).embed_one(text)
 
 
 # ======================================
@@ -75,13 +107,19 @@ def build_corpus() -> List[Chunk]:
         """
     }
 
+    return chunk_documents(docs)
+
+
+def chunk_documents(docs: dict) -> List[Chunk]:
+    """Documentos longos viram vários chunks (janelas sobrepostas)."""
     chunks = []
     idx = 0
 
     for doc_id, raw in docs.items():
         clean = " ".join(line.strip() for line in raw.splitlines() if line.strip())
-        chunks.append(Chunk(id=idx, doc_id=doc_id, text=clean))
-        idx += 1
+        for text in chunk_text(clean, CHUNK_MAX_TOKENS, CHUNK_OVERLAP):
+            chunks.append(Chunk(id=idx, doc_id=doc_id, text=text))
+            idx += 1
 
     return chunks
 
@@ -91,66 +129,91 @@ def build_corpus() -> List[Chunk]:
 # ======================================
 
 class OllamaRAG:
-    def __init__(self, chunks: List[Chunk]):
+    def __init__(self, chunks: List[Chunk], store: EmbeddingStore = None):
         self.chunks = chunks
         self.embeddings = None
+        self.ann = None
+        self.bm25 = None
+        self.reader = FiDReader(OLLAMA_URL, CHAT_MODEL, READ_MAX_CONCURRENCY, READ_MAX_TOKENS)
+        self.store = store if store is not None else EmbeddingStore(EMBEDDING_CACHE_DIR, EMBED_MODEL)
 
     def build_index(self):
-        print("Gerando embeddings com embeddinggemma...")
-        embs = []
-        for c in self.chunks:
-            vec = ollama_embed("embeddinggemma:latest", c.text)
-            vec = vec / np.linalg.norm(vec)
-            embs.append(vec)
-        self.embeddings = np.vstack(embs)
-
-    def retrieve(self, query: str, top_k: int = 3) -> List[Tuple[Chunk, float]]:
-        query_emb = ollama_embed("embeddinggemma:latest", query)
+        texts = [c.text for c in self.chunks]
+        self.bm25 = BM25Index().build(texts)
+        if RETRIEVAL_MODE == "lexical":
+            return
+
+        new = self.store.missing(texts)
+        print(f"Embeddings: {len(texts) - len(new)} no cache, {len(new)} a gerar com {EMBED_MODEL}...")
+
+        # Só chunks novos/alterados vão para o modelo (em lotes concorrentes);
+        # o resto vem do mmap
+        if new:
+            self.store.add(new, embedding_client(EMBED_MODEL).embed(new))
+
+        # Chunks alterados ou removidos deixam vetores mortos no cache a cada
+        # reindexação; acima do limite, o cache é regravado só com o corpus atual
+        removed = self.store.compact(texts, min_dead_ratio=EMBEDDING_COMPACT_DEAD_RATIO)
+        if removed:
+            print(f"Cache de embeddings compactado: {removed} vetores antigos removidos.")
+        self.embeddings = self.store.matrix(texts)
+
+        if len(self.chunks) >= ANN_MIN_CHUNKS:
+            print(f"Construindo índice IVF para {len(self.chunks)} chunks...")
+            self.ann = IVFIndex(nprobe=ANN_NPROBE).build(self.embeddings)
+
+    def retrieve(self, query: str, top_k: int = 3, mode: str = None) -> List[Tuple[Chunk, float]]:
+        mode = mode or RETRIEVAL_MODE
+
+        if mode == "lexical":
+            top_idx, scores = self.bm25.search(query, top_k)
+            return [(self.chunks[i], float(s)) for i, s in zip(top_idx, scores)]
+
+        query_emb = ollama_embed(EMBED_MODEL, query)
         query_emb = query_emb / np.linalg.norm(query_emb)
 
-        sims = np.dot(self.embeddings, query_emb)
-        top_idx = sims.argsort()[::-1][:top_k]
-
-        return [(self.chunks[i], float(sims[i])) for i in top_idx]
-
-    def build_prompt(self, question: str, retrieved: List[Tuple[Chunk, float]]) -> str:
-        ctx = ""
-        for i, (chunk, score) in enumerate(retrieved, start=1):
-            ctx += f"\n[Trecho {i} | doc={chunk.doc_id} | score={score:.3f}]\n{chunk.text}\n"
-
-        return f"""
-Você é um assistente que responde SOMENTE com base nos trechos fornecidos.
-
-Tarefas:
-1. Leia todos os trechos.
-2. Correlacione informações de diferentes documentos.
-3. Responda à pergunta citando de onde veio cada informação.
-
-=== CONTEXTO ===
-{ctx}
-=== FIM DO CONTEXTO ===
-
-Pergunta: {question}
-
-Responda de forma clara e objetiva.
-""".strip()
-
-    def answer(self, question: str):
-        retrieved = self.retrieve(question)
-
-        print("\n=== TRECHOS RECUPERADOS ===")
-        for c, s in retrieved:
-            print(f"\n> doc={c.doc_id} (score={s:.3f})")
-            print(c.text)
-
-        prompt = self.build_prompt(question, retrieved)
-
-        print("\n=== PROMPT ENVIADO AO LLM ===")
-        print(prompt)
-
-        print("\n=== RESPOSTA DO MODELO ===\n")
-        answer = ollama_chat("llama3.1:8b", prompt)
-        print(answer)
+        if mode == "hybrid":
+            cand, _ = self.bm25.search(query, LEXICAL_CANDIDATES)
+            # Poucos termos em comum: o BM25 não serve de pré-filtro
+            if len(cand) >= top_k:
+                rows = np.sort(cand)  # leitura em ordem no mmap
+                dense_rank = rows[np.argsort(-(self.embeddings[rows] @ query_emb))]
+                fused = reciprocal_rank_fusion([cand, dense_rank])[:top_k]
+                return [(self.chunks[i], s) for i, s in fused]
+
+        if self.ann is not None:
+            top_idx, scores = self.ann.search(query_emb, top_k)
+        else:
+            top_idx, scores = exact_search(self.embeddings, query_emb, top_k)
+
+        return [(self.chunks[i], float(s)) for i, s in zip(top_idx, scores)]
+
+    async def answer_stream(self, question: str, top_k: int = 3):
+        """Eventos do FiDReader (evidências por trecho, tokens, resumo)."""
+        retrieved = await asyncio.to_thread(self.retrieve, question, top_k)
+        yield {"type": "retrieved", "passages": retrieved}
+        async for event in self.reader.stream(question, retrieved):
+            yield event
+
+    async def answer(self, question: str):
+        answering = False
+        async for event in self.answer_stream(question):
+            if event["type"] == "retrieved":
+                print("\n=== TRECHOS RECUPERADOS ===")
+                for c, s in event["passages"]:
+                    print(f"\n> doc={c.doc_id} (score={s:.3f})")
+                    print(c.text)
+                print("\n=== EVIDÊNCIAS POR TRECHO ===")
+            elif event["type"] == "evidence":
+                print(f"\n[{event['rank']}] doc={event['doc_id']}: {event['text']}")
+            elif event["type"] == "token":
+                if not answering:
+                    print("\n=== RESPOSTA DO MODELO ===\n")
+                    answering = True
+                print(event["text"], end="", flush=True)
+            elif event["type"] == "done":
+                print(f"\n\n(primeiro token em {event['ttft_ms']} ms, total {event['total_ms']} ms, "
+                      f"{event['passages_used']} trechos com evidência)")
 
 
 # ======================================
@@ -168,7 +231,7 @@ def main():
         "e qual alerta de segurança o protocolo menciona?"
     )
 
-    rag.answer(question)
+    asyncio.run(rag.answer(question))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+# ======================================
+# Chunking por janela de tokens
+# ======================================
+
+def chunk_text(text: str, max_tokens: int = 200, overlap: int = 40) -> List[str]:
+    """
+    Quebra o texto em janelas de até `max_tokens` palavras, com `overlap`
+    palavras repetidas entre janelas vizinhas (uma dose não fica separada
+    do medicamento a que se refere só por cair na fronteira).
+    """
+    if overlap >= max_tokens:
+        raise ValueError("overlap precisa ser menor que max_tokens.")
+    words = text.split()
+    if len(words) <= max_tokens:
+        return [" ".join(words)] if words else []
+
+    step = max_tokens - overlap
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + max_tokens]))
+        if start + max_tokens >= len(words):
+            break
+    return chunks
+
+
+# ======================================
+# Top-k
+# ======================================
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Índices dos k maiores scores, em ordem decrescente. argpartition é O(n);
+    só os k escolhidos são ordenados (em vez de ordenar os n scores).
+    """
+    n = scores.shape[0]
+    if k >= n:
+        return np.argsort(-scores)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+def exact_search(vectors: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    sims = vectors @ query
+    idx = top_k(sims, k)
+    return idx, sims[idx]
+
+
+# ======================================
+# Índice aproximado (IVF)
+# ======================================
+
+class IVFIndex:
+    """
+    Inverted file: k-means esférico separa os vetores (normalizados) em
+    `nlist` grupos; a busca só compara a consulta com os vetores dos
+    `nprobe` grupos de centróide mais próximo.
+
+    Os vetores são guardados reordenados por grupo, então cada grupo é uma
+    fatia contígua da matriz (sem cópia por consulta para juntar candidatos).
+    """
+
+    def __init__(self, nlist: int = None, nprobe: int = 8, n_iter: int = 10,
+                 train_size: int = 50_000, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.train_size = train_size
+        self.seed = seed
+
+        self.centroids = None
+        self.vectors = None   # reordenados por grupo
+        self.ids = None       # posição original de cada linha de self.vectors
+        self.offsets = None   # grupo g = linhas offsets[g]:offsets[g+1]
+
+    def build(self, vectors: np.ndarray) -> "IVFIndex":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n = vectors.shape[0]
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(self.seed)
+
+        sample = vectors
+        if n > self.train_size:
+            sample = vectors[rng.choice(n, self.train_size, replace=False)]
+
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            centroids = np.where(empty[:, None], centroids, sums / np.where(norms == 0, 1.0, norms))
+
+        # Atribuição final de todos os vetores, em blocos (limita memória)
+        assign = np.empty(n, dtype=np.int64)
+        for start in range(0, n, 65_536):
+            block = vectors[start:start + 65_536]
+            assign[start:start + block.shape[0]] = np.argmax(block @ centroids.T, axis=1)
+
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        self.centroids = centroids
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.ids = order
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.nlist = nlist
+        return self
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        groups = top_k(self.centroids @ query, nprobe)
+
+        cand_ids, cand_sims = [], []
+        for g in groups:
+            lo, hi = self.offsets[g], self.offsets[g + 1]
+            if lo == hi:
+                continue
+            cand_sims.append(self.vectors[lo:hi] @ query)
+            cand_ids.append(self.ids[lo:hi])
+        if not cand_ids:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        sims = np.concatenate(cand_sims)
+        ids = np.concatenate(cand_ids)
+        best = top_k(sims, k)
+        return ids[best], sims[best]
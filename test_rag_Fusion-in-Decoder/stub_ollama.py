@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+# ======================================
+# Servidor Ollama de mentira (para testes)
+# ======================================
+#
+# Implementa:
+# - POST /api/embed com vetores determinísticos (hashing de palavras, então
+#   textos parecidos têm vetores parecidos) e latência simulada:
+#   `latency_ms` por requisição + `item_ms` por texto do lote.
+# - POST /api/generate (LLM de mentira), com e sem stream: o primeiro token
+#   sai após `ttft_ms` e os seguintes a cada `token_ms`. O texto gerado
+#   repete palavras do trecho/evidências do prompt.
+#
+#   python stub_ollama.py --port 11435 --latency-ms 20 --item-ms 1 --ttft-ms 300 --token-ms 25
+
+
+def _tokens(text: str):
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    return re.findall(r"\w+", folded)
+
+
+def fake_completion(prompt: str, max_tokens: int) -> list:
+    """Tokens (palavras com espaço) de uma resposta plausível para o prompt."""
+    if "=== TRECHO" in prompt:
+        body = prompt.split("===\n", 1)[1].split("\n=== FIM", 1)[0]
+    elif "=== EVIDÊNCIAS ===" in prompt:
+        body = "Segundo as evidências: " + prompt.split("=== EVIDÊNCIAS ===", 1)[1].split("=== FIM", 1)[0]
+    else:
+        body = "Resposta simulada: " + prompt
+    body = " ".join(line for line in body.splitlines() if not line.startswith("["))
+    words = body.split()
+    return [w + " " for w in words[:max_tokens]]
+
+
+def fake_embedding(text: str, dim: int) -> list:
+    vec = np.zeros(dim, dtype=np.float32)
+    for tok in _tokens(text):
+        h = int.from_bytes(hashlib.md5(tok.encode("utf-8")).digest()[:8], "little")
+        vec[h % dim] += 1.0 if (h >> 63) == 0 else -1.0
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec /= norm
+    return vec.tolist()
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # cabeçalho e corpo saem em writes separados
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_generate(self, model: str, tokens: list):
+        cfg = self.server.config
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(cfg["ttft_ms"] / 1000.0)
+        for i, tok in enumerate(tokens):
+            if i:
+                time.sleep(cfg["token_ms"] / 1000.0)
+            self._write_chunk({"model": model, "response": tok, "done": False})
+        self._write_chunk({"model": model, "response": "", "done": True})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, payload: dict):
+        line = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        cfg = self.server.config
+        if self.path == "/api/generate":
+            data = self._read_json()
+            max_tokens = (data.get("options") or {}).get("num_predict") or cfg["max_tokens"]
+            tokens = fake_completion(data.get("prompt", ""), max_tokens)
+            with self.server.stats_lock:
+                self.server.stats["generate_requests"] += 1
+            if data.get("stream", True):
+                self._stream_generate(data.get("model"), tokens)
+            else:
+                time.sleep((cfg["ttft_ms"] + cfg["token_ms"] * max(len(tokens) - 1, 0)) / 1000.0)
+                self._send_json(200, {"model": data.get("model"), "response": "".join(tokens).strip(), "done": True})
+            return
+        if self.path == "/api/embed":
+            data = self._read_json()
+            inputs = data.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            time.sleep((cfg["latency_ms"] + cfg["item_ms"] * len(inputs)) / 1000.0)
+            with self.server.stats_lock:
+                self.server.stats["embed_requests"] += 1
+                self.server.stats["embed_inputs"] += len(inputs)
+            self._send_json(200, {
+                "model": data.get("model"),
+                "embeddings": [fake_embedding(t, cfg["dim"]) for t in inputs],
+            })
+            return
+        self._send_json(404, {"error": f"rota desconhecida: {self.path}"})
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, dim: int = 768,
+                      latency_ms: float = 0.0, item_ms: float = 0.0,
+                      ttft_ms: float = 0.0, token_ms: float = 0.0, max_tokens: int = 64):
+    """
+    Sobe o servidor numa thread daemon e devolve (server, base_url).
+    port=0 escolhe uma porta livre. Pare com server.shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), StubOllamaHandler)
+    server.daemon_threads = True
+    server.config = {
+        "dim": dim, "latency_ms": latency_ms, "item_ms": item_ms,
+        "ttft_ms": ttft_ms, "token_ms": token_ms, "max_tokens": max_tokens,
+    }
+    server.stats = {"embed_requests": 0, "embed_inputs": 0, "generate_requests": 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor Ollama de mentira para testes do RAG.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latência fixa por requisição")
+    parser.add_argument("--item-ms", type=float, default=1.0, help="latência por texto do lote")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="tempo até o primeiro token")
+    parser.add_argument("--token-ms", type=float, default=25.0, help="intervalo entre tokens")
+    parser.add_argument("--max-tokens", type=int, default=64, help="tokens gerados sem num_predict")
+    args = parser.parse_args()
+
+    server, url = start_stub_server(
+        args.host, args.port, args.dim, args.latency_ms, args.item_ms,
+        args.ttft_ms, args.token_ms, args.max_tokens,
+    )
+    print(f"Stub Ollama em {url} (Ctrl+C para sair)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()